@@ -4,13 +4,17 @@ from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 
 from alembic import context
-from app.database import Base
+from app.database import Base, SQL_DATABASE_URL
 from app.models import User, Task
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
+# the database URL comes from the DATABASE_URL environment variable
+# (see app/config.py); alembic.ini only holds the local default.
+config.set_main_option("sqlalchemy.url", SQL_DATABASE_URL)
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -22,6 +26,16 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+
+# Объекты полнотекстового поиска (models.TASK_SEARCH_DDL) создаются через DDL, а не описаны
+# в моделях. Без этого autogenerate предлагал бы их удалить.
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == "table" and name.startswith("tasks_fts"):
+        return False
+    if type_ == "column" and name == "search_vector" or type_ == "index" and name == "ix_tasks_search_vector":
+        return False
+    return True
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -44,6 +58,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -67,7 +82,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_object=include_object
         )
 
         with context.begin_transaction():
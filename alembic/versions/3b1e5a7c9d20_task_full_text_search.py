@@ -0,0 +1,72 @@
+"""task full text search
+
+Revision ID: 3b1e5a7c9d20
+Revises: 49c0f65d658d
+Create Date: 2026-10-18 03:10:41.512310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b1e5a7c9d20'
+down_revision: Union[str, Sequence[str], None] = '49c0f65d658d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# те же объекты, что в models.TASK_SEARCH_DDL на момент этой миграции
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE tasks_fts USING fts5(owner, title, description, content='', prefix='2 3', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+    "INSERT INTO tasks_fts(rowid, owner, title, description) VALUES (new.id, 'u' || new.owner_id, new.title, new.description); "
+    "END",
+    "CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, owner, title, description) "
+    "VALUES ('delete', old.id, 'u' || old.owner_id, old.title, old.description); "
+    "END",
+    "CREATE TRIGGER tasks_fts_update AFTER UPDATE OF owner_id, title, description ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, owner, title, description) "
+    "VALUES ('delete', old.id, 'u' || old.owner_id, old.title, old.description); "
+    "INSERT INTO tasks_fts(rowid, owner, title, description) VALUES (new.id, 'u' || new.owner_id, new.title, new.description); "
+    "END",
+    # задачи, созданные до миграции
+    "INSERT INTO tasks_fts(rowid, owner, title, description) SELECT id, 'u' || owner_id, title, description FROM tasks",
+]
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER tasks_fts_update",
+    "DROP TRIGGER tasks_fts_delete",
+    "DROP TRIGGER tasks_fts_insert",
+    "DROP TABLE tasks_fts",
+]
+# вычисляемая колонка заполняется для существующих строк сама
+POSTGRES_UPGRADE = [
+    "ALTER TABLE tasks ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "to_tsvector('simple', 'u' || owner_id::text) "
+    "|| setweight(to_tsvector('simple', coalesce(title, '')), 'A') "
+    "|| setweight(to_tsvector('simple', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX ix_tasks_search_vector ON tasks USING gin (search_vector)",
+]
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX ix_tasks_search_vector",
+    "ALTER TABLE tasks DROP COLUMN search_vector",
+]
+
+
+def run(statements: dict) -> None:
+    for statement in statements.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    run({"sqlite": SQLITE_UPGRADE, "postgresql": POSTGRES_UPGRADE})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    run({"sqlite": SQLITE_DOWNGRADE, "postgresql": POSTGRES_DOWNGRADE})
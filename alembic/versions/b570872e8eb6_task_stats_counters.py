@@ -0,0 +1,91 @@
+"""task stats counters
+
+Revision ID: b570872e8eb6
+Revises: 3b1e5a7c9d20
+Create Date: 2026-10-18 03:25:00.765412
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b570872e8eb6'
+down_revision: Union[str, Sequence[str], None] = '3b1e5a7c9d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# те же триггеры, что в models.TASK_STATS_DDL на момент этой миграции
+SQLITE_TRIGGERS = [
+    "CREATE TRIGGER task_stats_insert AFTER INSERT ON tasks WHEN new.owner_id IS NOT NULL BEGIN "
+    "INSERT INTO task_stats (owner_id, status, priority, count) "
+    "VALUES (new.owner_id, coalesce(new.status, ''), coalesce(new.priority, ''), 1) "
+    "ON CONFLICT (owner_id, status, priority) DO UPDATE SET count = count + 1; "
+    "END",
+    "CREATE TRIGGER task_stats_delete AFTER DELETE ON tasks WHEN old.owner_id IS NOT NULL BEGIN "
+    "UPDATE task_stats SET count = count - 1 "
+    "WHERE owner_id = old.owner_id AND status = coalesce(old.status, '') AND priority = coalesce(old.priority, ''); "
+    "END",
+    "CREATE TRIGGER task_stats_update AFTER UPDATE OF owner_id, status, priority ON tasks BEGIN "
+    "UPDATE task_stats SET count = count - 1 "
+    "WHERE owner_id = old.owner_id AND status = coalesce(old.status, '') AND priority = coalesce(old.priority, ''); "
+    "INSERT INTO task_stats (owner_id, status, priority, count) "
+    "SELECT new.owner_id, coalesce(new.status, ''), coalesce(new.priority, ''), 1 WHERE new.owner_id IS NOT NULL "
+    "ON CONFLICT (owner_id, status, priority) DO UPDATE SET count = count + 1; "
+    "END",
+]
+POSTGRES_TRIGGERS = [
+    "CREATE FUNCTION task_stats_sync() RETURNS trigger AS $$ BEGIN "
+    "IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.owner_id IS NOT NULL THEN "
+    "UPDATE task_stats SET count = count - 1 "
+    "WHERE owner_id = OLD.owner_id AND status = coalesce(OLD.status, '') AND priority = coalesce(OLD.priority, ''); "
+    "END IF; "
+    "IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.owner_id IS NOT NULL THEN "
+    "INSERT INTO task_stats (owner_id, status, priority, count) "
+    "VALUES (NEW.owner_id, coalesce(NEW.status, ''), coalesce(NEW.priority, ''), 1) "
+    "ON CONFLICT (owner_id, status, priority) DO UPDATE SET count = task_stats.count + 1; "
+    "END IF; "
+    "RETURN NULL; "
+    "END $$ LANGUAGE plpgsql",
+    "CREATE TRIGGER task_stats_sync AFTER INSERT OR DELETE OR UPDATE OF owner_id, status, priority ON tasks "
+    "FOR EACH ROW EXECUTE FUNCTION task_stats_sync()",
+]
+# счетчики для задач, созданных до миграции
+BACKFILL = ("INSERT INTO task_stats (owner_id, status, priority, count) "
+            "SELECT owner_id, coalesce(status, ''), coalesce(priority, ''), count(*) FROM tasks "
+            "WHERE owner_id IS NOT NULL GROUP BY owner_id, coalesce(status, ''), coalesce(priority, '')")
+DROP_TRIGGERS = {
+    "sqlite": ["DROP TRIGGER task_stats_update", "DROP TRIGGER task_stats_delete", "DROP TRIGGER task_stats_insert"],
+    "postgresql": ["DROP TRIGGER task_stats_sync ON tasks", "DROP FUNCTION task_stats_sync()"],
+}
+
+
+def run(statements: dict) -> None:
+    for statement in statements.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('task_stats',
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('priority', sa.String(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('owner_id', 'status', 'priority')
+    )
+    # ### end Alembic commands ###
+    run({"sqlite": SQLITE_TRIGGERS, "postgresql": POSTGRES_TRIGGERS})
+    op.execute(BACKFILL)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    run(DROP_TRIGGERS)
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table('task_stats')
+    # ### end Alembic commands ###
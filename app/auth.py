@@ -1,17 +1,44 @@
-import bcrypt
-from jose import JWTError, jwt
+import asyncio
+import json
+import os
+import threading
+import time
+import concurrent.futures
 from datetime import datetime, timedelta
+from .cache import LRUCache
+from .config import (BCRYPT_ROUNDS, HASH_POOL_KIND, HASH_POOL_WORKERS, HASH_QUEUE_SIZE, JWT_SIGNING_KEYS,
+                     JWT_ACTIVE_KID, JWT_KEYS_FILE, JWT_KEYS_RELOAD_SECONDS, TOKEN_CACHE_SIZE)
 
 
 SECRET_KEY = "api-task-manager-python-project"
 ALGORITHM = "HS256"
 ACESS_TOKEN_EXPIRE_MINUTES = 30
 
-def get_password_hash(password: str) -> str:
+
+# bcrypt и python-jose (вместе с бэкендами криптографии) импортируются при первом хешировании
+# или первой работе с токеном, а не вместе с модулем: так быстрее запускается процесс API.
+# auth.jwt и auth.JWTError доступны как атрибуты модуля, например для except в main.py
+def __getattr__(name: str):
+    if name in ("jwt", "JWTError"):
+        from jose import jwt, JWTError
+        globals().update(jwt=jwt, JWTError=JWTError)
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Загружает модули сразу, не дожидаясь первого запроса (app.server перед fork)
+def preload():
+    import bcrypt  # noqa: F401
+    __getattr__("jwt")
+
+
+def get_password_hash(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    import bcrypt
     # Превращаем строку в последовательность байтов по стандарту utf-8
     pwd_bytes = password.encode('utf-8')
     # Генерируем шум. это случайная строка данных, которая добавляется к паролю перед тем, как он будет зашифрован
-    salt = bcrypt.gensalt()
+    # rounds это стоимость: каждый +1 удваивает время хеширования
+    salt = bcrypt.gensalt(rounds=rounds)
     # Хешируем пароль
     hashed = bcrypt.hashpw(pwd_bytes, salt)
     # Результат bcrypt это байты. Декодируем их в строку, 
@@ -20,6 +47,7 @@ def get_password_hash(password: str) -> str:
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
+    import bcrypt
     # bcrypt.checkpw: Извлекает шум из начала hashed_password.
 # добавляет к plain_password этой же шум и заново его хеширует.
 # Сравнивает полученный результат с тем хэшем, что лежит в базе.
@@ -28,12 +56,171 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         hashed_password.encode('utf-8'))
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    # хеш bcrypt выглядит как $2b$12$..., где 12 это стоимость, с которой он был создан
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+# Очередь на хеширование переполнена, запрос нужно отклонить (в main.py это 503 + Retry-After)
+class HasherBusy(Exception):
+    pass
+
+
+# Выполняется в потоке или процессе пула: сколько операция ждала в очереди и ее результат.
+# time.monotonic у процессов одной машины общий, поэтому время постановки можно передать в процесс.
+def _timed_call(submitted: float, fn, *args):
+    return time.monotonic() - submitted, fn(*args)
+
+
+# bcrypt занимает десятки и сотни миллисекунд процессора. Чтобы вход и регистрация
+# не забирали все потоки сервера, хеширование выполняется в отдельном пуле
+# с ограниченной очередью: если она заполнена, запрос сразу получает отказ, а не копится.
+class PasswordHasher:
+    def __init__(self, kind: str = HASH_POOL_KIND, workers: int = HASH_POOL_WORKERS, queue_size: int = HASH_QUEUE_SIZE):
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+        # одно место = одна операция, которая выполняется или ждет в очереди пула
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+        # функция, которая получает время ожидания в очереди пула (main.py передает его в /metrics)
+        self.observe_wait = None
+
+    def _get_executor(self):
+        # пул создается при первом обращении, а не при импорте модуля
+        with self._lock:
+            if self._executor is None:
+                # модули пулов (и multiprocessing для ProcessPoolExecutor) загружаются только здесь
+                futures = concurrent.futures
+                pool_class = futures.ProcessPoolExecutor if self.kind == "process" else futures.ThreadPoolExecutor
+                self._executor = pool_class(max_workers=self.workers)
+            return self._executor
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    # эндпоинты асинхронные: пока bcrypt работает в пуле, цикл событий обслуживает другие запросы
+    async def _run(self, fn, *args):
+        wait, result = await asyncio.wrap_future(self.submit(_timed_call, time.monotonic(), fn, *args))
+        if self.observe_wait is not None:
+            self.observe_wait(wait)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password, BCRYPT_ROUNDS)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+hasher = PasswordHasher()
+
+
+# kid ключа SECRET_KEY. Токены без kid (выданные до ротации ключей) проверяются этим ключом.
+DEFAULT_KID = "default"
+
+
+def load_signing_keys(spec: str = JWT_SIGNING_KEYS, active_kid: str = JWT_ACTIVE_KID) -> tuple[dict[str, str], str]:
+    if not spec:
+        return {DEFAULT_KID: SECRET_KEY}, active_kid or DEFAULT_KID
+    keys = {}
+    for item in spec.split(","):
+        kid, _, key = item.partition(":")
+        keys[kid.strip()] = key.strip()
+    return keys, active_kid or next(iter(keys))
+
+
+# Подпись и проверка токенов с несколькими ключами. Новые токены подписываются активным ключом,
+# его kid записывается в заголовок токена, а при проверке ключ выбирается по этому kid.
+# Так ключ можно сменить, не отзывая уже выданные токены: старый ключ остается в списке,
+# пока не истекут подписанные им токены.
+# Проверенные claims кэшируются до exp токена, поэтому подпись считается один раз на токен.
+class TokenVerifier:
+    def __init__(self, keys: dict[str, str], active_kid: str, keys_file: str = "",
+                 cache_size: int = TOKEN_CACHE_SIZE, reload_seconds: float = JWT_KEYS_RELOAD_SECONDS):
+        self.cache = LRUCache(maxsize=cache_size)
+        self.keys_file = keys_file
+        self.reload_seconds = reload_seconds
+        self._keys_mtime = None
+        self._checked_at = 0.0
+        self.set_keys(keys, active_kid)
+        if keys_file:
+            self._reload()
+
+    def set_keys(self, keys: dict[str, str], active_kid: str):
+        if active_kid not in keys:
+            raise ValueError(f"Нет ключа подписи с kid '{active_kid}'")
+        self.keys = dict(keys)
+        self.active_kid = active_kid
+        # токены, проверенные удаленным ключом, не должны оставаться действительными через кэш
+        self.cache.clear()
+
+    def _reload(self):
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.keys_file).st_mtime
+        except OSError:
+            # файла нет: продолжаем работать с текущими ключами
+            return
+        if mtime == self._keys_mtime:
+            return
+        with open(self.keys_file) as f:
+            data = json.load(f)
+        self.set_keys(data["keys"], data["active"])
+        self._keys_mtime = mtime
+
+    def _check_keys_file(self):
+        if self.keys_file and time.monotonic() - self._checked_at >= self.reload_seconds:
+            self._reload()
+
+    def encode(self, claims: dict) -> str:
+        from jose import jwt
+        self._check_keys_file()
+        return jwt.encode(claims, self.keys[self.active_kid], algorithm=ALGORITHM, headers={"kid": self.active_kid})
+
+    def decode(self, token: str) -> dict:
+        self._check_keys_file()
+        claims = self.cache.get(token)
+        if claims is not None:
+            return claims
+        from jose import jwt, JWTError
+        kid = jwt.get_unverified_header(token).get("kid", DEFAULT_KID)
+        key = self.keys.get(kid)
+        if key is None:
+            raise JWTError(f"Неизвестный ключ подписи '{kid}'")
+        claims = jwt.decode(token, key, algorithms=ALGORITHM)
+        # кэш отдает запись только до exp, дальше токен снова проверяется и jose вернет ошибку срока
+        self.cache.set(token, claims, expires_at=claims.get("exp"))
+        return claims
+
+
+token_verifier = TokenVerifier(*load_signing_keys(), keys_file=JWT_KEYS_FILE)
+
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire}) 
     # здесь должен быть encode, потому что функция превращает обычный словарь в защищенный токен. Это называется encode.
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = token_verifier.encode(to_encode)
     return encoded_jwt
-
-
@@ -0,0 +1,221 @@
+# кэши приложения: в памяти процесса и, для ответов API, во внешнем хранилище
+
+import json
+import multiprocessing
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from .config import (PRINCIPAL_CACHE_SIZE, RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_SIZE, REDIS_URL,
+                     RESPONSE_CACHE_VERSION_SLOTS)
+
+
+# Ограниченный по размеру кэш с вытеснением давно не использованных записей (LRU)
+# и временем жизни для каждой записи.
+class LRUCache:
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        # OrderedDict помнит порядок: в конце самые "свежие" ключи, в начале кандидаты на вытеснение
+        self._data: OrderedDict = OrderedDict()
+        # эндпоинты выполняются в пуле потоков, поэтому доступ к словарю защищаем блокировкой
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            # expires_at это unix-время, как exp в JWT. None значит "без срока"
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at: float | None = None):
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+# Версии данных пользователей в общей памяти для нескольких процессов API (app/server.py).
+# Память выделяется до fork, поэтому все процессы видят одни и те же ячейки: изменение задач
+# в одном процессе сбрасывает кэш пользователя в остальных. Ячеек меньше, чем пользователей,
+# пользователи с одинаковым owner_id % slots сбрасываются вместе, это лишь лишний промах кэша.
+# Поддерживает те же операции, что словарь версий в MemoryBackend.
+class SharedVersions:
+    def __init__(self, slots: int = RESPONSE_CACHE_VERSION_SLOTS):
+        self._slots = multiprocessing.RawArray("Q", slots)
+
+    def get(self, owner_id: int, default: int = 0) -> int:
+        return self._slots[owner_id % len(self._slots)]
+
+    def __setitem__(self, owner_id: int, version: int):
+        self._slots[owner_id % len(self._slots)] = version
+
+    def clear(self):
+        self._slots[:] = [0] * len(self._slots)
+
+
+# Кэш аутентифицированных пользователей: ключ это sub из токена (email),
+# значение это schemas.CurrentUser. Запись живет PRINCIPAL_CACHE_TTL секунд (config.py),
+# но не дольше, чем токен, который ее положил.
+# Вместе с пользователем хранится версия его id. invalidate увеличивает версию, и запись
+# перестает читаться. После share_versions версии общие для процессов API (app/server.py),
+# поэтому пользователь, деактивированный через один процесс, теряет доступ и во всех остальных.
+class PrincipalCache(LRUCache):
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE):
+        super().__init__(maxsize=maxsize)
+        self._versions: dict[int, int] = {}
+        self._version_lock = threading.Lock()
+
+    def get(self, key):
+        item = super().get(key)
+        if item is None:
+            return None
+        version, user = item
+        if self._versions.get(user.id, 0) != version:
+            # пользователя изменили после того, как он попал в кэш, в этом процессе или в другом
+            self.delete(key)
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return user
+
+    def set(self, key, user, expires_at: float | None = None):
+        super().set(key, (self._versions.get(user.id, 0), user), expires_at=expires_at)
+
+    def invalidate(self, key, user_id: int | None = None):
+        self.delete(key)
+        if user_id is not None:
+            with self._version_lock:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    # Вызывается до запуска процессов API, как MemoryBackend.share_versions
+    def share_versions(self, slots: int = RESPONSE_CACHE_VERSION_SLOTS):
+        self._versions = SharedVersions(slots)
+        self._version_lock = multiprocessing.Lock()
+
+
+principal_cache = PrincipalCache()
+
+
+def invalidate_user(email: str, user_id: int | None = None):
+    # вызывается, когда пользователя удалили, деактивировали или сменили ему email
+    principal_cache.invalidate(email, user_id)
+
+
+# Хранилища для кэша ответов. Ключ ответа включает номер версии данных пользователя,
+# а любое изменение его задач увеличивает версию: старые записи просто перестают читаться
+# и со временем вытесняются или истекают по TTL.
+# Методы асинхронные, чтобы общее хранилище не блокировало цикл событий.
+class MemoryBackend:
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._versions: dict[int, int] = {}
+        self._lock = threading.Lock()
+        # Версии в памяти после перезапуска снова начинаются с 0, а у процессов, запущенных
+        # отдельно (uvicorn --workers), они свои. Случайная эпоха в ключе не дает ETag,
+        # выданному до перезапуска или другим процессом, совпасть с ETag других данных.
+        # Процессы app.server получают эпоху вместе с общими версиями через fork.
+        self.epoch = secrets.token_hex(4)
+
+    async def get(self, key: str):
+        return self._entries.get(key)
+
+    async def set(self, key: str, value, ttl: int):
+        self._entries.set(key, value, expires_at=time.time() + ttl)
+
+    async def version(self, owner_id: int) -> int:
+        return self._versions.get(owner_id, 0)
+
+    async def bump(self, owner_id: int):
+        with self._lock:
+            self._versions[owner_id] = self._versions.get(owner_id, 0) + 1
+
+    # Вызывается до запуска процессов API. Блокировка тоже общая, чтобы одновременный bump
+    # в двух процессах не записал одну и ту же версию дважды
+    def share_versions(self, slots: int = RESPONSE_CACHE_VERSION_SLOTS):
+        self._versions = SharedVersions(slots)
+        self._lock = multiprocessing.Lock()
+
+    def clear(self):
+        self._entries.clear()
+        with self._lock:
+            self._versions.clear()
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+
+# Общее хранилище для нескольких процессов API. client это асинхронный клиент Redis
+# (redis.asyncio.Redis) или любой объект с такими же методами get, set(ex=...) и incr.
+class RedisBackend:
+    def __init__(self, client, prefix: str = "task-manager:"):
+        self.client = client
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        # версии хранятся в Redis и не сбрасываются при перезапуске API
+        self.epoch = ""
+
+    async def get(self, key: str):
+        raw = await self.client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value, ttl: int):
+        await self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=ttl)
+
+    async def version(self, owner_id: int) -> int:
+        return int(await self.client.get(f"{self.prefix}version:{owner_id}") or 0)
+
+    async def bump(self, owner_id: int):
+        await self.client.incr(f"{self.prefix}version:{owner_id}")
+
+    def clear(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def create_response_cache(backend: str = RESPONSE_CACHE_BACKEND):
+    if backend == "off":
+        return None
+    if backend == "redis":
+        # redis нужен только для этого режима, поэтому импортируем его здесь
+        import redis.asyncio
+        return RedisBackend(redis.asyncio.Redis.from_url(REDIS_URL))
+    return MemoryBackend()
+
+
+task_list_cache = create_response_cache()
@@ -1,16 +1,93 @@
-from sqlalchemy import create_engine
+import asyncio
+import contextvars
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 # orm позволяет работать с таблицами базы как с обычными классами python
 # sessionmaker это фабрика по созданию сессий, чтобы не указывать аргументы каждый раз
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy import exc as sa_exc
 from sqlalchemy.ext.declarative import declarative_base
+# асинхронный вариант движка и сессий: эндпоинты не занимают потоки, пока ждут базу
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from .config import (SQLITE_PROFILE, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE, SQLITE_BUSY_TIMEOUT_MS,
+                     SQLITE_WRITE_BATCH, DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+                     DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT_MS)
 
 
-SQL_DATABASE_URL = "sqlite:///.task.db"
+# адрес берется из переменной окружения DATABASE_URL (см. app/config.py)
+SQL_DATABASE_URL = DATABASE_URL
+
+
+# Сколько запросы ждут соединение из пула. Если время растет, пул мал для нагрузки
+# (или база не успевает отдавать соединения).
+class PoolWaitStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"checkouts": self.checkouts, "timeouts": self.timeouts,
+                    "wait_seconds_total": self.wait_seconds_total, "wait_seconds_max": self.wait_seconds_max}
+
+
+pool_stats = PoolWaitStats()
+
+
+# Пулы, которые замеряют время выдачи соединения (ожидание свободного или открытие нового)
+def timed_pool(base):
+    class TimedPool(base):
+        def connect(self):
+            start = time.perf_counter()
+            try:
+                connection = super().connect()
+            except sa_exc.TimeoutError:
+                pool_stats.record(time.perf_counter() - start, timed_out=True)
+                raise
+            pool_stats.record(time.perf_counter() - start)
+            return connection
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+TimedQueuePool = timed_pool(QueuePool)
+TimedAsyncQueuePool = timed_pool(AsyncAdaptedQueuePool)
+
+
+# Параметры движка для адреса базы. is_async выбирает пул и параметры драйвера
+# (у sqlite3, aiosqlite, psycopg2 и asyncpg они называются по-разному).
+def engine_options(url: str, is_async: bool = False) -> dict:
+    if ":memory:" in url:
+        # база в памяти живет внутри одного соединения, пул по умолчанию для нее подходит
+        return {"connect_args": {} if is_async else {"check_same_thread": False}}
+    options = {"poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+               "pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT,
+               "pool_recycle": DB_POOL_RECYCLE, "pool_pre_ping": DB_POOL_PRE_PING}
+    if url.startswith("sqlite"):
+        # {"check_same_thread": False} разрешает разным потокам использовать одно и то же соединение.
+        options["connect_args"] = {"timeout": 30} if is_async else {"check_same_thread": False, "timeout": 30}
+    elif url.startswith("postgresql") and DB_STATEMENT_TIMEOUT_MS:
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
 
 # engine это переменная управления подключением. настраивается 1 раз перед запуском приложения
-engine = create_engine(SQL_DATABASE_URL,
-# {"check_same_thread": False} разрешает разным потокам использовать одно и то же соединение.
-connect_args={"check_same_thread": False, "timeout": 30})
+engine = create_engine(SQL_DATABASE_URL, **engine_options(SQL_DATABASE_URL))
 
 
 # autocommit=False: позволяет объединять несколько действий в одну транзакцию 
@@ -29,12 +106,162 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # каждой колонке и каждом типе данных. через этот чертеж вы даете команду создать таблицы в файле .db
 Base = declarative_base()
 
-# get_db() нужна в эндпоинтах для создания сессии подключения
-def get_db():
-    db = SessionLocal() # Создаем сессию (открываем соединение)
-    try:
-        yield db # Отдаем сессию функции, которой она нужна
-    finally:
-        db.close() # закрываем соединение. finally нужен, если произойдет ошибка, соединение не останется открытым
 
+# Синхронный движок выше нужен alembic и скриптам, эндпоинты работают через асинхронный.
+# Адрес тот же, меняется только драйвер: aiosqlite для SQLite, asyncpg для Postgres.
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def to_async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    # если драйвер уже указан (sqlite+pysqlite), заменяем его
+    return f"{ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{rest}"
+
+
+# Настройки SQLite для продакшена, применяются к каждому новому соединению.
+# WAL: читатели не блокируют писателя и наоборот. synchronous=NORMAL: в режиме WAL
+# fsync выполняется при checkpoint, а не при каждом commit (после сбоя питания можно потерять
+# последние транзакции, но не целостность базы).
+def apply_sqlite_profile(engine, profile: str = SQLITE_PROFILE, writer: bool = False):
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if sync_engine.dialect.name != "sqlite" or profile != "production":
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in ("journal_mode=WAL", "synchronous=NORMAL", f"mmap_size={SQLITE_MMAP_SIZE}",
+                       f"cache_size={SQLITE_CACHE_SIZE}", f"busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+                       "temp_store=MEMORY"):
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+        if writer:
+            # драйвер sqlite3 сам решает, когда начать транзакцию, и не умеет SAVEPOINT в начале.
+            # Писателю транзакции нужны под контролем, поэтому BEGIN отправляем сами (ниже).
+            dbapi_connection.isolation_level = None
+
+    if writer:
+        @event.listens_for(sync_engine, "begin")
+        def begin_immediate(conn):
+            # IMMEDIATE сразу берет блокировку записи, а не при первом INSERT
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
 
+
+apply_sqlite_profile(engine)
+
+async_engine = create_async_engine(to_async_url(SQL_DATABASE_URL), **engine_options(SQL_DATABASE_URL, is_async=True))
+apply_sqlite_profile(async_engine)
+
+# expire_on_commit=False: после commit объекты остаются читаемыми без нового запроса к базе.
+# В асинхронном режиме неявная подгрузка атрибутов невозможна, поэтому это обязательно.
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+# Очередь-писатель для SQLite. В SQLite одновременно пишет только одно соединение, остальные
+# ждут блокировку. Поэтому все записи процесса идут через одно соединение: задания из очереди
+# собираются в пачку, каждое выполняется в своем SAVEPOINT, а вся пачка фиксируется одним commit
+# (group commit). Ошибка одного задания откатывает только его SAVEPOINT.
+class WriteQueue:
+    def __init__(self, session_factory, max_batch: int = SQLITE_WRITE_BATCH):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self._queue = None
+        self._task = None
+        self.commits = 0
+        self.jobs = 0
+
+    def _ensure_started(self):
+        # очередь привязана к циклу событий, в котором ее впервые использовали
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            # пустой контекст: иначе задача унаследует contextvars запроса, который ее запустил
+            # (например, метрики этого запроса), и писала бы в них все последующие записи
+            self._task = loop.create_task(self._run(), context=contextvars.Context())
+
+    # fn(db) выполняется в сессии писателя; результат (или исключение) возвращается после commit
+    async def submit(self, fn):
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, future))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            jobs = [await self._queue.get()]
+            while len(jobs) < self.max_batch and not self._queue.empty():
+                jobs.append(self._queue.get_nowait())
+            # None в очереди это сигнал остановки от close()
+            if None in jobs:
+                stopping = True
+                jobs = [job for job in jobs if job is not None]
+            if jobs:
+                await self._run_batch(jobs)
+
+    async def _run_batch(self, jobs):
+        done = []
+        try:
+            async with self.session_factory() as db:
+                for fn, future in jobs:
+                    if future.cancelled():
+                        continue
+                    try:
+                        async with db.begin_nested():
+                            result = await fn(db)
+                    except Exception as exc:
+                        future.set_exception(exc)
+                    else:
+                        done.append((future, result))
+                await db.commit()
+        except Exception as exc:
+            # commit не удался: ни одно задание пачки не записано
+            for future, _ in done:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        self.commits += 1
+        self.jobs += len(jobs)
+        for future, result in done:
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {"commits": self.commits, "jobs": self.jobs, "queued": self._queue.qsize() if self._queue else 0}
+
+    async def close(self):
+        # задания, которые уже в очереди, будут записаны до остановки
+        if self._task is not None and not self._task.done():
+            await self._queue.put(None)
+            await self._task
+        self._task = None
+
+
+def create_write_queue(url: str, profile: str = SQLITE_PROFILE) -> WriteQueue | None:
+    if not url.startswith("sqlite") or profile != "production":
+        return None
+    # отдельный движок с единственным соединением только для записи; чтение идет через async_engine
+    write_engine = create_async_engine(to_async_url(url), pool_size=1, max_overflow=0,
+                                       connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000})
+    apply_sqlite_profile(write_engine, profile, writer=True)
+    return WriteQueue(async_sessionmaker(write_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False))
+
+
+write_queue = create_write_queue(SQL_DATABASE_URL)
+
+
+# Выполняет изменения в базе и фиксирует их. С очередью-писателем fn выполняется в ее сессии
+# вместе с записями других запросов, без нее в сессии запроса.
+async def run_write(db: AsyncSession, fn):
+    if write_queue is None:
+        result = await fn(db)
+        await db.commit()
+        return result
+    return await write_queue.submit(fn)
+
+
+# get_db() нужна в эндпоинтах для создания сессии подключения
+async def get_db():
+    # async with закрывает сессию, даже если в эндпоинте произошла ошибка
+    async with AsyncSessionLocal() as db:
+        yield db # Отдаем сессию функции, которой она нужна
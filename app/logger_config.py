@@ -1,30 +1,149 @@
+import atexit
+import json
 import logging
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 import colorlog
+from .config import LOG_MODE, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW
 
-def setup_logger():
-    # Создаем обработчик для терминала
-    handler = colorlog.StreamHandler()
-    # Настраиваем цвета для каждого уровня
-    formatter = colorlog.ColoredFormatter(
-        "%(log_color)s%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-        log_colors={
-            'DEBUG':    'cyan',
-            'INFO':     'green',
-            'WARNING':  'yellow',
-            'ERROR':    'red',
-            'CRITICAL': 'bold_red',
+
+# Одна запись лога = одна строка JSON, без цветов: такие строки разбирают сборщики логов
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
         }
-    )
-    handler.setFormatter(formatter)
+        if getattr(record, "suppressed", 0):
+            data["suppressed"] = record.suppressed
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+# Повторяющиеся предупреждения (например, неудачные входы при переборе паролей) не должны
+# заполнять очередь. С одной строки кода пропускается не больше burst записей за окно,
+# а первая запись следующего окна сообщает, сколько было пропущено (поле suppressed).
+class WarningSampler(logging.Filter):
+    def __init__(self, burst: int = LOG_SAMPLE_BURST, window: float = LOG_SAMPLE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        # (logger, файл, строка) -> [начало окна, записей в окне, пропущено в окне]
+        self._windows = {}
+        self.sampled = 0
+
+    def filter(self, record):
+        if record.levelno != logging.WARNING:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.window:
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                window = self._windows[key] = [now, 0, 0]
+            window[1] += 1
+            if window[1] > self.burst:
+                window[2] += 1
+                self.sampled += 1
+                return False
+        return True
+
+
+# QueueHandler, который не ждет, когда очередь заполнена, а отбрасывает запись и считает ее
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # В потоке запроса только подставляем аргументы в сообщение.
+        # Форматирование в JSON и запись в stderr выполняет поток QueueListener.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_queue_handler = None
+_sampler = None
+
+
+# background=False: запись в stderr прямо в вызывающем потоке. Так пишет главный процесс
+# app.server: в нем не должно быть других потоков в момент fork
+def setup_logger(background: bool = True):
+    global _listener, _queue_handler, _sampler
+    stop_logger()
+    if LOG_MODE == "production" and not background:
+        _queue_handler = _sampler = None
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+    elif LOG_MODE == "production":
+        # запись в stderr из отдельного потока, запрос только кладет запись в очередь
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(JsonFormatter())
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _sampler = WarningSampler()
+        _queue_handler = DroppingQueueHandler(log_queue)
+        _queue_handler.addFilter(_sampler)
+        _listener = QueueListener(log_queue, stream_handler)
+        _listener.start()
+        handler = _queue_handler
+    else:
+        _queue_handler = _sampler = None
+        # Создаем обработчик для терминала
+        handler = colorlog.StreamHandler()
+        # Настраиваем цвета для каждого уровня
+        formatter = colorlog.ColoredFormatter(
+            "%(log_color)s%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+            log_colors={
+                'DEBUG':    'cyan',
+                'INFO':     'green',
+                'WARNING':  'yellow',
+                'ERROR':    'red',
+                'CRITICAL': 'bold_red',
+            }
+        )
+        handler.setFormatter(formatter)
 
     # 3. Настраиваем основной логгер
     root_logger = logging.getLogger()
     if root_logger.hasHandlers():
         root_logger.handlers.clear()
     root_logger.addHandler(handler)
-    root_logger.setLevel(logging.INFO)
+    root_logger.setLevel(LOG_LEVEL)
+
+
+def stop_logger():
+    # дописывает записи, которые остались в очереди (вызывается при остановке приложения)
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# поток слушателя фоновый: без этого записи, оставшиеся в очереди при выходе, потеряются
+atexit.register(stop_logger)
+
 
+def log_stats() -> dict:
+    if _queue_handler is None:
+        return {}
+    return {"dropped": _queue_handler.dropped, "sampled": _sampler.sampled, "queued": _queue_handler.queue.qsize()}
 
-# Создаем объект логгера для импорта
-logger = setup_logger()
\ No newline at end of file
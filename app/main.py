@@ -1,148 +1,660 @@
 # файл с эндпоинтами и настройками для запуска программы
 
-from app.logger_config import setup_logger
+from app.logger_config import setup_logger, log_stats
 import logging
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from fastapi import FastAPI, Depends, HTTPException, APIRouter, status, BackgroundTasks
-# Session позволяет работать с базой через объекты класса
-from sqlalchemy.orm import Session
-from app.database import engine, get_db, SessionLocal
-from . import models, schemas, auth
-from jose import JWTError, jwt
+from fastapi import FastAPI, Depends, HTTPException, APIRouter, status, Request, Response, Query, Body
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+# AsyncSession позволяет работать с базой через объекты класса, не блокируя цикл событий
+from sqlalchemy import select, insert, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from app.database import get_db, run_write, write_queue, pool_stats
+from . import models, schemas, auth, notifications, search, stats
+from .cache import principal_cache, task_list_cache, invalidate_user
+from .metrics import metrics, MetricsMiddleware
+from .scheduler import scheduler, utcnow
+from .serializers import FastJSONResponse, dumps, task_dicts, task_response
+from .ratelimit import rate_limiter, limit_by_ip, client_ip, REGISTER_IP_LIMIT, API_IP_LIMIT
+from .config import (HASH_RETRY_AFTER, NOTIFICATION_WORKER, BULK_MAX_ITEMS, RESPONSE_CACHE_TTL, TRUST_TOKEN_CLAIMS,
+                     USER_TASKS_LIMIT, DEADLINE_SCHEDULER, DUE_SOON_SECONDS, PRINCIPAL_CACHE_TTL)
+from pydantic import ValidationError
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import hashlib
+import csv
+import io
+import json
 import time
+from datetime import datetime, timedelta
 
-setup_logger()
 # Создаем логгер именно для этого файла
 logger = logging.getLogger(__name__)
-app = FastAPI(title="Task Manager API")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # логи настраиваются при запуске, а не при импорте: поток записи логов (LOG_MODE=production)
+    # создается в том процессе, который будет обслуживать запросы (см. app/server.py)
+    setup_logger()
+    # воркер оповещений работает в том же процессе, пока запущено API
+    stop = asyncio.Event()
+    worker_task = scheduler_task = None
+    if NOTIFICATION_WORKER == "inline":
+        worker_task = asyncio.create_task(notifications.worker.run(stop))
+    # из нескольких процессов API (app/server.py) планировщик запускается только в одном
+    if DEADLINE_SCHEDULER == "inline" and getattr(app.state, "run_scheduler", True):
+        scheduler_task = asyncio.create_task(scheduler.run(stop))
+    yield
+    stop.set()
+    for task in (worker_task, scheduler_task):
+        if task is not None:
+            await task
+    # записи, которые уже стоят в очереди-писателе, фиксируются до выхода
+    if write_queue is not None:
+        await write_queue.close()
+    auth.hasher.shutdown()
+
+
+app = FastAPI(title="Task Manager API", lifespan=lifespan)
+# время запросов, число SQL запросов и т.д., см. /metrics
+app.add_middleware(MetricsMiddleware)
+# stats() компонентов попадают в /metrics как app_<имя>_<поле>
+metrics.register_collector("principal_cache", principal_cache.stats)
+metrics.register_collector("token_cache", lambda: auth.token_verifier.cache.stats())
+metrics.register_collector("hasher", lambda: {"rejected": auth.hasher.rejected})
+auth.hasher.observe_wait = metrics.record_hasher_wait
+metrics.register_collector("db_pool", pool_stats.stats)
+metrics.register_collector("logging", log_stats)
+metrics.register_collector("rate_limiter", rate_limiter.stats)
+metrics.register_collector("notifications", lambda: notifications.worker.stats())
+metrics.register_collector("deadline_scheduler", scheduler.stats)
+if task_list_cache is not None:
+    metrics.register_collector("task_list_cache", task_list_cache.stats)
+if write_queue is not None:
+    metrics.register_collector("write_queue", write_queue.stats)
+
 router = APIRouter(prefix="/users", tags=["Users"])
-task_router = APIRouter(prefix="/tasks", tags=["Tasks"])
+# лимит на IP для всех маршрутов /tasks (включается API_IP_PER_MINUTE)
+task_router = APIRouter(prefix="/tasks", tags=["Tasks"], dependencies=[Depends(limit_by_ip(API_IP_LIMIT))])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/users/token")
 
 
-def send_high_priority_email(email: str, task_title: str):
-    # Имитируем долгую работу
-    time.sleep(3) 
-    print(f"--- EMAIL SENT to {email} ---")
-    print(f"Notification: New critical task created: '{task_title}'")
-    print("---------------------------------")
+# Пул bcrypt перегружен: лучше сразу попросить клиента повторить запрос,
+# чем держать поток сервера в длинной очереди
+@app.exception_handler(auth.HasherBusy)
+def hasher_busy_handler(request: Request, exc: auth.HasherBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Сервер перегружен, повторите попытку позже"},
+        headers={"Retry-After": str(HASH_RETRY_AFTER)})
+
+
+# Уникальные индексы, нарушение которых - ошибка клиента, а не сервера: по имени индекса
+# (так его называет Postgres) или по колонкам (так пишет SQLite) -> (код ответа, текст)
+UNIQUE_VIOLATIONS = {
+    ("ix_tasks_owner_id_title", "tasks.owner_id, tasks.title"):
+        (status.HTTP_409_CONFLICT, "Задача с таким названием уже существует"),
+    # email проверяется при регистрации заранее, сюда попадает только одновременная регистрация
+    ("ix_users_email", "users.email"): (status.HTTP_400_BAD_REQUEST, "Такой email уже занят"),
+}
+
+
+# Нарушение ограничения в базе. Транзакция к этому моменту откатана. Занятое название задачи
+# или email - ответ клиенту, остальное (внешний ключ, NOT NULL) - ошибка в коде, то есть 500.
+@app.exception_handler(IntegrityError)
+def integrity_error_handler(request: Request, exc: IntegrityError):
+    message = str(exc.orig)
+    for names, (status_code, detail) in UNIQUE_VIOLATIONS.items():
+        if any(name in message for name in names):
+            return JSONResponse(status_code=status_code, content={"detail": detail})
+    logger.error(f"Нарушение ограничения в базе: {request.method} {request.url.path}", exc_info=exc)
+    return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        content={"detail": "Внутренняя ошибка сервера"})
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
-@router.post("/", response_model=schemas.User, summary="регистрация")
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+@router.post("/", response_model=schemas.User, summary="регистрация", dependencies=[Depends(limit_by_ip(REGISTER_IP_LIMIT))])
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     # пытаемся найти пользователя с таким же email
-    existing_user = db.query(models.User).filter(models.User.email == user.email).first()
+    existing_user = await db.scalar(select(models.User).where(models.User.email == user.email))
     if existing_user:
         logger.warning(f"Попытка регистрации на занятый email: {user.email}.")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Такой email уже занят")
-    hashed_pwd = auth.get_password_hash(user.password)
-    db_user = models.User(email = user.email, hashed_password = hashed_pwd)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    hashed_pwd = await auth.hasher.hash(user.password)
+
+    async def write(db: AsyncSession):
+        db_user = models.User(email = user.email, hashed_password = hashed_pwd)
+        db.add(db_user)
+        await db.flush()
+        # у нового пользователя задач еще нет, читать их из базы незачем
+        return schemas.User(id=db_user.id, email=db_user.email, is_active=db_user.is_active, tasks=[])
+    return await run_write(db, write)
+
+
+# Ответ о пользователях по схеме schemas.User. Задачи встраиваются только при include_tasks:
+# одним запросом на всех пользователей (а не по запросу на каждого) и не больше task_limit
+# задач на пользователя. Без include_tasks поле tasks в ответ не попадает.
+async def users_response(db: AsyncSession, users: list[models.User | schemas.CurrentUser], include_tasks: bool = False,
+                         task_limit: int = USER_TASKS_LIMIT) -> list[schemas.User]:
+    result = [schemas.User(id=user.id, email=user.email, is_active=user.is_active) for user in users]
+    if not include_tasks or not users:
+        return result
+    # номер задачи внутри задач владельца, чтобы ограничить их число на каждого пользователя
+    numbered = (select(models.Task, func.row_number().over(partition_by=models.Task.owner_id,
+                                                           order_by=models.Task.id).label("n"))
+                .where(models.Task.owner_id.in_([user.id for user in users]))
+                .subquery())
+    columns = [numbered.c[name] for name in schemas.Task.model_fields]
+    rows = await db.execute(select(*columns).where(numbered.c.n <= task_limit)
+                            .order_by(numbered.c.owner_id, numbered.c.id))
+    tasks = {user.id: [] for user in users}
+    for row in rows.mappings():
+        # без повторной валидации: у сохраненных задач deadline может быть уже в прошлом
+        tasks[row["owner_id"]].append(schemas.Task.model_construct(
+            **{**row, "status": schemas.Status(row["status"]), "priority": schemas.Priority(row["priority"])}))
+    for item in result:
+        item.tasks = tasks[item.id]
+    return result
 
 
 @router.post("/token", summary="получить токен")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
-        logger.warning(f"Пользователь ввел несуществующие в базе данные: {form_data.username}, {form_data.password}.")
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    # лимиты по IP и по логину и блокировка после неудачных попыток проверяются до базы и bcrypt
+    username = form_data.username.lower()
+    await rate_limiter.check_login(client_ip(request), username)
+    user = await db.scalar(select(models.User).where(models.User.email == form_data.username))
+    if not user or not await auth.hasher.verify(form_data.password, user.hashed_password):
+        await rate_limiter.login_failed(username)
+        # пароль в лог не пишем
+        logger.warning(f"Пользователь ввел несуществующие в базе данные: {form_data.username}.")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный логин или пароль") 
-    access_token = auth.create_access_token(data={"sub": user.email})
+    # проверяется после пароля, чтобы по ответу нельзя было узнать о деактивации без пароля
+    if not user.is_active:
+        raise inactive_user()
+    # пароль верный, но хеш создан с другой стоимостью bcrypt: обновляем его, пока знаем пароль
+    if auth.needs_rehash(user.hashed_password):
+        new_hash = await auth.hasher.hash(form_data.password)
+
+        async def write(db: AsyncSession):
+            await db.execute(update(models.User).where(models.User.id == user.id).values(hashed_password=new_hash))
+        await run_write(db, write)
+        # события ORM (models.drop_cached_user_on_update) на UPDATE через Core не срабатывают,
+        # поэтому после изменения строки users кэш сбрасывается явно
+        invalidate_user(user.email, user.id)
+    await rate_limiter.login_succeeded(username)
+    # uid позволяет get_current_user не искать пользователя по email (см. TRUST_TOKEN_CLAIMS)
+    access_token = auth.create_access_token(data={"sub": user.email, "uid": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def inactive_user() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Пользователь деактивирован")
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> schemas.CurrentUser:
     try: 
-        payload = jwt.decode(token, auth.SECRET_KEY, algorithms=auth.ALGORITHM) 
+        # подпись проверяется один раз на токен, дальше claims берутся из кэша до exp
+        payload = auth.token_verifier.decode(token)
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
-    except JWTError:
+    except auth.JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="неправильный токен")
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user 
+    # Сначала смотрим в кэш, чтобы не читать таблицу users на каждый запрос с тем же токеном
+    cached_user = principal_cache.get(email)
+    if cached_user is not None:
+        # в кэш попадают только активные пользователи
+        return cached_user
+    if TRUST_TOKEN_CLAIMS and payload.get("uid") is not None:
+        # id уже есть в подписанном токене, а токены выдаются только активным пользователям
+        current_user = schemas.CurrentUser(id=payload["uid"], email=email, is_active=True)
+    else:
+        user = await db.scalar(select(models.User).where(models.User.email == email))
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        current_user = schemas.CurrentUser.model_validate(user)
+        if not current_user.is_active:
+            raise inactive_user()
+    # запись живет PRINCIPAL_CACHE_TTL секунд, но не дольше exp токена: после него токен все равно
+    # не пройдет проверку
+    expires_at = time.time() + PRINCIPAL_CACHE_TTL
+    if payload.get("exp") is not None:
+        expires_at = min(expires_at, payload["exp"])
+    principal_cache.set(email, current_user, expires_at=expires_at)
+    return current_user 
+
+
+@router.get("/me", response_model=schemas.User, response_model_exclude_unset=True, summary="текущий пользователь")
+async def read_current_user(include_tasks: bool = False,
+                            task_limit: int = Query(100, ge=1, le=USER_TASKS_LIMIT, description="задач в ответе"),
+                            current_user: schemas.CurrentUser = Depends(get_current_user),
+                            db: AsyncSession = Depends(get_db)):
+    return (await users_response(db, [current_user], include_tasks, task_limit))[0]
+
+
+# Вызывается после каждого успешного изменения задач пользователя:
+# сохраненные ответы GET /tasks/{owner_id} для него перестают использоваться,
+# а планировщик дедлайнов перечитывает его задачи
+async def tasks_changed(owner_id: int):
+    if task_list_cache is not None:
+        await task_list_cache.bump(owner_id)
+    scheduler.owner_changed(owner_id)
 
 
 @task_router.post("/", response_model=schemas.TaskResponse, summary="создать задачу")
-def create_task(task: schemas.TaskCreate, background_tasks: BackgroundTasks, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # эта строка превращает схему Pydantic в запись таблицы.
-    new_task = models.Task(**task.model_dump(), owner_id = current_user.id)
-    db.add(new_task)
-    db.commit()
-    db.refresh(new_task)
-    # ПРОВЕРКА: Если приоритет высокий, добавляем задачу в фон
-    if new_task.priority == schemas.Priority.high:
-        background_tasks.add_task(
-            send_high_priority_email, 
-            current_user.email, # Берем email из объекта текущего пользователя
-            new_task.title)
-    return new_task
+async def create_task(task: schemas.TaskCreate, current_user: schemas.CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    async def write(db: AsyncSession):
+        # эта строка превращает схему Pydantic в запись таблицы.
+        new_task = models.Task(**task.model_dump(), owner_id = current_user.id)
+        db.add(new_task)
+        # ПРОВЕРКА: Если приоритет высокий, кладем оповещение в outbox в той же транзакции.
+        # Письмо отправит воркер из app/notifications.py
+        if new_task.priority == schemas.Priority.high:
+            notifications.enqueue_high_priority(db, current_user.email, [new_task.title])
+        await db.flush()
+        await db.refresh(new_task)
+        return new_task
+    new_task = await run_write(db, write)
+    await tasks_changed(current_user.id)
+    # ответ в формате TaskResponse без повторной валидации через pydantic
+    return FastJSONResponse(task_response([getattr(new_task, field) for field in TASK_FIELDS], TASK_FIELDS))
+
+
+def check_batch_size(items: list):
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Не больше {BULK_MAX_ITEMS} элементов в одном запросе")
+
+
+# Проверяет каждый элемент пакета отдельно: ошибка в одном элементе не отменяет остальные.
+# Возвращает список (номер, схема) для корректных элементов и список ошибок.
+def validate_items(items: list, schema):
+    check_batch_size(items)
+    valid, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, schema.model_validate(item)))
+        except ValidationError as exc:
+            # через json(), потому что в errors() могут быть исключения, которые не сериализуются
+            errors.append({"index": index, "detail": json.loads(exc.json(include_url=False))})
+    return valid, errors
+
+
+# Находит id задач пользователя по названиям одним запросом для всего пакета
+# (название уникально у пользователя, поэтому на каждое не больше одной задачи)
+async def task_ids_by_title(db: AsyncSession, owner_id: int, titles: list[str]) -> dict[str, int]:
+    rows = await db.execute(select(models.Task.title, models.Task.id).where(
+        models.Task.owner_id == owner_id, models.Task.title.in_(set(titles))))
+    return dict(rows.all())
+
+
+def not_found_errors(items, found: dict[str, int]):
+    return [{"index": index, "detail": f"Задача с названием '{title}' не найдена"}
+            for index, title in items if title not in found]
+
+
+@task_router.post("/bulk", summary="создать несколько задач")
+async def create_tasks_bulk(items: list[dict] = Body(...), current_user: schemas.CurrentUser = Depends(get_current_user),
+                            db: AsyncSession = Depends(get_db)):
+    valid, errors = validate_items(items, schemas.TaskCreate)
+    if not valid:
+        return {"created": 0, "ids": [], "errors": errors}
+
+    async def write(db: AsyncSession):
+        # названия, которые уже заняты у пользователя или повторяются в самом пакете, не вставляем,
+        # а возвращаем ошибкой для этого элемента
+        existing = await task_ids_by_title(db, current_user.id, [task.title for _, task in valid])
+        seen, new, duplicates = set(existing), [], []
+        for index, task in valid:
+            if task.title in seen:
+                duplicates.append({"index": index, "detail": f"Задача с названием '{task.title}' уже существует"})
+            else:
+                seen.add(task.title)
+                new.append(task)
+        if not new:
+            return [], duplicates
+        rows = [{**task.model_dump(), "owner_id": current_user.id} for task in new]
+        # один INSERT на весь пакет (executemany) и один commit вместо commit на каждую задачу
+        ids = list(await db.scalars(insert(models.Task).returning(models.Task.id, sort_by_parameter_order=True), rows))
+        # одно оповещение на пакет со всеми задачами высокого приоритета
+        high = [task.title for task in new if task.priority == schemas.Priority.high]
+        if high:
+            notifications.enqueue_high_priority(db, current_user.email, high)
+        return ids, duplicates
+    ids, duplicates = await run_write(db, write)
+    if ids:
+        await tasks_changed(current_user.id)
+    errors = sorted(errors + duplicates, key=lambda error: error["index"])
+    return {"created": len(ids), "ids": ids, "errors": errors}
+
+
+# PATCH и DELETE /tasks/bulk совпадают с маршрутами /{title} для задачи с названием "bulk".
+# Пакет всегда передается списком, поэтому запрос с объектом (PATCH) или без тела (DELETE)
+# обрабатывается как запрос к задаче "bulk" по названию.
+@task_router.patch("/bulk", summary="обновить несколько задач по названию")
+async def update_tasks_bulk(items: list[dict] | dict = Body(...), current_user: schemas.CurrentUser = Depends(get_current_user),
+                            db: AsyncSession = Depends(get_db)):
+    if isinstance(items, dict):
+        try:
+            task_data = schemas.TaskUpdate.model_validate(items)
+        except ValidationError as exc:
+            raise RequestValidationError(exc.errors(include_url=False))
+        return await update_task("bulk", task_data, db, current_user)
+    valid, errors = validate_items(items, schemas.TaskBulkUpdate)
+    changes = []
+    for index, item in valid:
+        update_data = item.changes.model_dump(exclude_unset=True, exclude_none=True)
+        if update_data:
+            changes.append((index, item.title, update_data))
+        else:
+            errors.append({"index": index, "detail": "Не указаны поля для обновления"})
+
+    async def write(db: AsyncSession):
+        found = await task_ids_by_title(db, current_user.id, [title for _, title, _ in changes])
+        # новые названия, которые уже заняты у пользователя или повторяются в самом пакете, возвращаем
+        # ошибкой для элемента: иначе уникальный индекс отменил бы UPDATE всего пакета. Название,
+        # которое освобождает другой элемент того же пакета, тоже считается занятым.
+        renames = [update_data["title"] for _, title, update_data in changes
+                   if title in found and update_data.get("title", title) != title]
+        taken = set(await task_ids_by_title(db, current_user.id, renames)) if renames else set()
+        rows, conflicts = [], []
+        for index, title, update_data in changes:
+            if title not in found:
+                continue
+            new_title = update_data.get("title", title)
+            if new_title != title:
+                if new_title in taken:
+                    conflicts.append({"index": index, "detail": f"Задача с названием '{new_title}' уже существует"})
+                    continue
+                taken.add(new_title)
+            rows.append({"id": found[title], **update_data})
+        if rows:
+            # UPDATE по первичному ключу пачкой: SQLAlchemy группирует строки с одинаковым набором полей
+            await db.execute(update(models.Task), rows)
+        return found, len(rows), conflicts
+    found, updated, conflicts = await run_write(db, write)
+    if updated:
+        await tasks_changed(current_user.id)
+    errors += conflicts + not_found_errors([(index, title) for index, title, _ in changes], found)
+    errors.sort(key=lambda error: error["index"])
+    return {"updated": updated, "errors": errors}
+
+
+@task_router.delete("/bulk", summary="удалить несколько задач по названию")
+async def delete_tasks_bulk(titles: list[str] | None = Body(None), current_user: schemas.CurrentUser = Depends(get_current_user),
+                            db: AsyncSession = Depends(get_db)):
+    if titles is None:
+        return await delete_task("bulk", current_user, db)
+    check_batch_size(titles)
+
+    async def write(db: AsyncSession):
+        found = await task_ids_by_title(db, current_user.id, titles)
+        if found:
+            await db.execute(delete(models.Task).where(models.Task.id.in_(found.values())))
+        return found
+    found = await run_write(db, write)
+    if found:
+        await tasks_changed(current_user.id)
+    return {"deleted": len(found), "errors": not_found_errors(enumerate(titles), found)}
+
+
+# Общая часть удаления и обновления одной задачи. condition выбирает задачу (по id или по названию),
+# label описывает ее в сообщениях об ошибках. Чужие задачи не находятся: owner_id всегда в условии.
+# Каждое изменение это один запрос: DELETE/UPDATE ... RETURNING вместо загрузки объекта,
+# изменения и повторного чтения. Если запрос не затронул ни одной строки, задачи нет.
+async def delete_one_task(db: AsyncSession, current_user: schemas.CurrentUser, condition, label: str) -> str:
+    async def write(db: AsyncSession):
+        task_title = await db.scalar(delete(models.Task).where(
+            condition, models.Task.owner_id == current_user.id).returning(models.Task.title).execution_options(
+                synchronize_session=False))
+        # Проверяем, нашлась ли задача
+        if task_title is None:
+            logger.warning(f"Пользователю {current_user.email} было отказано в удалении задачи")
+            raise HTTPException(
+                status_code=404, 
+                detail=f"Задача {label} не найдена или у вас нет прав на её удаление")
+        return task_title
+    task_title = await run_write(db, write)
+    await tasks_changed(current_user.id)
+    return task_title
+
+
+async def update_one_task(db: AsyncSession, current_user: schemas.CurrentUser, condition, label: str, update_data: dict) -> dict:
+    def not_found():
+        logger.warning(f"Пользователю {current_user.email} было отказано в обновлении задачи")
+        return HTTPException(status_code=404, detail=f"Задача {label} не найдена или у вас нет прав на её обновление")
+
+    where = (condition, models.Task.owner_id == current_user.id)
+    if not update_data:
+        # менять нечего, но для отсутствующей задачи по-прежнему отвечаем 404, а не 400
+        if await db.scalar(select(models.Task.id).where(*where)) is None:
+            raise not_found()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Не указаны поля для обновления")
+
+    async def write(db: AsyncSession):
+        # новое название может совпасть с другой задачей: IntegrityError превращается в 409
+        row = (await db.execute(update(models.Task).where(*where).values(**update_data).returning(
+            *models.Task.__table__.columns).execution_options(synchronize_session=False))).first()
+        if row is None:
+            raise not_found()
+        return row._asdict()
+    task = await run_write(db, write)
+    await tasks_changed(current_user.id)
+    return task
+
+
+@task_router.delete("/id/{task_id}", summary="удалить задачу по id")
+async def delete_task_by_id(task_id: int, current_user: schemas.CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # поиск по первичному ключу
+    task_title = await delete_one_task(db, current_user, models.Task.id == task_id, f"с id {task_id}")
+    return {"message": f"Задача '{task_title}' удалена"}
 
 
+@task_router.patch("/id/{task_id}", summary="обновить задачу по id")
+async def update_task_by_id(task_id: int, task_data: schemas.TaskUpdate, db: AsyncSession = Depends(get_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    update_data = task_data.model_dump(exclude_unset=True, exclude_none=True)
+    task = await update_one_task(db, current_user, models.Task.id == task_id, f"с id {task_id}", update_data)
+    return {"message": f"Задача '{task['title']}' успешно обновлена", "updated_fields": list(update_data.keys()), "task": task}
+
+
+# Маршруты по названию оставлены для совместимости со старыми клиентами.
+# Название уникально у пользователя (индекс ix_tasks_owner_id_title), поэтому задача определяется однозначно.
 @task_router.delete("/{title}", summary="удалить задачу по названию")
-def delete_task(title: str, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Поиск задачи по названию и owner_id
-    task_to_delete = db.query(models.Task).filter(
-        models.Task.title == title,  # Ищем по названию
-        models.Task.owner_id == current_user.id ).first()
-                            # Только свои задачи
-    # Проверяем, нашлась ли задача
-    if not task_to_delete:
-        logger.warning(f"Пользователю {current_user.email} было отказано в удалении задачи")
-        raise HTTPException(
-            status_code=404, 
-            detail=f"Задача с названием '{title}' не найдена или у вас нет прав на её удаление")
-    # Сохраняем название перед удалением для сообщения, 
-    # так как после commit объект станет недоступен
-    task_title = task_to_delete.title
-    db.delete(task_to_delete)
-    db.commit()
+async def delete_task(title: str, current_user: schemas.CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    task_title = await delete_one_task(db, current_user, models.Task.title == title, f"с названием '{title}'")
     return {"message": f"Задача '{task_title}' удалена"}
 
 
 @task_router.patch("/{title}", summary="обновить задачу по названию")
-def update_task(title: str, task_data: schemas.TaskUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    # Получаем объект из базы
-    db_task = db.query(models.Task).filter(models.Task.title == title, models.Task.owner_id == current_user.id).first()
-    if not db_task:
-        logger.warning(f"Пользователю {current_user.email} было отказано в обновлении задачи")
-        raise HTTPException(status_code=404, detail=f"Задача с названием '{title}' не найдена или у вас нет прав на её обновление")
+async def update_task(title: str, task_data: schemas.TaskUpdate, db: AsyncSession = Depends(get_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
     # превращаем схему в словарь, исключая те поля, которые не были переданы в запросе и поля, значение которых None
     update_data = task_data.model_dump(exclude_unset=True, exclude_none=True)
-    if not update_data:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Не указаны поля для обновления")
-    for key, value in update_data.items():
-        # функция обновления атрибутов
-        setattr(db_task, key, value) # Обновляем только пришедшие поля
-    db.commit()
-    db.refresh(db_task)
-    return {"message": f"Задача '{title}' успешно обновлена", "updated_fields": list(update_data.keys()), "task": db_task}
+    task = await update_one_task(db, current_user, models.Task.title == title, f"с названием '{title}'", update_data)
+    return {"message": f"Задача '{title}' успешно обновлена", "updated_fields": list(update_data.keys()), "task": task}
 
 
-@task_router.get("/{owner_id}", summary="просмотр задач с фильтрацией")
-def get_task(title: str|None = None, priority: schemas.Priority|None = None, status: schemas.Status|None = None, db: Session = Depends(get_db),
-                 current_user: models.User = Depends(get_current_user)):
-    query = db.query(models.Task).filter(models.Task.owner_id == current_user.id)
+# поля задачи в ответах: их можно запросить через fields= и они же идут в выгрузку
+TASK_FIELDS = list(schemas.TaskResponse.model_fields)
+
+
+# Общие фильтры для просмотра и выгрузки задач: только свои задачи плюс необязательные условия
+def filter_tasks(query, owner_id: int, title: str|None, priority: schemas.Priority|None, status: schemas.Status|None):
+    query = query.where(models.Task.owner_id == owner_id)
     if title:
-        query = query.filter(models.Task.title == title)
+        query = query.where(models.Task.title == title)
     if priority:
-        query = query.filter(models.Task.priority == priority)
+        query = query.where(models.Task.priority == priority)
     if status:
-        query = query.filter(models.Task.status == status)
-    tasks = query.all()
-    return tasks
+        query = query.where(models.Task.status == status)
+    return query
+
+
+# сколько строк выгрузки собирается в один кусок ответа
+EXPORT_CHUNK_ROWS = 1000
+
+
+def export_value(value):
+    # datetime выводим так же, как в JSON ответах get_task
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def export_rows(db: AsyncSession, query, format: str):
+    # stream() читает результат порциями по yield_per строк (на Postgres через серверный курсор),
+    # поэтому в памяти одновременно находится только одна порция, а не весь список
+    result = await db.stream(query.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(TASK_FIELDS)
+        async for chunk in result.partitions():
+            writer.writerows([export_value(value) for value in row] for row in chunk)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    else:
+        async for chunk in result.partitions():
+            yield "".join(json.dumps(dict(zip(TASK_FIELDS, map(export_value, row))), ensure_ascii=False) + "\n" for row in chunk)
+
+
+# Поиск по словам в title и description (app/search.py), лучшие совпадения первыми.
+# Следующая страница запрашивается с cursor из заголовка X-Next-Cursor.
+@task_router.get("/search", summary="полнотекстовый поиск задач")
+async def search_tasks(request: Request, q: str = Query(..., min_length=1, max_length=200, description="слова запроса, слово* ищет по префиксу"),
+                       limit: int = Query(20, ge=1, le=100, description="задач на странице"),
+                       cursor: str|None = Query(None, description="значение X-Next-Cursor из предыдущего ответа"),
+                       db: AsyncSession = Depends(get_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    rows, next_cursor = await search.search_tasks(db, current_user.id, q, TASK_FIELDS, limit, cursor)
+    return task_list_response(request, dumps(task_dicts(rows, TASK_FIELDS)), {}, next_cursor)
+
+
+# Невыполненные задачи с дедлайном в ближайшие within секунд, ближайшие первыми.
+# Оба запроса читают диапазон индекса ix_tasks_owner_id_deadline.
+@task_router.get("/due", summary="задачи, которые скоро истекают")
+async def get_due_tasks(within: int = Query(DUE_SOON_SECONDS, ge=1, le=366 * 24 * 3600, description="секунд до дедлайна"),
+                        limit: int = Query(100, ge=1, le=1000, description="задач в ответе"),
+                        db: AsyncSession = Depends(get_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    now = utcnow()
+    return await deadline_tasks(db, current_user.id, limit, models.Task.deadline > now,
+                                models.Task.deadline <= now + timedelta(seconds=within))
+
+
+@task_router.get("/overdue", summary="просроченные задачи")
+async def get_overdue_tasks(limit: int = Query(100, ge=1, le=1000, description="задач в ответе"),
+                            db: AsyncSession = Depends(get_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    return await deadline_tasks(db, current_user.id, limit, models.Task.deadline <= utcnow())
+
+
+async def deadline_tasks(db: AsyncSession, owner_id: int, limit: int, *conditions):
+    columns = [getattr(models.Task, field) for field in TASK_FIELDS]
+    query = (select(*columns).where(models.Task.owner_id == owner_id, *conditions,
+                                    models.Task.status != schemas.Status.completed)
+             .order_by(models.Task.deadline, models.Task.id).limit(limit))
+    return FastJSONResponse(task_dicts((await db.execute(query)).all(), TASK_FIELDS))
+
+
+# Количество задач по статусу и приоритету из счетчиков task_stats и число просроченных (app/stats.py)
+@task_router.get("/stats", summary="статистика задач пользователя")
+async def get_task_stats(db: AsyncSession = Depends(get_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    return FastJSONResponse(await stats.task_stats(db, current_user.id))
+
+
+@task_router.get("/export", summary="выгрузка всех задач в NDJSON или CSV")
+async def export_tasks(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), title: str|None = None,
+                       priority: schemas.Priority|None = None, status: schemas.Status|None = None,
+                       db: AsyncSession = Depends(get_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    columns = [getattr(models.Task, field) for field in TASK_FIELDS]
+    query = filter_tasks(select(*columns), current_user.id, title, priority, status).order_by(models.Task.id)
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(export_rows(db, query, format), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="tasks.{format}"'})
+
+
+# Курсор для постраничного вывода: id последней выданной задачи в base64.
+# Для клиента это непрозрачная строка, которую он возвращает в параметре cursor.
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+
+
+def task_list_response(request: Request, body: bytes, headers: dict, next_cursor: str|None) -> Response:
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@task_router.get("/{owner_id}", summary="просмотр задач с фильтрацией")
+async def get_task(request: Request, title: str|None = None, priority: schemas.Priority|None = None, status: schemas.Status|None = None,
+                 limit: int = Query(100, ge=1, le=1000, description="задач на странице"),
+                 cursor: str|None = Query(None, description="значение X-Next-Cursor из предыдущего ответа"),
+                 fields: str|None = Query(None, description="поля через запятую, например id,title,status"),
+                 db: AsyncSession = Depends(get_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    selected = TASK_FIELDS
+    if fields:
+        selected = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = set(selected) - set(TASK_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(sorted(unknown))}")
+
+    # Ключ кэша: все параметры, от которых зависит ответ, и версия данных пользователя
+    # (с эпохой хранилища версий, см. cache.MemoryBackend). Из него же получается ETag,
+    # поэтому повторный запрос с If-None-Match получает 304 без обращения к базе.
+    headers = {}
+    cache_key = None
+    if task_list_cache is not None:
+        version = await task_list_cache.version(current_user.id)
+        cache_key = f"tasks:{current_user.id}:{task_list_cache.epoch}{version}:{title}:{priority}:{status}:{limit}:{cursor}:{','.join(selected)}"
+        etag = f'W/"{hashlib.sha1(cache_key.encode()).hexdigest()}"'
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers={"ETag": etag})
+        headers["ETag"] = etag
+        cached = await task_list_cache.get(cache_key)
+        if cached is not None:
+            body, next_cursor = cached
+            return task_list_response(request, body.encode(), headers, next_cursor)
+
+    # Выбираем только нужные колонки, а не целые объекты models.Task.
+    # id нужен всегда: по нему строится курсор следующей страницы, поэтому он идет в конце выборки.
+    columns = [getattr(models.Task, field) for field in selected]
+    query = filter_tasks(select(*columns, models.Task.id), current_user.id, title, priority, status)
+    # Keyset-пагинация: продолжаем после последнего id вместо OFFSET,
+    # поэтому каждая страница стоит одинаково, сколько бы задач ни было у пользователя
+    if cursor:
+        query = query.where(models.Task.id > decode_cursor(cursor))
+    # одна лишняя строка показывает, есть ли следующая страница
+    rows = (await db.execute(query.order_by(models.Task.id).limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][-1])
+    # Словари строятся прямо из кортежей колонок и сразу кодируются в JSON.
+    # В кэше хранится готовое тело ответа: при попадании его не нужно кодировать заново.
+    body = dumps(task_dicts(rows, selected))
+    if cache_key is not None:
+        await task_list_cache.set(cache_key, [body.decode(), next_cursor], RESPONSE_CACHE_TTL)
+    return task_list_response(request, body, headers, next_cursor)
 
 
 app.include_router(router)
 app.include_router(task_router)
 if __name__ == "__main__":
     import uvicorn
-    # Запускаем сервер: 'app.main' это путь к модулю, 'app' это имя переменной FastAPI
+    # Сервер для разработки: один процесс, перезапуск при изменении кода.
+    # В продакшене API запускается через python -m app.server (app/server.py).
+    # 'app.main' это путь к модулю, 'app' это имя переменной FastAPI
     uvicorn.run("app.main:app", host="127.0.0.1", port=8000, reload=True)
-    
 
 
@@ -0,0 +1,212 @@
+# метрики запросов: время по маршрутам, запросы к базе, ожидание пула bcrypt.
+# Отдаются на /metrics в текстовом формате Prometheus.
+
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+import anyio.to_thread
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .config import SLOW_REQUEST_SECONDS, SLOW_REQUEST_MAX_STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+# границы корзин гистограмм, как у стандартных клиентов Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def samples(self, name: str, labels: str):
+        # в формате Prometheus корзины накопительные: le="0.1" включает все меньшие значения
+        cumulative = 0
+        separator = "," if labels else ""
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+# Статистика одного запроса. Лежит в contextvar, поэтому события базы, которые происходят
+# во время обработки запроса, попадают в его счетчики.
+class RequestStats:
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.log: list[tuple[str, float]] = []
+
+    def record(self, statement: str, seconds: float):
+        self.statements += 1
+        self.sql_seconds += seconds
+        if len(self.log) < SLOW_REQUEST_MAX_STATEMENTS:
+            self.log.append((statement, seconds))
+
+
+current_request: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar("current_request", default=None)
+
+
+class Metrics:
+    def __init__(self):
+        # события базы и пул потоков приходят из разных потоков
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = defaultdict(int)                                       # (method, route, status)
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))         # (method, route)
+        self.statements = defaultdict(lambda: Histogram(STATEMENT_BUCKETS))    # (method, route)
+        self.sql_seconds = defaultdict(float)                                  # (method, route)
+        self.sql_total = 0
+        self.sql_seconds_total = 0.0
+        self.hasher_wait = Histogram(LATENCY_BUCKETS)
+        self.slow_requests = 0
+        # имя -> функция, возвращающая словарь чисел (stats() кэшей, воркеров, пула соединений)
+        self.collectors = {}
+
+    def register_collector(self, name: str, collect):
+        self.collectors[name] = collect
+
+    def record_statement(self, seconds: float):
+        with self._lock:
+            self.sql_total += 1
+            self.sql_seconds_total += seconds
+
+    def record_hasher_wait(self, seconds: float):
+        with self._lock:
+            self.hasher_wait.observe(seconds)
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        with self._lock:
+            self.requests[(method, route, status)] += 1
+            self.latency[(method, route)].observe(seconds)
+            self.statements[(method, route)].observe(stats.statements)
+            self.sql_seconds[(method, route)] += stats.sql_seconds
+
+    def render(self) -> str:
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            header("http_requests_total", "counter", "Запросы по маршруту и коду ответа")
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+            header("http_request_duration_seconds", "histogram", "Время обработки запроса")
+            for (method, route), histogram in sorted(self.latency.items()):
+                lines.extend(histogram.samples("http_request_duration_seconds", f'method="{method}",route="{route}"'))
+            header("http_requests_in_flight", "gauge", "Запросы, которые обрабатываются сейчас")
+            lines.append(f"http_requests_in_flight {self.in_flight}")
+            header("http_slow_requests_total", "counter", "Запросы дольше SLOW_REQUEST_SECONDS")
+            lines.append(f"http_slow_requests_total {self.slow_requests}")
+            header("http_request_sql_statements", "histogram", "SQL запросов на один HTTP запрос")
+            for (method, route), histogram in sorted(self.statements.items()):
+                lines.extend(histogram.samples("http_request_sql_statements", f'method="{method}",route="{route}"'))
+            header("http_request_sql_seconds_total", "counter", "Время SQL запросов по маршруту")
+            for (method, route), seconds in sorted(self.sql_seconds.items()):
+                lines.append(f'http_request_sql_seconds_total{{method="{method}",route="{route}"}} {seconds}')
+            header("db_statements_total", "counter", "Все SQL запросы процесса, включая фоновые")
+            lines.append(f"db_statements_total {self.sql_total}")
+            header("db_statement_seconds_total", "counter", "Время всех SQL запросов процесса")
+            lines.append(f"db_statement_seconds_total {self.sql_seconds_total}")
+            header("hasher_wait_seconds", "histogram", "Ожидание свободного потока или процесса пула bcrypt")
+            lines.extend(self.hasher_wait.samples("hasher_wait_seconds", ""))
+
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        header("threadpool_threads_busy", "gauge", "Занятые потоки пула")
+        lines.append(f"threadpool_threads_busy {limiter.borrowed_tokens}")
+        header("threadpool_threads_total", "gauge", "Размер пула потоков")
+        lines.append(f"threadpool_threads_total {limiter.total_tokens}")
+        # числовые значения из stats() компонентов, например app_principal_cache_hits
+        for component, collect in self.collectors.items():
+            for key, value in collect().items():
+                if isinstance(value, (int, float)):
+                    name = f"app_{component}_{key}"
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# События всех движков SQLAlchemy (синхронных и асинхронных), включая движок очереди-писателя
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["metrics_query_start"].pop()
+    metrics.record_statement(seconds)
+    stats = current_request.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(context):
+    # запрос завершился ошибкой и after_cursor_execute не будет вызван
+    if context.connection is not None and context.connection.info.get("metrics_query_start"):
+        context.connection.info["metrics_query_start"].pop()
+
+
+# ASGI middleware: время запроса до отправки последней части ответа (для потоковой выгрузки тоже)
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with metrics._lock:
+            metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - start
+            with metrics._lock:
+                metrics.in_flight -= 1
+            current_request.reset(token)
+            # шаблон маршрута (/tasks/{owner_id}), а не конкретный путь, чтобы не плодить метки
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.record_request(scope["method"], route, status_code, seconds, stats)
+            if seconds >= SLOW_REQUEST_SECONDS:
+                log_slow_request(scope, status_code, seconds, stats)
+
+
+def log_slow_request(scope, status_code: int, seconds: float, stats: RequestStats):
+    with metrics._lock:
+        metrics.slow_requests += 1
+    statements = "\n".join(f"  {sql_seconds * 1000:.1f} ms: {statement}" for statement, sql_seconds in stats.log)
+    logger.warning(f"Медленный запрос {scope['method']} {scope['path']} -> {status_code}: {seconds * 1000:.1f} ms, "
+                   f"SQL: {stats.statements} запросов, {stats.sql_seconds * 1000:.1f} ms\n{statements}")
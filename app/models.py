@@ -2,11 +2,13 @@
 
 # типы данных для столбцов. ForeignKey это ограничение на уровне базы. 
 # Оно связывает строку одной таблицы со строкой в другой (например, задачу с её автором).
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, DateTime, Index
 # relationship — это инструмент sqlalchemy.orm, который позволяет удобно работать со связанными данными как с объектами Python 
 # (например, сразу получить список объектов задач через user.tasks)
 from sqlalchemy.orm import relationship
+from sqlalchemy import event, inspect, DDL
 from .database import Base
+from .cache import invalidate_user
 from datetime import datetime, timedelta
 
 
@@ -25,7 +27,9 @@ class User(Base):
     # cascade="all: Если удалить пользователя, SQLAlchemy удалит и все его задачи
     # cascade="delete-orphan: Если удалить задачу из списка задач пользователя,
     # SQLAlchemy не просто отвяжет её, а удалит её из базы данных.
-    tasks = relationship("Task", back_populates="owner", cascade="all, delete-orphan")
+    # lazy="raise_on_sql": задачи не подгружаются неявно при обращении к user.tasks (по запросу на
+    # каждого пользователя), их нужно загрузить заранее, см. users_response в main.py
+    tasks = relationship("Task", back_populates="owner", cascade="all, delete-orphan", lazy="raise_on_sql")
 
 
 class Task(Base):
@@ -38,4 +42,145 @@ class Task(Base):
     deadline =  Column(DateTime)
     # ForeignKey("users.id") значит, что при создании задачи, owner_id равен id пользователя
     owner_id = Column(Integer, ForeignKey("users.id")) 
-    owner = relationship("User", back_populates="tasks")
\ No newline at end of file
+    owner = relationship("User", back_populates="tasks")
+    # Составные индексы под фильтры эндпоинтов: все запросы к задачам идут с owner_id,
+    # поэтому он стоит первым. Без них список задач пользователя читает всю таблицу.
+    __table_args__ = (
+        # Название задачи уникально у пользователя: по нему работают маршруты-псевдонимы
+        # /tasks/{title} и get_task(title=...), и каждый раз находится ровно одна задача
+        Index("ix_tasks_owner_id_title", "owner_id", "title", unique=True),
+        # get_task с фильтрами status и priority
+        Index("ix_tasks_owner_id_status_priority", "owner_id", "status", "priority"),
+        # постраничный вывод get_task: задачи пользователя уже упорядочены по id внутри индекса
+        Index("ix_tasks_owner_id_id", "owner_id", "id"),
+        # задачи пользователя, которые скоро истекают или уже просрочены (/tasks/due, /tasks/overdue)
+        Index("ix_tasks_owner_id_deadline", "owner_id", "deadline"),
+        # ближайшие дедлайны всех пользователей для планировщика из app/scheduler.py
+        Index("ix_tasks_deadline", "deadline"),
+    )
+
+
+# Счетчики задач пользователя по статусу и приоритету для /tasks/stats (app/stats.py).
+# Их обновляют триггеры на tasks в той же транзакции, что и саму задачу, поэтому
+# статистика не требует GROUP BY по всем задачам и учитывает пакетные изменения через Core.
+class TaskStat(Base):
+    __tablename__ = "task_stats"
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # пустая строка вместо NULL: NULL не участвует в первичном ключе и ON CONFLICT
+    status = Column(String, primary_key=True)
+    priority = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+# задачи без владельца (owner_id NULL, остались от старых версий) не считаются, как и в stats.actual_counts
+TASK_STATS_DDL = {
+    "sqlite": [
+        "CREATE TRIGGER task_stats_insert AFTER INSERT ON tasks WHEN new.owner_id IS NOT NULL BEGIN "
+        "INSERT INTO task_stats (owner_id, status, priority, count) "
+        "VALUES (new.owner_id, coalesce(new.status, ''), coalesce(new.priority, ''), 1) "
+        "ON CONFLICT (owner_id, status, priority) DO UPDATE SET count = count + 1; "
+        "END",
+        "CREATE TRIGGER task_stats_delete AFTER DELETE ON tasks WHEN old.owner_id IS NOT NULL BEGIN "
+        "UPDATE task_stats SET count = count - 1 "
+        "WHERE owner_id = old.owner_id AND status = coalesce(old.status, '') AND priority = coalesce(old.priority, ''); "
+        "END",
+        "CREATE TRIGGER task_stats_update AFTER UPDATE OF owner_id, status, priority ON tasks BEGIN "
+        "UPDATE task_stats SET count = count - 1 "
+        "WHERE owner_id = old.owner_id AND status = coalesce(old.status, '') AND priority = coalesce(old.priority, ''); "
+        "INSERT INTO task_stats (owner_id, status, priority, count) "
+        "SELECT new.owner_id, coalesce(new.status, ''), coalesce(new.priority, ''), 1 WHERE new.owner_id IS NOT NULL "
+        "ON CONFLICT (owner_id, status, priority) DO UPDATE SET count = count + 1; "
+        "END",
+    ],
+    "postgresql": [
+        "CREATE FUNCTION task_stats_sync() RETURNS trigger AS $$ BEGIN "
+        "IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.owner_id IS NOT NULL THEN "
+        "UPDATE task_stats SET count = count - 1 "
+        "WHERE owner_id = OLD.owner_id AND status = coalesce(OLD.status, '') AND priority = coalesce(OLD.priority, ''); "
+        "END IF; "
+        "IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.owner_id IS NOT NULL THEN "
+        "INSERT INTO task_stats (owner_id, status, priority, count) "
+        "VALUES (NEW.owner_id, coalesce(NEW.status, ''), coalesce(NEW.priority, ''), 1) "
+        "ON CONFLICT (owner_id, status, priority) DO UPDATE SET count = task_stats.count + 1; "
+        "END IF; "
+        "RETURN NULL; "
+        "END $$ LANGUAGE plpgsql",
+        "CREATE TRIGGER task_stats_sync AFTER INSERT OR DELETE OR UPDATE OF owner_id, status, priority ON tasks "
+        "FOR EACH ROW EXECUTE FUNCTION task_stats_sync()",
+    ],
+}
+
+
+# Полнотекстовый поиск по title и description (app/search.py).
+# SQLite: таблица FTS5 без копии текста (content=''), ее синхронизируют триггеры на tasks,
+# поэтому в индекс попадают и пакетные изменения через Core. Токен "u<owner_id>" в колонке owner
+# позволяет искать только среди задач пользователя, не перебирая совпадения остальных.
+# Postgres: вычисляемая колонка tsvector с тем же токеном владельца и GIN-индекс по ней.
+# В существующей базе их создает миграция 3b1e5a7c9d20.
+TASK_SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE tasks_fts USING fts5(owner, title, description, content='', prefix='2 3', "
+        "tokenize='unicode61 remove_diacritics 2')",
+        "CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+        "INSERT INTO tasks_fts(rowid, owner, title, description) VALUES (new.id, 'u' || new.owner_id, new.title, new.description); "
+        "END",
+        # из таблицы без копии текста запись удаляется командой 'delete' с прежними значениями колонок
+        "CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+        "INSERT INTO tasks_fts(tasks_fts, rowid, owner, title, description) "
+        "VALUES ('delete', old.id, 'u' || old.owner_id, old.title, old.description); "
+        "END",
+        "CREATE TRIGGER tasks_fts_update AFTER UPDATE OF owner_id, title, description ON tasks BEGIN "
+        "INSERT INTO tasks_fts(tasks_fts, rowid, owner, title, description) "
+        "VALUES ('delete', old.id, 'u' || old.owner_id, old.title, old.description); "
+        "INSERT INTO tasks_fts(rowid, owner, title, description) VALUES (new.id, 'u' || new.owner_id, new.title, new.description); "
+        "END",
+    ],
+    "postgresql": [
+        "ALTER TABLE tasks ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+        "to_tsvector('simple', 'u' || owner_id::text) "
+        "|| setweight(to_tsvector('simple', coalesce(title, '')), 'A') "
+        "|| setweight(to_tsvector('simple', coalesce(description, '')), 'B')) STORED",
+        "CREATE INDEX ix_tasks_search_vector ON tasks USING gin (search_vector)",
+    ],
+}
+for ddl in (TASK_STATS_DDL, TASK_SEARCH_DDL):
+    for dialect, statements in ddl.items():
+        for statement in statements:
+            event.listen(Task.__table__, "after_create", DDL(statement).execute_if(dialect=dialect))
+# триггеры удаляются вместе с tasks, а таблицу FTS5 и функцию триггера нужно удалить отдельно
+event.listen(Task.__table__, "after_drop", DDL("DROP TABLE IF EXISTS tasks_fts").execute_if(dialect="sqlite"))
+event.listen(Task.__table__, "after_drop", DDL("DROP FUNCTION IF EXISTS task_stats_sync()").execute_if(dialect="postgresql"))
+
+
+# Исходящие оповещения (outbox). Запись добавляется в той же транзакции, что и задача,
+# поэтому оповещение не потеряется при перезапуске: его отправит воркер из app/notifications.py
+class Notification(Base):
+    __tablename__ = "notifications"
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String, nullable=False)
+    # JSON с данными для письма, например {"titles": ["..."]}
+    payload = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending") # pending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # воркер берет только записи, у которых время следующей попытки уже наступило
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    __table_args__ = (Index("ix_notifications_status_next_attempt_at", "status", "next_attempt_at"),)
+
+
+# Пользователь мог попасть в кэш get_current_user. Если его удалили, деактивировали
+# или поменяли email, старая запись в кэше больше не должна пускать его в API.
+@event.listens_for(User, "after_delete")
+def drop_cached_user_on_delete(mapper, connection, target):
+    invalidate_user(target.email, target.id)
+
+
+@event.listens_for(User, "after_update")
+def drop_cached_user_on_update(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.is_active.history.has_changes() or state.attrs.email.history.has_changes():
+        # deleted содержит прежнее значение email, если его поменяли
+        for email in [*state.attrs.email.history.deleted, target.email]:
+            invalidate_user(email, target.id)
@@ -0,0 +1,172 @@
+# очередь оповещений: запись в outbox (таблица notifications) и воркер, который ее разбирает
+
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .database import AsyncSessionLocal
+from .config import (NOTIFY_BATCH_SIZE, NOTIFY_CONCURRENCY, NOTIFY_MAX_ATTEMPTS,
+                     NOTIFY_BACKOFF_SECONDS, NOTIFY_POLL_INTERVAL, NOTIFY_LEASE_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+
+# Добавляет оповещение в сессию, но не коммитит: оно сохранится вместе с задачей
+# в одной транзакции или не сохранится вовсе.
+def enqueue_high_priority(db: AsyncSession, email: str, titles: list[str]):
+    db.add(models.Notification(recipient=email, payload=json.dumps({"titles": titles}, ensure_ascii=False)))
+
+
+# Локальная замена почтового сервиса: печатает письмо в консоль
+class ConsoleSender:
+    async def send(self, email: str, titles: list[str]):
+        print(f"--- EMAIL SENT to {email} ---")
+        for title in titles:
+            print(f"Notification: New critical task created: '{title}'")
+        print("---------------------------------")
+
+
+class NotificationWorker:
+    def __init__(self, session_factory=AsyncSessionLocal, sender=None, batch_size: int = NOTIFY_BATCH_SIZE,
+                 concurrency: int = NOTIFY_CONCURRENCY, max_attempts: int = NOTIFY_MAX_ATTEMPTS,
+                 backoff_seconds: float = NOTIFY_BACKOFF_SECONDS, poll_interval: float = NOTIFY_POLL_INTERVAL,
+                 lease_seconds: float = NOTIFY_LEASE_SECONDS):
+        self.session_factory = session_factory
+        self.sender = sender or ConsoleSender()
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        # метрики
+        self.started_at = time.monotonic()
+        self.queue_depth = 0
+        self.sent = 0          # отправленные записи outbox
+        self.messages = 0      # отправленные письма (несколько записей одному адресату склеиваются в одно)
+        self.retries = 0
+        self.failed = 0
+        self.send_calls = 0
+        self.send_seconds_total = 0.0
+        self.send_seconds_max = 0.0
+
+    async def _claim_batch(self) -> list[tuple[int, str, list[str], int]]:
+        async with self.session_factory() as db:
+            now = datetime.utcnow()
+            self.queue_depth = await db.scalar(select(func.count(models.Notification.id)).where(
+                models.Notification.status == "pending"))
+            pending = (models.Notification.status == "pending", models.Notification.next_attempt_at <= now)
+            # skip_locked позволяет нескольким воркерам на Postgres не ждать строки, которые уже берет другой.
+            # SQLite эту часть запроса просто игнорирует.
+            candidates = select(models.Notification.id).where(*pending).order_by(models.Notification.id).limit(
+                self.batch_size).with_for_update(skip_locked=True)
+            # Аренда: пока пачка отправляется, другие воркеры ее не возьмут. Если процесс упадет,
+            # записи снова станут доступны, когда аренда истечет. Условие повторяется в самом UPDATE:
+            # строку, которую между выбором и записью арендовал другой процесс, UPDATE не изменит и не
+            # вернет, поэтому одну запись outbox получает только один воркер.
+            rows = (await db.execute(update(models.Notification).where(
+                models.Notification.id.in_(candidates.scalar_subquery()), *pending).values(
+                    next_attempt_at=now + timedelta(seconds=self.lease_seconds)).returning(
+                        models.Notification.id, models.Notification.recipient, models.Notification.payload,
+                        models.Notification.attempts))).all()
+            await db.commit()
+            return [(row.id, row.recipient, json.loads(row.payload)["titles"], row.attempts)
+                    for row in sorted(rows, key=lambda row: row.id)]
+
+    async def _record(self, sent_ids: list[int], failures: list[tuple[int, int, str]]):
+        async with self.session_factory() as db:
+            now = datetime.utcnow()
+            if sent_ids:
+                await db.execute(update(models.Notification).where(models.Notification.id.in_(sent_ids)).values(
+                    status="sent", sent_at=now))
+            for notification_id, attempts, error in failures:
+                values = {"attempts": attempts, "last_error": error}
+                if attempts >= self.max_attempts:
+                    values["status"] = "failed"
+                else:
+                    # экспоненциальная пауза: 2, 4, 8... секунд при NOTIFY_BACKOFF_SECONDS = 2
+                    values["next_attempt_at"] = now + timedelta(seconds=self.backoff_seconds * 2 ** (attempts - 1))
+                await db.execute(update(models.Notification).where(models.Notification.id == notification_id).values(**values))
+            await db.commit()
+
+    async def _deliver(self, semaphore: asyncio.Semaphore, email: str, rows: list):
+        titles = [title for _, _, row_titles, _ in rows for title in row_titles]
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await self.sender.send(email, titles)
+            except Exception as exc:
+                logger.warning(f"Не удалось отправить оповещение на {email}: {exc}")
+                return [], [(row_id, attempts + 1, str(exc)) for row_id, _, _, attempts in rows]
+            finally:
+                elapsed = time.perf_counter() - start
+                self.send_calls += 1
+                self.send_seconds_total += elapsed
+                self.send_seconds_max = max(self.send_seconds_max, elapsed)
+        self.messages += 1
+        return [row_id for row_id, _, _, _ in rows], []
+
+    # Обрабатывает одну пачку и возвращает количество записей outbox, которые удалось отправить
+    async def run_once(self) -> int:
+        rows = await self._claim_batch()
+        if not rows:
+            return 0
+        # несколько оповещений одному адресату отправляются одним письмом
+        by_recipient = defaultdict(list)
+        for row in rows:
+            by_recipient[row[1]].append(row)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self._deliver(semaphore, email, group) for email, group in by_recipient.items()))
+        sent_ids = [row_id for sent, _ in results for row_id in sent]
+        failures = [failure for _, failed in results for failure in failed]
+        await self._record(sent_ids, failures)
+        self.sent += len(sent_ids)
+        self.retries += sum(1 for _, attempts, _ in failures if attempts < self.max_attempts)
+        self.failed += sum(1 for _, attempts, _ in failures if attempts >= self.max_attempts)
+        self.queue_depth = max(self.queue_depth - len(sent_ids), 0)
+        return len(sent_ids)
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                sent = await self.run_once()
+            except Exception:
+                logger.exception("Ошибка воркера оповещений")
+                sent = 0
+            # пачка была полной: скорее всего в очереди есть еще, не ждем
+            if sent < self.batch_size:
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stats(self) -> dict:
+        uptime = time.monotonic() - self.started_at
+        return {
+            "queue_depth": self.queue_depth,
+            "sent": self.sent,
+            "messages": self.messages,
+            "retries": self.retries,
+            "failed": self.failed,
+            "send_latency_avg_seconds": self.send_seconds_total / self.send_calls if self.send_calls else 0.0,
+            "send_latency_max_seconds": self.send_seconds_max,
+            "throughput_per_second": self.sent / uptime if uptime else 0.0,
+        }
+
+
+worker = NotificationWorker()
+
+
+if __name__ == "__main__":
+    # отдельный процесс для оповещений, если API запущено с NOTIFICATION_WORKER=off
+    from .logger_config import setup_logger
+    setup_logger()
+    try:
+        asyncio.run(worker.run(asyncio.Event()))
+    except KeyboardInterrupt:
+        pass
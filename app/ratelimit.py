@@ -0,0 +1,185 @@
+# Ограничение частоты запросов и защита входа от перебора паролей.
+# Проверки выполняются до запросов к базе и bcrypt, поэтому отказ почти ничего не стоит.
+
+import math
+import threading
+import time
+from fastapi import HTTPException, Request, status
+from .cache import LRUCache
+from .config import (RATE_LIMIT_BACKEND, RATE_LIMIT_STORE_SIZE, REDIS_URL, LOGIN_IP_PER_MINUTE, LOGIN_IP_BURST,
+                     LOGIN_USER_PER_MINUTE, LOGIN_USER_BURST, REGISTER_IP_PER_MINUTE, REGISTER_IP_BURST,
+                     API_IP_PER_MINUTE, API_IP_BURST, LOCKOUT_THRESHOLD, LOCKOUT_BASE_SECONDS,
+                     LOCKOUT_MAX_SECONDS, LOCKOUT_WINDOW_SECONDS)
+
+
+# Token bucket в виде GCRA: вместо числа жетонов хранится одно число tat, время,
+# когда корзина снова станет полной. Каждый запрос сдвигает tat на interval (60 / лимит в минуту);
+# запрос разрешен, пока tat опережает текущее время не больше чем на burst интервалов.
+# Возвращает новое значение tat (None, если запрос отклонен) и сколько секунд ждать до повтора.
+def gcra(tat: float | None, now: float, interval: float, burst: int) -> tuple[float | None, float]:
+    tat = max(tat or now, now)
+    new_tat = tat + interval
+    allow_at = new_tat - interval * burst
+    if now < allow_at:
+        return None, allow_at - now
+    return new_tat, 0.0
+
+
+# То же самое на Lua: в Redis скрипт выполняется атомарно, поэтому несколько процессов API
+# не обойдут лимит одновременными запросами
+GCRA_SCRIPT = """
+local tat = tonumber(redis.call('GET', KEYS[1]))
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+if not tat or tat < now then tat = now end
+local new_tat = tat + interval
+local allow_at = new_tat - interval * burst
+if now < allow_at then return tostring(allow_at - now) end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return '0'
+"""
+
+
+# Хранилище в памяти процесса. Число ключей ограничено: при переборе с множества IP
+# вытесняются самые старые, память не растет.
+class MemoryStore:
+    def __init__(self, maxsize: int = RATE_LIMIT_STORE_SIZE):
+        self._data = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    async def hit(self, key: str, interval: float, burst: int) -> float:
+        now = time.time()
+        with self._lock:
+            new_tat, retry_after = gcra(self._data.get(key), now, interval, burst)
+            if new_tat is not None:
+                # когда корзина снова полная, запись не нужна
+                self._data.set(key, new_tat, expires_at=new_tat)
+        return retry_after
+
+    async def incr(self, key: str, ttl: int) -> int:
+        with self._lock:
+            count, expires_at = self._data.get(key) or (0, time.time() + ttl)
+            self._data.set(key, (count + 1, expires_at), expires_at=expires_at)
+        return count + 1
+
+    async def get(self, key: str):
+        return self._data.get(key)
+
+    async def set(self, key: str, value, ttl: float):
+        self._data.set(key, value, expires_at=time.time() + ttl)
+
+    async def delete(self, key: str):
+        self._data.delete(key)
+
+    def clear(self):
+        self._data.clear()
+
+
+# Общее хранилище для нескольких процессов API: асинхронный клиент Redis или объект
+# с такими же методами get, set(px=...), incr, expire, delete и eval
+class RedisStore:
+    def __init__(self, client, prefix: str = "task-manager:ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def hit(self, key: str, interval: float, burst: int) -> float:
+        return float(await self.client.eval(GCRA_SCRIPT, 1, self.prefix + key, time.time(), interval, burst))
+
+    async def incr(self, key: str, ttl: int) -> int:
+        count = await self.client.incr(self.prefix + key)
+        if count == 1:
+            # окно считается от первой неудачи
+            await self.client.expire(self.prefix + key, ttl)
+        return count
+
+    async def get(self, key: str):
+        value = await self.client.get(self.prefix + key)
+        return float(value) if value is not None else None
+
+    async def set(self, key: str, value, ttl: float):
+        await self.client.set(self.prefix + key, value, px=max(int(ttl * 1000), 1))
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+    def clear(self):
+        pass
+
+
+class RateLimit:
+    def __init__(self, name: str, per_minute: float, burst: int):
+        self.name = name
+        self.per_minute = per_minute
+        self.burst = burst
+
+
+LOGIN_IP_LIMIT = RateLimit("login-ip", LOGIN_IP_PER_MINUTE, LOGIN_IP_BURST)
+LOGIN_USER_LIMIT = RateLimit("login-user", LOGIN_USER_PER_MINUTE, LOGIN_USER_BURST)
+REGISTER_IP_LIMIT = RateLimit("register-ip", REGISTER_IP_PER_MINUTE, REGISTER_IP_BURST)
+API_IP_LIMIT = RateLimit("api-ip", API_IP_PER_MINUTE, API_IP_BURST)
+
+
+def too_many_requests(retry_after: float, detail: str = "Слишком много запросов, повторите попытку позже"):
+    return HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=detail,
+                         headers={"Retry-After": str(max(math.ceil(retry_after), 1))})
+
+
+class RateLimiter:
+    def __init__(self, store):
+        self.store = store
+        self.rejected = 0
+        self.lockouts = 0
+
+    async def check(self, limit: RateLimit, key: str):
+        if limit.per_minute <= 0:
+            return
+        retry_after = await self.store.hit(f"{limit.name}:{key}", 60 / limit.per_minute, limit.burst)
+        if retry_after > 0:
+            self.rejected += 1
+            raise too_many_requests(retry_after)
+
+    async def check_login(self, ip: str, username: str):
+        await self.check(LOGIN_IP_LIMIT, ip)
+        await self.check(LOGIN_USER_LIMIT, username)
+        locked_until = await self.store.get(f"lock:{username}")
+        if locked_until is not None and locked_until > time.time():
+            self.rejected += 1
+            raise too_many_requests(locked_until - time.time(), "Слишком много неудачных попыток входа, вход временно заблокирован")
+
+    async def login_failed(self, username: str):
+        failures = await self.store.incr(f"failures:{username}", LOCKOUT_WINDOW_SECONDS)
+        if failures >= LOCKOUT_THRESHOLD:
+            # 30 с, 60 с, 120 с... при LOCKOUT_BASE_SECONDS = 30
+            duration = min(LOCKOUT_BASE_SECONDS * 2 ** (failures - LOCKOUT_THRESHOLD), LOCKOUT_MAX_SECONDS)
+            await self.store.set(f"lock:{username}", time.time() + duration, duration)
+            self.lockouts += 1
+
+    async def login_succeeded(self, username: str):
+        await self.store.delete(f"failures:{username}")
+
+    def stats(self) -> dict:
+        return {"rejected": self.rejected, "lockouts": self.lockouts}
+
+
+def create_store(backend: str = RATE_LIMIT_BACKEND):
+    if backend == "redis":
+        # redis нужен только для этого режима, поэтому импортируем его здесь
+        import redis.asyncio
+        return RedisStore(redis.asyncio.Redis.from_url(REDIS_URL))
+    return MemoryStore()
+
+
+rate_limiter = RateLimiter(create_store())
+
+
+def client_ip(request: Request) -> str:
+    # за прокси uvicorn подставляет адрес из X-Forwarded-For, если запущен с --proxy-headers
+    return request.client.host if request.client else "unknown"
+
+
+# Зависимость для маршрутов и роутеров: Depends(limit_by_ip(REGISTER_IP_LIMIT))
+def limit_by_ip(limit: RateLimit):
+    async def dependency(request: Request):
+        await rate_limiter.check(limit, client_ip(request))
+    return dependency
@@ -0,0 +1,263 @@
+# Планировщик дедлайнов: события due_soon (до дедлайна осталось меньше DUE_SOON_SECONDS)
+# и overdue (дедлайн прошел) для невыполненных задач.
+#
+# Вместо периодического опроса таблицы задач планировщик держит в памяти кучу (heapq),
+# упорядоченную по времени срабатывания, и спит до ближайшего события. В куче только дедлайны
+# ближайших DEADLINE_HORIZON_SECONDS секунд: они читаются из базы по индексу ix_tasks_deadline,
+# следующее окно загружается, когда текущее заканчивается. Когда задачи пользователя меняются
+# (main.tasks_changed), перечитываются только его задачи из окна, а устаревшие записи кучи
+# пропускаются при извлечении.
+#
+# Если процессов API несколько (app/server.py), планировщик работает только в одном из них,
+# а остальные сообщают ему об изменениях задач через OwnerChangePipe.
+#
+# События доставляются хотя бы один раз. Первое окно после запуска начинается на
+# DEADLINE_CATCHUP_SECONDS раньше текущего времени: задачи, у которых дедлайн прошел или стал
+# близким, пока процесс не работал, сразу получают пропущенные due_soon и overdue, а события,
+# отправленные до перезапуска в этом интервале, приходят повторно. О невыполненных задачах
+# с дедлайном раньше этого интервала планировщик не сообщает.
+
+import asyncio
+import heapq
+import logging
+import multiprocessing
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from . import models, schemas
+from .database import AsyncSessionLocal
+from .config import DUE_SOON_SECONDS, DEADLINE_HORIZON_SECONDS, DEADLINE_EVENT_BATCH, DEADLINE_CATCHUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+# дедлайны хранятся в базе без часового пояса, в UTC (см. schemas.deadline_must_be_future)
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Обработчик по умолчанию: одна строка лога на пачку событий
+async def log_events(events: list[dict]):
+    due_soon = sum(1 for event in events if event["event"] == "due_soon")
+    logger.info(f"Дедлайны: {due_soon} задач скоро истекают, {len(events) - due_soon} просрочены")
+
+
+# Канал между процессами API: owner_id пишутся в pipe, созданный до fork, по 8 байт.
+# Запись в pipe до PIPE_BUF байт атомарна, поэтому числа от разных процессов не перемешиваются.
+# Если планировщик не успевает читать и pipe заполнен, изменение не теряется молча: счетчик
+# переполнений в общей памяти растет, и планировщик перечитывает все окно.
+class OwnerChangePipe:
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.set_blocking(self.write_fd, False)
+        self._overflows = multiprocessing.RawValue("Q", 0)
+        self._seen_overflows = 0
+
+    def send(self, owner_id: int):
+        try:
+            os.write(self.write_fd, owner_id.to_bytes(8, "little"))
+        except BlockingIOError:
+            self._overflows.value += 1
+
+    # Владельцы, которые пришли с прошлого вызова, и было ли переполнение
+    def receive(self) -> tuple[set[int], bool]:
+        data = b""
+        while True:
+            try:
+                chunk = os.read(self.read_fd, 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        owners = {int.from_bytes(data[i:i + 8], "little") for i in range(0, len(data), 8)}
+        overflowed = self._overflows.value != self._seen_overflows
+        self._seen_overflows = self._overflows.value
+        return owners, overflowed
+
+
+class DeadlineScheduler:
+    def __init__(self, session_factory=AsyncSessionLocal, sink=log_events, due_soon_seconds: float = DUE_SOON_SECONDS,
+                 horizon_seconds: float = DEADLINE_HORIZON_SECONDS, batch_size: int = DEADLINE_EVENT_BATCH,
+                 catchup_seconds: float = DEADLINE_CATCHUP_SECONDS):
+        self.session_factory = session_factory
+        # async-функция, которая получает список событий (не больше batch_size за вызов)
+        self.sink = sink
+        self.due_soon = timedelta(seconds=due_soon_seconds)
+        self.horizon = timedelta(seconds=horizon_seconds)
+        self.batch_size = batch_size
+        self.catchup = timedelta(seconds=catchup_seconds)
+        # (время срабатывания, id задачи, событие, дедлайн)
+        self._heap = []
+        # id задачи -> (owner_id, title, deadline) для задач текущего окна
+        self._tasks = {}
+        self._owners = defaultdict(set)
+        # уже отправленные (id задачи, событие, дедлайн)
+        self._fired = set()
+        self._dirty = set()
+        self._window_end = None
+        # события с временем срабатывания до этого момента уже обработаны
+        self._processed_until = None
+        self._wakeup = None
+        # OwnerChangePipe, если процессов API несколько
+        self.remote = None
+        # метрики
+        self.window_loads = 0
+        self.owner_reloads = 0
+        self.events = {"due_soon": 0, "overdue": 0}
+        self.batches = 0
+
+    # Вызывается после изменения задач пользователя, сама база здесь не читается:
+    # задачи перечитает цикл планировщика, заодно для всех изменившихся пользователей сразу
+    def owner_changed(self, owner_id: int):
+        if self._wakeup is None:
+            # планировщик работает в другом процессе или не запущен
+            if self.remote is not None:
+                self.remote.send(owner_id)
+            return
+        self._dirty.add(owner_id)
+        self._wakeup.set()
+
+    def _receive_remote(self):
+        owners, overflowed = self.remote.receive()
+        self._dirty |= owners
+        if overflowed:
+            # часть изменений потеряна: окно загрузится заново при следующем проходе
+            self._window_end = None
+        self._wakeup.set()
+
+    def _query(self, start: datetime, end: datetime):
+        # задачи, у которых до конца окна наступит хотя бы одно событие
+        return select(models.Task.id, models.Task.owner_id, models.Task.title, models.Task.deadline).where(
+            models.Task.deadline > start, models.Task.deadline <= end + self.due_soon,
+            models.Task.status != schemas.Status.completed)
+
+    def _push(self, task_id: int, owner_id: int, title: str, deadline: datetime):
+        self._tasks[task_id] = (owner_id, title, deadline)
+        self._owners[owner_id].add(task_id)
+        for event, fire_at in (("due_soon", deadline - self.due_soon), ("overdue", deadline)):
+            if (task_id, event, deadline) not in self._fired:
+                heapq.heappush(self._heap, (fire_at, task_id, event, deadline))
+
+    def _forget(self, task_id: int):
+        owner_id, _, _ = self._tasks.pop(task_id)
+        self._owners[owner_id].discard(task_id)
+        if not self._owners[owner_id]:
+            del self._owners[owner_id]
+
+    async def load_window(self, now: datetime):
+        # при первой загрузке окно захватывает дедлайны, пропущенные, пока процесс не работал
+        start, end = self._processed_until or now - self.catchup, now + self.horizon
+        async with self.session_factory() as db:
+            rows = (await db.execute(self._query(start, end))).all()
+        self._heap = []
+        self._tasks = {}
+        self._owners = defaultdict(set)
+        self._dirty = set()
+        for row in rows:
+            self._push(*row)
+        # отметки об отправке нужны только для задач, которые остались в окне
+        self._fired = {key for key in self._fired if key[0] in self._tasks}
+        self._window_end = end
+        self._processed_until = start
+        self.window_loads += 1
+
+    async def reload_owners(self, owners: set[int]):
+        async with self.session_factory() as db:
+            rows = (await db.execute(self._query(self._processed_until, self._window_end).where(
+                models.Task.owner_id.in_(owners)))).all()
+        for owner_id in owners:
+            for task_id in list(self._owners.get(owner_id, ())):
+                self._forget(task_id)
+        for row in rows:
+            self._push(*row)
+        # записи удаленных и перенесенных задач остаются в куче, пока не дойдут до вершины;
+        # если их накопилось больше, чем живых, куча пересобирается
+        if len(self._heap) > 4 * len(self._tasks) + 1000:
+            self._heap = [entry for entry in self._heap if self._is_live(entry)]
+            heapq.heapify(self._heap)
+        self.owner_reloads += len(owners)
+
+    def _is_live(self, entry) -> bool:
+        _, task_id, event, deadline = entry
+        task = self._tasks.get(task_id)
+        return task is not None and task[2] == deadline and (task_id, event, deadline) not in self._fired
+
+    def _event(self, entry) -> dict:
+        _, task_id, event, deadline = entry
+        owner_id, title, _ = self._tasks[task_id]
+        return {"event": event, "task_id": task_id, "owner_id": owner_id, "title": title, "deadline": deadline}
+
+    # Отправляет наступившие события и возвращает время, когда планировщик нужно разбудить снова
+    async def run_once(self, now: datetime | None = None) -> datetime:
+        now = now or utcnow()
+        if self._window_end is None or now >= self._window_end:
+            await self.load_window(now)
+        if self._dirty:
+            owners, self._dirty = self._dirty, set()
+            await self.reload_owners(owners)
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._is_live(entry):
+                due.append(entry)
+        # события отмечаются отправленными только после успешного вызова sink: если он упал,
+        # неотправленные записи возвращаются в кучу и уйдут при следующем проходе
+        for start in range(0, len(due), self.batch_size):
+            batch = due[start:start + self.batch_size]
+            try:
+                await self.sink([self._event(entry) for entry in batch])
+            except Exception:
+                for entry in due[start:]:
+                    heapq.heappush(self._heap, entry)
+                raise
+            self.batches += 1
+            for _, task_id, event, deadline in batch:
+                self._fired.add((task_id, event, deadline))
+                self.events[event] += 1
+                if event == "overdue":
+                    # после дедлайна задача больше не нужна планировщику
+                    self._forget(task_id)
+                    self._fired.discard((task_id, "due_soon", deadline))
+                    self._fired.discard((task_id, "overdue", deadline))
+        self._processed_until = now
+        return min(self._heap[0][0], self._window_end) if self._heap else self._window_end
+
+    async def run(self, stop: asyncio.Event):
+        self._wakeup = asyncio.Event()
+        if self.remote is not None:
+            asyncio.get_running_loop().add_reader(self.remote.read_fd, self._receive_remote)
+        try:
+            while not stop.is_set():
+                self._wakeup.clear()
+                try:
+                    wake_at = await self.run_once()
+                except Exception:
+                    logger.exception("Ошибка планировщика дедлайнов")
+                    wake_at = utcnow() + timedelta(seconds=5)
+                # спим до ближайшего события, изменения задач или остановки
+                waiters = [asyncio.ensure_future(stop.wait()), asyncio.ensure_future(self._wakeup.wait())]
+                await asyncio.wait(waiters, timeout=max((wake_at - utcnow()).total_seconds(), 0),
+                                   return_when=asyncio.FIRST_COMPLETED)
+                for waiter in waiters:
+                    waiter.cancel()
+        finally:
+            if self.remote is not None:
+                asyncio.get_running_loop().remove_reader(self.remote.read_fd)
+            self._wakeup = None
+
+    def stats(self) -> dict:
+        return {
+            "scheduled_tasks": len(self._tasks),
+            "heap_size": len(self._heap),
+            "due_soon_events": self.events["due_soon"],
+            "overdue_events": self.events["overdue"],
+            "batches": self.batches,
+            "window_loads": self.window_loads,
+            "owner_reloads": self.owner_reloads,
+        }
+
+
+scheduler = DeadlineScheduler()
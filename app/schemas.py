@@ -23,6 +23,9 @@ def deadline_must_be_future(v: datetime):
             v_utc = v.astimezone(timezone.utc) if v.tzinfo else v.replace(tzinfo=timezone.utc)
             if v_utc < datetime.now(timezone.utc):
                 raise ValueError("deadline не может быть в прошлом")
+            # в базе дедлайны хранятся без пояса, в UTC: SQLite отбрасывает смещение при записи,
+            # а планировщик и /tasks/due сравнивают их с scheduler.utcnow()
+            return v_utc.replace(tzinfo=None)
         return v
 
 
@@ -94,6 +97,12 @@ class TaskUpdate(BaseModel):
     }
 
 
+# Элемент пакетного обновления: какую задачу (по названию) и какими полями обновить
+class TaskBulkUpdate(BaseModel):
+    title: str
+    changes: TaskUpdate
+
+
 # Базовая схема пользователя.
 class UserBase(BaseModel):
     email: str
@@ -115,3 +124,11 @@ class User(UserBase):
 class UserCreate(UserBase):
     password: str
 
+
+
+# Облегченная копия пользователя для get_current_user.
+# Хранится в кэше между запросами, поэтому не привязана к сессии базы (в отличие от models.User).
+class CurrentUser(UserBase):
+    id: int
+    is_active: bool
+    model_config = {"from_attributes": True, "frozen": True}
@@ -0,0 +1,101 @@
+# Полнотекстовый поиск задач по title и description.
+# Индекс описан в models.TASK_SEARCH_DDL: FTS5 на SQLite, tsvector + GIN на Postgres.
+# Запрос пользователя разбирается здесь сам, а не передается в синтаксис FTS как есть:
+# слова ищутся все сразу (AND), "слово*" ищет по префиксу, остальные символы игнорируются.
+# Совпадения в названии выше совпадений только в описании.
+
+import base64
+import json
+import re
+from fastapi import HTTPException
+from sqlalchemy import text, column, Float
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+
+# больше слов в запросе не учитывается
+MAX_TERMS = 16
+
+# SQLite: сначала задачи, где все слова есть в названии, потом те, где слова нашлись в описании.
+# bm25 здесь не подходит: для каждого запроса он считает, в скольких задачах ВСЕХ пользователей
+# встречается слово, и на частых словах это десятки миллисекунд при 1 млн задач. Два запроса
+# MATCH с фильтром по владельцу читают только его задачи.
+SQLITE_SEARCH = """
+SELECT {columns}, matches.rank
+FROM (SELECT rowid AS id, 0.0 AS rank FROM tasks_fts WHERE tasks_fts MATCH :title_query
+      UNION ALL
+      SELECT rowid AS id, 1.0 AS rank FROM tasks_fts WHERE tasks_fts MATCH :other_query) AS matches
+JOIN tasks ON tasks.id = matches.id
+{after}
+ORDER BY matches.rank, tasks.id
+LIMIT :limit
+"""
+
+# Postgres: ts_rank_cd считается по самой строке (вес A у названия, B у описания), без статистики
+# по всей таблице. Он тем больше, чем лучше совпадение, поэтому сортируем по нему со знаком минус:
+# как и в SQLite, меньше значит выше в выдаче
+POSTGRES_SEARCH = """
+SELECT {columns}, matches.rank
+FROM (SELECT id, -ts_rank_cd(search_vector, to_tsquery('simple', :query)) AS rank
+      FROM tasks WHERE search_vector @@ to_tsquery('simple', :query)) AS matches
+JOIN tasks ON tasks.id = matches.id
+{after}
+ORDER BY matches.rank, tasks.id
+LIMIT :limit
+"""
+
+AFTER_CURSOR = "WHERE matches.rank > :rank OR (matches.rank = :rank AND tasks.id > :id)"
+
+
+# Слова запроса: [(слово, поиск по префиксу)]
+def parse_terms(q: str) -> list[tuple[str, bool]]:
+    terms = [(match.group(1).lower(), bool(match.group(2))) for match in re.finditer(r"(\w+)(\*?)", q)]
+    if not terms:
+        raise HTTPException(status_code=400, detail="В запросе нет слов для поиска")
+    return terms[:MAX_TERMS]
+
+
+# Параметры запроса MATCH (SQLite) или to_tsquery (Postgres) с токеном владельца
+def match_params(dialect: str, owner_id: int, terms: list[tuple[str, bool]]) -> dict:
+    if dialect == "postgresql":
+        words = " & ".join(f"{word}:*" if prefix else word for word, prefix in terms)
+        return {"query": f"u{owner_id} & ({words})"}
+    # слова в кавычках, чтобы FTS5 не принял их за операторы (AND, OR, NOT, NEAR)
+    words = " AND ".join(f'"{word}"*' if prefix else f'"{word}"' for word, prefix in terms)
+    return {
+        "title_query": f"owner : u{owner_id} AND title : ({words})",
+        "other_query": f"(owner : u{owner_id} AND {{title description}} : ({words})) NOT title : ({words})",
+    }
+
+
+def encode_cursor(rank: float, task_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, task_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        rank, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(task_id)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+
+
+# Одна страница результатов по рангу: строки с колонками fields и курсор следующей страницы
+async def search_tasks(db: AsyncSession, owner_id: int, q: str, fields: list[str], limit: int,
+                       cursor: str | None = None) -> tuple[list, str | None]:
+    dialect = db.bind.dialect.name
+    params = {**match_params(dialect, owner_id, parse_terms(q)), "limit": limit + 1}
+    after = ""
+    if cursor:
+        params["rank"], params["id"] = decode_cursor(cursor)
+        after = AFTER_CURSOR
+    template = POSTGRES_SEARCH if dialect == "postgresql" else SQLITE_SEARCH
+    columns = ", ".join(f"tasks.{field}" for field in fields)
+    # типы колонок нужны, чтобы deadline пришел как datetime, а не строкой
+    query = text(template.format(columns=columns, after=after)).columns(
+        *[getattr(models.Task, field) for field in fields], column("rank", Float))
+    rows = (await db.execute(query, params)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].rank, rows[-1].id)
+    return rows, next_cursor
@@ -0,0 +1,53 @@
+# Быстрая сериализация задач для ответов со списками.
+# Строки собираются прямо из кортежей колонок, без объектов ORM и моделей pydantic,
+# и кодируются orjson. На больших списках валидация и сериализация через pydantic
+# занимали больше времени процессора, чем сам запрос к базе.
+
+import json
+from datetime import datetime
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    # orjson не обязателен: без него ответы кодируются стандартным json с тем же результатом
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+# datetime кодируется в ISO 8601 (как jsonable_encoder), enum-строки и числа как есть
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+# Тот же формат, что у TaskResponse.serialize_dt ("%H:%M:%d:%m:%Y"), без strftime на каждую строку
+def format_deadline(value: datetime | None) -> str | None:
+    if value is None:
+        return None
+    return f"{value.hour:02d}:{value.minute:02d}:{value.day:02d}:{value.month:02d}:{value.year}"
+
+
+# Строки результата (кортежи в порядке fields) в словари для ответа.
+# В выборке могут быть лишние колонки после fields, они отбрасываются.
+def task_dicts(rows, fields: list[str]) -> list[dict]:
+    return [dict(zip(fields, row)) for row in rows]
+
+
+# Задача в формате schemas.TaskResponse
+def task_response(row, fields: list[str]) -> dict:
+    item = dict(zip(fields, row))
+    if "deadline" in item:
+        item["deadline"] = format_deadline(item["deadline"])
+    return item
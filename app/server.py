@@ -0,0 +1,192 @@
+# Запуск API в продакшене: python -m app.server [--workers N] [--host HOST] [--port PORT]
+#
+# Главный процесс один раз импортирует приложение (FastAPI, SQLAlchemy, модели, схемы pydantic)
+# и открывает сокет, а процессы API создает через fork: они получают уже загруженные модули
+# и начинают принимать запросы сразу после запуска lifespan. Соединения из общего сокета
+# распределяет между процессами ядро.
+#
+# Состояние, которое процессы должны разделять, создается до fork:
+# - версии данных пользователей для кэша ответов memory (cache.SharedVersions), поэтому
+#   изменение задач в любом процессе сбрасывает кэш пользователя во всех;
+# - версии пользователей в кэше principal_cache (cache.PrincipalCache): пользователь,
+#   удаленный или деактивированный через один процесс, теряет доступ во всех;
+# - планировщик дедлайнов работает только в процессе 0, остальные передают ему изменения
+#   задач через scheduler.OwnerChangePipe.
+# Воркер оповещений работает в каждом процессе: аренду пачки outbox он берет одним условным
+# UPDATE ... RETURNING (notifications.NotificationWorker._claim_batch), и запись, которую уже
+# арендовал другой процесс, ему не достается. Сами записи principal_cache и лимиты ratelimit
+# с хранилищем memory у каждого процесса свои, для общих лимитов нужен RATE_LIMIT_BACKEND=redis.
+#
+# SIGTERM или SIGINT главному процессу: процессы API перестают принимать соединения,
+# дожидаются начатых запросов и их фоновых задач (не дольше --graceful-timeout секунд),
+# затем lifespan останавливает воркер оповещений и планировщик и дописывает очередь-писатель
+# SQLite. Процесс, который не завершился и через LIFESPAN_SHUTDOWN_SECONDS после этого,
+# получает SIGKILL. Упавший процесс API запускается заново с тем же номером.
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+import uvicorn
+from .config import WEB_WORKERS, WEB_HOST, WEB_PORT, WEB_GRACEFUL_TIMEOUT, RATE_LIMIT_BACKEND, DEADLINE_SCHEDULER
+from .logger_config import setup_logger, stop_logger
+
+logger = logging.getLogger(__name__)
+
+# время на остановку фоновых воркеров в lifespan после того, как дождались запросов
+LIFESPAN_SHUTDOWN_SECONDS = 10
+# uvicorn завершает процесс с этим кодом, если не запустился lifespan
+STARTUP_FAILURE = 3
+# как часто главный процесс проверяет, не завершились ли процессы API
+POLL_SECONDS = 0.1
+# процесс, который упал быстрее, перезапускается с паузой, чтобы не перезапускать его в цикле
+MIN_UPTIME_SECONDS = 1
+# так процесс API завершается после SIGTERM или SIGINT
+NORMAL_EXIT_CODES = (0, -signal.SIGTERM, -signal.SIGINT)
+
+
+class Supervisor:
+    def __init__(self, config: uvicorn.Config, sock, workers: int, graceful_timeout: int):
+        self.config = config
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        # pid -> (номер процесса, время запуска)
+        self.children = {}
+        self.stopping = False
+        self.exit_code = 0
+
+    def spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            # логи процесса API настроит lifespan приложения (main.lifespan)
+            code = 1
+            try:
+                code = run_worker(self.config, self.sock, index)
+            except Exception:
+                logger.exception(f"Ошибка в процессе API {index}")
+            finally:
+                stop_logger()
+                os._exit(code)
+        self.children[pid] = (index, time.monotonic())
+        logger.info(f"Процесс API {index} запущен (pid {pid})")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    # Завершившиеся процессы API: [(номер, код выхода, время запуска)]
+    def reap(self) -> list[tuple[int, int, float]]:
+        exited = []
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            index, started_at = self.children.pop(pid)
+            exited.append((index, os.waitstatus_to_exitcode(status), started_at))
+        return exited
+
+    def run(self) -> int:
+        # обработчики ставятся до fork, чтобы SIGTERM во время запуска не оставил процессы без главного
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+        while not self.stopping:
+            for index, code, started_at in self.reap():
+                if code == STARTUP_FAILURE:
+                    # ошибка в настройках или базе: перезапуск не поможет
+                    logger.error(f"Процесс API {index} не запустился, остановка")
+                    self.stopping = True
+                    self.exit_code = 1
+                    break
+                logger.error(f"Процесс API {index} завершился с кодом {code}, перезапуск")
+                if time.monotonic() - started_at < MIN_UPTIME_SECONDS:
+                    time.sleep(MIN_UPTIME_SECONDS)
+                if not self.stopping:
+                    self.spawn(index)
+            time.sleep(POLL_SECONDS)
+        self.shutdown()
+        return self.exit_code
+
+    def shutdown(self):
+        logger.info(f"Остановка {len(self.children)} процессов API")
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + LIFESPAN_SHUTDOWN_SECONDS
+        while self.children and time.monotonic() < deadline:
+            for index, code, _ in self.reap():
+                if code not in NORMAL_EXIT_CODES:
+                    logger.error(f"Процесс API {index} завершился с кодом {code}")
+                    self.exit_code = 1
+            time.sleep(POLL_SECONDS)
+        for pid, (index, _) in self.children.items():
+            logger.error(f"Процесс API {index} не остановился за отведенное время, SIGKILL")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.exit_code = 1
+        self.children = {}
+
+
+def run_worker(config: uvicorn.Config, sock, index: int) -> int:
+    from .database import engine, async_engine
+    # главный процесс не открывает соединений с базой, но если бы открыл, дочерний
+    # не должен пользоваться ими: пулы начинаются заново, не закрывая чужие соединения
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+    config.app.state.run_scheduler = index == 0
+    server = uvicorn.Server(config)
+    # сигнал, пришедший до запуска uvicorn, тоже останавливает сервер, а не убивает процесс:
+    # uvicorn ставит этот же обработчик на время работы и возвращает его после
+    signal.signal(signal.SIGTERM, server.handle_exit)
+    signal.signal(signal.SIGINT, server.handle_exit)
+    try:
+        server.run(sockets=[sock])
+    except SystemExit as exc:
+        return exc.code if isinstance(exc.code, int) else 1
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.server", description="запуск API в нескольких процессах")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS, help="число процессов API")
+    parser.add_argument("--host", default=WEB_HOST)
+    parser.add_argument("--port", type=int, default=WEB_PORT)
+    parser.add_argument("--graceful-timeout", type=int, default=WEB_GRACEFUL_TIMEOUT,
+                        help="сколько секунд после SIGTERM ждать начатые запросы")
+    args = parser.parse_args(argv)
+
+    # приложение импортируется здесь, до fork, один раз для всех процессов
+    from .main import app
+    from . import auth
+    # то, что приложение загружает лениво при первом запросе, тоже загружается до fork,
+    # чтобы этого не делал каждый процесс API
+    auth.preload()
+    # fork из процесса с потоками может оставить дочернему процессу блокировку, захваченную
+    # другим потоком, поэтому главный процесс пишет логи без потока-слушателя
+    setup_logger(background=False)
+    from .cache import task_list_cache, principal_cache, MemoryBackend
+    from .scheduler import scheduler, OwnerChangePipe
+    if isinstance(task_list_cache, MemoryBackend):
+        task_list_cache.share_versions()
+    principal_cache.share_versions()
+    if DEADLINE_SCHEDULER == "inline" and args.workers > 1:
+        scheduler.remote = OwnerChangePipe()
+    if RATE_LIMIT_BACKEND == "memory" and args.workers > 1:
+        logger.warning(f"RATE_LIMIT_BACKEND=memory: лимиты считаются в каждом из {args.workers} процессов отдельно")
+
+    # время запросов и медленные запросы есть в /metrics, строка лога на каждый запрос не нужна
+    config = uvicorn.Config(app, host=args.host, port=args.port, log_config=None, access_log=False,
+                            timeout_graceful_shutdown=args.graceful_timeout)
+    # протоколы и middleware uvicorn тоже загружаются до fork
+    config.load()
+    sock = config.bind_socket()
+    return Supervisor(config, sock, args.workers, args.graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# Статистика задач пользователя для /tasks/stats: количество по статусу и приоритету и просроченные.
+#
+# Количество берется из task_stats (models.TaskStat), а не из GROUP BY по tasks: строки task_stats
+# обновляют триггеры в той же транзакции, в которой создается, меняется или удаляется задача,
+# поэтому запрос читает не больше 9 строк пользователя при любом числе задач.
+# Просроченные задачи зависят от текущего времени, а не только от записей в tasks, поэтому
+# их нельзя хранить счетчиком: они считаются по индексу ix_tasks_owner_id_deadline.
+#
+# Проверка и пересборка счетчиков (например, после ручных правок в базе с выключенными триггерами):
+#   python -m app.stats check    - сравнить task_stats с GROUP BY по tasks, код 1 при расхождениях
+#   python -m app.stats rebuild  - пересчитать task_stats заново
+
+import argparse
+import sys
+from sqlalchemy import select, func, delete, insert, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas
+from .scheduler import utcnow
+
+STAT_KEY = (models.TaskStat.owner_id, models.TaskStat.status, models.TaskStat.priority)
+
+
+async def task_stats(db: AsyncSession, owner_id: int) -> dict:
+    rows = (await db.execute(select(models.TaskStat.status, models.TaskStat.priority, models.TaskStat.count)
+                             .where(models.TaskStat.owner_id == owner_id, models.TaskStat.count > 0))).all()
+    overdue = await db.scalar(select(func.count()).select_from(models.Task).where(
+        models.Task.owner_id == owner_id, models.Task.deadline <= utcnow(),
+        models.Task.status != schemas.Status.completed))
+    by_status = dict.fromkeys((status.value for status in schemas.Status), 0)
+    by_priority = dict.fromkeys((priority.value for priority in schemas.Priority), 0)
+    for status, priority, count in rows:
+        # пустая строка в task_stats означает NULL в tasks
+        if status:
+            by_status[status] = by_status.get(status, 0) + count
+        if priority:
+            by_priority[priority] = by_priority.get(priority, 0) + count
+    return {"total": sum(row.count for row in rows), "by_status": by_status, "by_priority": by_priority,
+            "overdue": overdue}
+
+
+# Текущее количество задач по (owner_id, status, priority), посчитанное по самой таблице tasks
+def actual_counts():
+    status = func.coalesce(models.Task.status, "")
+    priority = func.coalesce(models.Task.priority, "")
+    return (select(models.Task.owner_id, status, priority, func.count())
+            .where(models.Task.owner_id.is_not(None)).group_by(models.Task.owner_id, status, priority))
+
+
+# Расхождения task_stats с tasks: [(owner_id, status, priority, в task_stats, на самом деле)]
+def check(conn: Connection) -> list[tuple]:
+    stored = {tuple(row[:3]): row[3] for row in conn.execute(select(*STAT_KEY, models.TaskStat.count))}
+    actual = {tuple(row[:3]): row[3] for row in conn.execute(actual_counts())}
+    return sorted((*key, stored.get(key, 0), actual.get(key, 0)) for key in stored.keys() | actual.keys()
+                  if stored.get(key, 0) != actual.get(key, 0))
+
+
+def rebuild(conn: Connection):
+    if conn.dialect.name == "postgresql":
+        # запись задач ждет конца пересборки, иначе триггер изменит строку, которую мы сейчас удалим
+        conn.execute(text("LOCK TABLE tasks IN SHARE MODE"))
+    conn.execute(delete(models.TaskStat))
+    conn.execute(insert(models.TaskStat).from_select([*STAT_KEY, models.TaskStat.count], actual_counts()))
+
+
+def main(argv: list[str] | None = None, engine=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.stats", description="проверка и пересборка task_stats")
+    parser.add_argument("command", choices=["check", "rebuild"])
+    args = parser.parse_args(argv)
+    if engine is None:
+        from .database import engine
+    # одна транзакция: и проверка, и пересборка видят один снимок tasks
+    with engine.begin() as conn:
+        if args.command == "rebuild":
+            rebuild(conn)
+            print("task_stats пересчитана")
+            return 0
+        mismatches = check(conn)
+    for owner_id, status, priority, stored, actual in mismatches:
+        print(f"owner_id={owner_id} status={status!r} priority={priority!r}: в task_stats {stored}, задач {actual}")
+    print(f"расхождений: {len(mismatches)}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+# Нагрузочный прогон основных эндпоинтов: register, login, create_task, get_task.
+# База заполняется N пользователями и M задачами у каждого, затем каждый сценарий
+# прогоняется напрямую через ASGI (без сети) и/или через uvicorn на нескольких уровнях нагрузки.
+# Для каждого прогона: req/s, p50/p95/p99 и SQL запросов на запрос (из app.metrics).
+#
+# Результаты сохраняются в JSON (--output). Если передан --baseline, прогон сравнивается
+# с сохраненным: падение req/s или рост p95 больше чем на --threshold считается регрессией,
+# и скрипт завершается с кодом 1.
+#
+# Запуск:
+#   python -m benchmarks.bench_api --users 100 --tasks 100 --output baseline.json
+#   python -m benchmarks.bench_api --users 100 --tasks 100 --baseline baseline.json --threshold 0.2
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+SCENARIOS = ["register", "login", "create_task", "get_task"]
+# маршрут в метриках (шаблон пути), по которому считается число SQL запросов
+ROUTES = {
+    "register": ("POST", "/users/"),
+    "login": ("POST", "/users/token"),
+    "create_task": ("POST", "/tasks/"),
+    "get_task": ("GET", "/tasks/{owner_id}"),
+}
+PASSWORD = "bench-password"
+SEED_CHUNK = 50000
+
+
+def configure(db_path: Path, bcrypt_rounds: int | None):
+    # Настройки приложения читаются при импорте app.config, поэтому задаем их до первого импорта app
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    if bcrypt_rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(bcrypt_rounds)
+    # иначе login и register упрутся в защиту от перебора, а не в производительность
+    for name in ("LOGIN_IP_PER_MINUTE", "LOGIN_USER_PER_MINUTE", "REGISTER_IP_PER_MINUTE", "API_IP_PER_MINUTE"):
+        os.environ[name] = "0"
+    # письма печатаются в консоль и засоряют вывод; записи outbox при этом все равно создаются
+    os.environ.setdefault("NOTIFICATION_WORKER", "off")
+    # медленные запросы под нагрузкой ожидаемы, их предупреждения только замедлят прогон
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+
+def seed(users: int, tasks: int) -> list[dict]:
+    from sqlalchemy import insert
+    from app import models, auth
+    from app.database import Base, engine
+
+    Base.metadata.create_all(engine)
+    # один хеш на всех: bcrypt для каждого пользователя занял бы минуты
+    hashed = auth.get_password_hash(PASSWORD)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"email": f"user{i}@bench.example", "hashed_password": hashed,
+                                            "is_active": True} for i in range(users)])
+        rows = ({"title": f"task {i}", "description": "описание", "owner_id": user_id,
+                 "priority": random.choice(["low", "medium", "high"]), "status": random.choice(["new", "completed"])}
+                for user_id in range(1, users + 1) for i in range(tasks))
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == SEED_CHUNK:
+                conn.execute(insert(models.Task), chunk)
+                chunk = []
+        if chunk:
+            conn.execute(insert(models.Task), chunk)
+    return [{"id": i + 1, "email": f"user{i}@bench.example"} for i in range(users)]
+
+
+# Запрос номер i сценария: (метод, путь, аргументы httpx)
+def build_requests(scenario: str, users: list[dict], run: str):
+    from app.auth import create_access_token
+
+    tokens = [{"Authorization": f"Bearer {create_access_token({'sub': user['email'], 'uid': user['id']})}"}
+              for user in users]
+    if scenario == "register":
+        return lambda i: ("POST", "/users/", {"json": {"email": f"new{run}-{i}@bench.example", "password": PASSWORD}})
+    if scenario == "login":
+        return lambda i: ("POST", "/users/token", {"data": {"username": users[i % len(users)]["email"], "password": PASSWORD}})
+    if scenario == "create_task":
+        return lambda i: ("POST", "/tasks/", {"json": {"title": f"{run} {i}", "priority": "high" if i % 10 == 0 else "medium"},
+                                              "headers": tokens[i % len(tokens)]})
+    filters = [{}, {"status": "new"}, {"priority": "high", "status": "completed"}, {"title": "task 1"}]
+    return lambda i: ("GET", "/tasks/1", {"params": filters[i % len(filters)], "headers": tokens[i % len(tokens)]})
+
+
+def percentile(values: list[float], p: float) -> float:
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+async def drive(client, make_request, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    queue = iter(range(requests))
+
+    async def client_loop():
+        nonlocal errors
+        for i in queue:
+            method, url, kwargs = make_request(i)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                response.raise_for_status()
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    if not latencies:
+        return {"rps": 0.0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "errors": errors}
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": errors,
+    }
+
+
+async def run_scenario(transport: str, base_url: str, scenario: str, users: list[dict], requests: int, concurrency: int) -> dict:
+    import httpx
+    from app.main import app
+    from app.metrics import metrics
+    from app.database import async_engine
+
+    histogram = metrics.statements[ROUTES[scenario]]
+    count, total = histogram.count, histogram.sum
+    make_request = build_requests(scenario, users, f"{transport}-{concurrency}")
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    if transport == "asgi":
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120)
+    else:
+        client = httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120)
+    async with client:
+        result = await drive(client, make_request, requests, concurrency)
+    if transport == "asgi":
+        # соединения пула привязаны к циклу событий этого прогона, следующий прогон начнет с новыми
+        await async_engine.dispose()
+    handled = histogram.count - count
+    result["sql_per_request"] = (histogram.sum - total) / handled if handled else None
+    return {"scenario": scenario, "transport": transport, "concurrency": concurrency, "requests": requests, **result}
+
+
+def serve(port: int):
+    import uvicorn
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def key(result: dict) -> tuple:
+    return result["scenario"], result["transport"], result["concurrency"]
+
+
+# Сравнение с сохраненным прогоном: возвращает описания регрессий
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[str]:
+    previous = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or not old["rps"] or result["p95_ms"] is None:
+            continue
+        name = "{} {} x{}".format(*key(result))
+        if result["rps"] < old["rps"] * (1 - threshold):
+            regressions.append(f"{name}: req/s {old['rps']:.1f} -> {result['rps']:.1f}")
+        if result["p95_ms"] > old["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {old['p95_ms']:.1f} ms -> {result['p95_ms']:.1f} ms")
+        if result["errors"] > old["errors"]:
+            regressions.append(f"{name}: ошибок {old['errors']} -> {result['errors']}")
+    return regressions
+
+
+def print_result(result: dict):
+    def ms(value):
+        return f"{value:>8.1f}" if value is not None else f"{'-':>8}"
+    sql = f"{result['sql_per_request']:>6.1f}" if result["sql_per_request"] is not None else f"{'-':>6}"
+    print(f"{result['scenario']:<12} {result['transport']:<8} {result['concurrency']:>5} {result['rps']:>9.1f} "
+          f"{ms(result['p50_ms'])} {ms(result['p95_ms'])} {ms(result['p99_ms'])} {sql} {result['errors']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="нагрузочный прогон API с проверкой регрессий")
+    parser.add_argument("--users", type=int, default=100, help="пользователей в базе")
+    parser.add_argument("--tasks", type=int, default=100, help="задач у каждого пользователя")
+    parser.add_argument("--requests", type=int, default=1000, help="запросов на каждый прогон")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 50])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--transport", choices=["asgi", "uvicorn", "both"], default="both")
+    parser.add_argument("--bcrypt-rounds", type=int, help="стоимость bcrypt (по умолчанию из BCRYPT_ROUNDS)")
+    parser.add_argument("--port", type=int, default=8103)
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора случайных чисел")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое ухудшение, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    transports = ["asgi", "uvicorn"] if args.transport == "both" else [args.transport]
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(Path(tmp) / "bench.db", args.bcrypt_rounds)
+        users = seed(args.users, args.tasks)
+        print(f"{args.users} пользователей, {args.tasks} задач у каждого, {args.requests} запросов на прогон")
+        print(f"{'scenario':<12} {'mode':<8} {'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'sql':>6} {'errors':>6}")
+        results = []
+        # сначала все прогоны через ASGI, потом uvicorn: асинхронный пул соединений приложения
+        # работает в одном цикле событий, а у uvicorn свой цикл в отдельном потоке
+        for transport in transports:
+            server = serve(args.port) if transport == "uvicorn" else None
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    result = asyncio.run(run_scenario(transport, f"http://127.0.0.1:{args.port}", scenario, users,
+                                                      args.requests, concurrency))
+                    print_result(result)
+                    results.append(result)
+            if server is not None:
+                server.should_exit = True
+
+    if args.output:
+        meta = {"users": args.users, "tasks": args.tasks, "requests": args.requests,
+                "python": platform.python_version(), "created_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        Path(args.output).write_text(json.dumps({"meta": meta, "results": results}, indent=2, ensure_ascii=False))
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text())["results"], args.threshold)
+        if regressions:
+            print(f"Регрессии (порог {args.threshold:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"Регрессий нет (порог {args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Сравнение синхронного и асинхронного доступа к базе под нагрузкой.
+# Оба приложения выполняют один и тот же запрос списка задач пользователя (как get_task),
+# отличаются только обработчик (def в пуле потоков или async def) и сессия (Session или AsyncSession).
+#
+# Запуск: python -m benchmarks.bench_async_db --tasks 200 --requests 2000 --concurrency 50 200 1000
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Depends
+from sqlalchemy import create_engine, select, insert
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app import models
+from app.database import Base, to_async_url
+
+
+def seed(url: str, tasks: int):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"email": "bench@example.com", "hashed_password": "x", "is_active": True}])
+        conn.execute(insert(models.Task), [{"title": f"task {i}", "owner_id": 1, "priority": "medium", "status": "new"}
+                                           for i in range(tasks)])
+    engine.dispose()
+
+
+def task_list_query():
+    return select(models.Task).where(models.Task.owner_id == 1)
+
+
+def build_sync_app(url: str) -> FastAPI:
+    engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 30})
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+
+    @app.get("/tasks")
+    def get_tasks(db: Session = Depends(get_db)):
+        return db.scalars(task_list_query()).all()
+
+    return app
+
+
+def build_async_app(url: str) -> FastAPI:
+    engine = create_async_engine(to_async_url(url), connect_args={"timeout": 30})
+    AsyncSessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+    async def get_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    app = FastAPI()
+
+    @app.get("/tasks")
+    async def get_tasks(db: AsyncSession = Depends(get_db)):
+        return (await db.scalars(task_list_query())).all()
+
+    return app
+
+
+def serve(app: FastAPI, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def drive(url: str, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    queue = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def client_loop():
+            nonlocal errors
+            for _ in queue:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else None,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sync vs async доступ к базе")
+    parser.add_argument("--tasks", type=int, default=200, help="задач у пользователя")
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на каждый уровень нагрузки")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200, 1000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        seed(url, args.tasks)
+        ports = {"sync": 8101, "async": 8102}
+        servers = [serve(build_sync_app(url), ports["sync"]), serve(build_async_app(url), ports["async"])]
+        print(f"{'mode':<6} {'clients':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for concurrency in args.concurrency:
+            for mode in ("sync", "async"):
+                result = asyncio.run(drive(f"http://127.0.0.1:{ports[mode]}/tasks", args.requests, concurrency))
+                print(f"{mode:<6} {concurrency:>7} {result['rps']:>9.1f} {result['p50_ms']:>9.1f} "
+                      f"{result['p99_ms']:>9.1f} {result['errors']:>7}")
+        for server in servers:
+            server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# Дедлайны на большой базе (по умолчанию 1 000 000 задач у 1000 пользователей).
+# Дедлайны смешанные: у части задач их нет, часть уже прошла, остальные равномерно
+# распределены по ближайшим 30 дням; часть задач выполнена.
+#
+# listing: запрос /tasks/due и /tasks/overdue одного пользователя по индексу (owner_id, deadline)
+#   и тот же запрос по прежнему индексу (owner_id, id), как было до индекса по дедлайну.
+# global: задачи всех пользователей с дедлайном в ближайший час (ix_tasks_deadline и полный просмотр).
+# scheduler: загрузка окна в кучу, перечитывание задач пользователя после изменения
+#   и извлечение событий из кучи за все окно.
+#
+# Запуск: python -m benchmarks.bench_deadlines --users 1000 --tasks 1000
+
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app import models
+from app.database import Base, to_async_url
+from app.scheduler import DeadlineScheduler, utcnow
+
+SEED_CHUNK = 50000
+
+DUE = ("SELECT id, title, deadline FROM tasks {hint} WHERE owner_id = :owner AND deadline > :now "
+       "AND deadline <= :end AND status != 'completed' ORDER BY deadline, id LIMIT 100")
+OVERDUE = ("SELECT id, title, deadline FROM tasks {hint} WHERE owner_id = :owner AND deadline <= :now "
+           "AND status != 'completed' ORDER BY deadline, id LIMIT 100")
+GLOBAL = "SELECT count(*) FROM tasks {hint} WHERE deadline > :now AND deadline <= :end AND status != 'completed'"
+
+
+def seed(url: str, users: int, tasks: int):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    now = utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"email": f"user{i}@bench.example", "hashed_password": "x", "is_active": True}
+                                           for i in range(users)])
+
+        def deadline():
+            kind = random.random()
+            if kind < 0.2:
+                return None
+            if kind < 0.4:
+                return now - timedelta(seconds=random.uniform(0, 30 * 86400))
+            return now + timedelta(seconds=random.uniform(0, 30 * 86400))
+        rows = ({"title": f"task {i}", "owner_id": owner, "priority": "medium", "deadline": deadline(),
+                 "status": random.choice(["new", "in progress", "completed"])}
+                for owner in range(1, users + 1) for i in range(tasks))
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == SEED_CHUNK:
+                conn.execute(insert(models.Task), chunk)
+                chunk = []
+        if chunk:
+            conn.execute(insert(models.Task), chunk)
+        conn.execute(text("ANALYZE"))
+    engine.dispose()
+
+
+def timed(conn, sql: str, params_list: list[dict]) -> str:
+    latencies = []
+    for params in params_list:
+        start = time.perf_counter()
+        conn.execute(text(sql), params).all()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return f"{statistics.median(latencies) * 1000:>9.2f} {latencies[int(len(latencies) * 0.95) - 1] * 1000:>9.2f}"
+
+
+def measure_queries(url: str, users: int, requests: int):
+    engine = create_engine(url)
+    now = utcnow()
+    owners = [{"owner": random.randint(1, users), "now": now, "end": now + timedelta(hours=24)} for _ in range(requests)]
+    print(f"{'query':<22} {'index':<28} {'p50 ms':>9} {'p95 ms':>9}")
+    with engine.connect() as conn:
+        for name, sql in (("due (24h)", DUE), ("overdue", OVERDUE)):
+            for index in ("ix_tasks_owner_id_deadline", "ix_tasks_owner_id_id"):
+                print(f"{name:<22} {index:<28} {timed(conn, sql.format(hint=f'INDEXED BY {index}'), owners)}")
+        hour = [{"now": now, "end": now + timedelta(hours=1)}] * min(requests, 20)
+        print(f"{'all users, next hour':<22} {'ix_tasks_deadline':<28} {timed(conn, GLOBAL.format(hint='INDEXED BY ix_tasks_deadline'), hour)}")
+        print(f"{'all users, next hour':<22} {'NOT INDEXED':<28} {timed(conn, GLOBAL.format(hint='NOT INDEXED'), hour)}")
+    engine.dispose()
+
+
+async def measure_scheduler(url: str, users: int, horizon_hours: float, requests: int):
+    engine = create_async_engine(to_async_url(url))
+    events = 0
+
+    async def sink(batch):
+        nonlocal events
+        events += len(batch)
+    scheduler = DeadlineScheduler(async_sessionmaker(engine, expire_on_commit=False), sink=sink,
+                                  horizon_seconds=horizon_hours * 3600)
+    now = utcnow()
+    start = time.perf_counter()
+    await scheduler.load_window(now)
+    print(f"загрузка окна {horizon_hours:g} ч: {(time.perf_counter() - start) * 1000:.1f} ms, "
+          f"{scheduler.stats()['scheduled_tasks']} задач, {scheduler.stats()['heap_size']} записей в куче")
+
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await scheduler.reload_owners({random.randint(1, users)})
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"перечитывание задач пользователя: p50 {statistics.median(latencies) * 1000:.2f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.2f} ms")
+
+    # проходим окно шагами по минуте, как если бы планировщик просыпался на каждом событии
+    start = time.perf_counter()
+    step = now
+    while step < now + timedelta(hours=horizon_hours):
+        step += timedelta(minutes=1)
+        await scheduler.run_once(step)
+    elapsed = time.perf_counter() - start
+    print(f"события за окно: {events} за {elapsed * 1000:.1f} ms, {scheduler.batches} пачек")
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="запросы по дедлайнам и планировщик на большой базе")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tasks", type=int, default=1000, help="задач у каждого пользователя")
+    parser.add_argument("--requests", type=int, default=200, help="запросов на каждый вариант")
+    parser.add_argument("--horizon-hours", type=float, default=6, help="окно планировщика")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        start = time.perf_counter()
+        seed(url, args.users, args.tasks)
+        print(f"{args.users * args.tasks} задач у {args.users} пользователей, "
+              f"заполнение {time.perf_counter() - start:.0f} s")
+        measure_queries(url, args.users, args.requests)
+        asyncio.run(measure_scheduler(url, args.users, args.horizon_hours, args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Пиковая память процесса при выгрузке всех задач пользователя.
+# stream: настоящий эндпоинт /tasks/export (NDJSON или CSV), тело ответа читается и выбрасывается по кускам.
+# list: прежний подход get_task без лимита, когда все задачи загружаются объектами и сериализуются разом.
+# Каждый режим запускается в отдельном процессе, чтобы ru_maxrss относился только к нему.
+#
+# Запуск: python -m benchmarks.bench_export --rows 1000000
+
+import argparse
+import asyncio
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app import models
+from app.database import Base, to_async_url
+
+SEED_CHUNK = 50000
+
+
+def seed(url: str, rows: int):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"email": "bench@example.com", "hashed_password": "x", "is_active": True}])
+        for start in range(0, rows, SEED_CHUNK):
+            conn.execute(insert(models.Task), [
+                {"title": f"task {i}", "description": "описание задачи " * 4, "owner_id": 1,
+                 "priority": "medium", "status": "new"}
+                for i in range(start, min(start + SEED_CHUNK, rows))])
+    engine.dispose()
+
+
+def peak_rss_mb() -> float:
+    # на Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def measure_stream(url: str, format: str) -> int:
+    from app.main import app
+    from app.database import get_db
+    from app.auth import create_access_token
+
+    session_factory = async_sessionmaker(create_async_engine(to_async_url(url)), expire_on_commit=False)
+
+    async def override_get_db():
+        async with session_factory() as db:
+            yield db
+    app.dependency_overrides[get_db] = override_get_db
+
+    token = create_access_token({"sub": "bench@example.com"})
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": "/tasks/export", "raw_path": b"/tasks/export",
+             "query_string": f"format={format}".encode(), "root_path": "", "server": ("bench", 80),
+             "client": ("bench", 1), "headers": [(b"authorization", f"Bearer {token}".encode())]}
+    received = 0
+    request_sent = False
+    finished = asyncio.Event()
+
+    async def receive():
+        # тело запроса пустое; дальше, как настоящий сервер, ждем отключения клиента,
+        # которое наступает только после отправки ответа
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal received
+        if message["type"] == "http.response.body":
+            received += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return received
+
+
+async def measure_list(url: str) -> int:
+    from fastapi.encoders import jsonable_encoder
+    import json
+
+    session_factory = async_sessionmaker(create_async_engine(to_async_url(url)), expire_on_commit=False)
+    async with session_factory() as db:
+        tasks = (await db.scalars(select(models.Task).where(models.Task.owner_id == 1))).all()
+        return len(json.dumps(jsonable_encoder(tasks)).encode())
+
+
+def run_measure(mode: str, url: str, format: str):
+    start = time.perf_counter()
+    if mode == "stream":
+        size = asyncio.run(measure_stream(url, format))
+    else:
+        size = asyncio.run(measure_list(url))
+    print(f"{mode}\t{size}\t{time.perf_counter() - start:.2f}\t{peak_rss_mb():.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="пиковая память выгрузки задач")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--measure", choices=["stream", "list"], help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        run_measure(args.measure, args.db, args.format)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        seed(url, args.rows)
+        print(f"{args.rows} задач, формат {args.format}")
+        print(f"{'mode':<8} {'bytes':>12} {'seconds':>8} {'peak RSS MB':>12}")
+        for mode in ("stream", "list"):
+            output = subprocess.run([sys.executable, "-m", "benchmarks.bench_export", "--measure", mode,
+                                     "--db", url, "--format", args.format],
+                                    check=True, capture_output=True, text=True).stdout
+            name, size, seconds, rss = output.strip().splitlines()[-1].split("\t")
+            print(f"{name:<8} {int(size):>12} {float(seconds):>8.2f} {float(rss):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
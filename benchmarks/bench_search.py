@@ -0,0 +1,141 @@
+# Полнотекстовый поиск GET /tasks/search на большой базе (по умолчанию 1 000 000 задач у 1000 пользователей).
+# Слова в названиях и описаниях берутся из словаря с распределением Ципфа: есть очень частые слова
+# и редкие, как в настоящих текстах. Запросы идут в приложение напрямую через ASGI, без сети.
+#
+# Для каждого вида запроса печатаются p50/p95. Если p95 хоть одного вида больше --target-p95-ms,
+# скрипт завершается с кодом 1, поэтому его можно запускать как проверку.
+#
+# Запуск: python -m benchmarks.bench_search --users 1000 --tasks 1000 --target-p95-ms 50
+
+import argparse
+import asyncio
+import itertools
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app import models
+from app.database import Base, to_async_url
+
+SEED_CHUNK = 50000
+WARMUP = 20
+SYLLABLES = ["ка", "ро", "ми", "ла", "те", "ну", "во", "се", "да", "пи", "ко", "ре", "ма", "ли", "то", "бу"]
+
+
+def make_vocabulary(size: int) -> tuple[list[str], list[float]]:
+    words = ["".join(parts) for length in (2, 3, 4) for parts in itertools.product(SYLLABLES, repeat=length)]
+    words = random.sample(words, size)
+    return words, [1 / (rank + 1) for rank in range(size)]
+
+
+def seed(url: str, users: int, tasks: int, words: list[str], weights: list[float]) -> float:
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"email": f"user{i}@bench.example", "hashed_password": "x", "is_active": True}
+                                           for i in range(users)])
+        for owner in range(1, users + 1, max(SEED_CHUNK // tasks, 1)):
+            owners = range(owner, min(owner + max(SEED_CHUNK // tasks, 1), users + 1))
+            sample = iter(random.choices(words, weights, k=len(owners) * tasks * 15))
+            # номер в конце названия делает его уникальным у пользователя
+            conn.execute(insert(models.Task), [
+                {"title": " ".join(itertools.islice(sample, 3)) + f" {i}",
+                 "description": " ".join(itertools.islice(sample, 12)), "owner_id": owner_id}
+                for owner_id in owners for i in range(tasks)])
+    engine.dispose()
+    return time.perf_counter() - start
+
+
+def queries(words: list[str]) -> dict:
+    frequent, middle, rare = words[:20], words[100:1000], words[-1000:]
+    return {
+        "frequent word": lambda: random.choice(frequent),
+        "two words": lambda: f"{random.choice(frequent)} {random.choice(middle)}",
+        "rare word": lambda: random.choice(rare),
+        "prefix": lambda: random.choice(middle)[:3] + "*",
+        "frequent, page 2": lambda: random.choice(frequent),
+    }
+
+
+async def measure(url: str, users: int, words: list[str], requests: int, limit: int) -> dict:
+    from app.main import app
+    from app.database import get_db
+    from app.auth import create_access_token
+
+    session_factory = async_sessionmaker(create_async_engine(to_async_url(url)), expire_on_commit=False)
+
+    async def override_get_db():
+        async with session_factory() as db:
+            yield db
+    app.dependency_overrides[get_db] = override_get_db
+
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for name, make_query in queries(words).items():
+            latencies, found = [], 0
+            # первые запросы читают страницы индекса с диска, их не считаем
+            for i in range(requests + WARMUP):
+                owner = random.randint(1, users)
+                headers = {"Authorization": f"Bearer {create_access_token({'sub': f'user{owner - 1}@bench.example'})}"}
+                params = {"q": make_query(), "limit": limit}
+                if name.endswith("page 2"):
+                    first = await client.get("/tasks/search", params=params, headers=headers)
+                    if "X-Next-Cursor" not in first.headers:
+                        continue
+                    params["cursor"] = first.headers["X-Next-Cursor"]
+                start = time.perf_counter()
+                response = await client.get("/tasks/search", params=params, headers=headers)
+                elapsed = time.perf_counter() - start
+                response.raise_for_status()
+                if i >= WARMUP:
+                    latencies.append(elapsed)
+                    found += len(response.json())
+            latencies.sort()
+            results[name] = (statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.95) - 1] * 1000,
+                             found / len(latencies))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="задержка полнотекстового поиска на большой базе")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tasks", type=int, default=1000, help="задач у каждого пользователя")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="разных слов в текстах")
+    parser.add_argument("--requests", type=int, default=200, help="запросов каждого вида")
+    parser.add_argument("--limit", type=int, default=20, help="задач на странице")
+    parser.add_argument("--target-p95-ms", type=float, default=50, help="допустимый p95 для каждого вида запроса")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    words, weights = make_vocabulary(args.vocabulary)
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        seconds = seed(url, args.users, args.tasks, words, weights)
+        total = args.users * args.tasks
+        print(f"{total} задач у {args.users} пользователей, вставка с индексацией {seconds:.0f} s "
+              f"({total / seconds:.0f} задач/s)")
+        results = asyncio.run(measure(url, args.users, words, args.requests, args.limit))
+
+    print(f"{'query':<18} {'p50 ms':>9} {'p95 ms':>9} {'found':>7}")
+    slow = []
+    for name, (p50, p95, found) in results.items():
+        print(f"{name:<18} {p50:>9.2f} {p95:>9.2f} {found:>7.1f}")
+        if p95 > args.target_p95_ms:
+            slow.append(name)
+    if slow:
+        print(f"p95 больше {args.target_p95_ms:g} ms: {', '.join(slow)}")
+        sys.exit(1)
+    print(f"все запросы укладываются в p95 {args.target_p95_ms:g} ms")
+
+
+if __name__ == "__main__":
+    main()
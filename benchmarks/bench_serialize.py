@@ -0,0 +1,81 @@
+# Стоимость сериализации списка задач (по умолчанию 10 000 строк), без базы и HTTP.
+# pydantic: TaskResponse.model_validate из объектов и json.dumps (валидация + strftime на строку).
+# jsonable: словари из кортежей колонок, jsonable_encoder и json.dumps (прежний get_task).
+# fast-json: app.serializers без orjson (словари из кортежей + json.dumps).
+# fast-orjson: app.serializers с orjson (текущий get_task).
+# task_response: словари в формате TaskResponse (deadline "%H:%M:%d:%m:%Y") + orjson.
+#
+# Запуск: python -m benchmarks.bench_serialize --tasks 10000 --rounds 20
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from fastapi.encoders import jsonable_encoder
+
+from app import schemas, serializers
+from app.main import TASK_FIELDS
+
+
+def make_rows(count: int) -> list[tuple]:
+    start = datetime(2030, 1, 1)
+    return [(f"task {i}", "описание задачи", random.choice(["new", "in progress", "completed"]),
+             random.choice(["low", "medium", "high"]), start + timedelta(minutes=i) if i % 2 else None, i + 1, 1)
+            for i in range(count)]
+
+
+def run(name: str, rows: list[tuple], rounds: int, serialize) -> None:
+    size = len(serialize(rows))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        serialize(rows)
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"{name:<14} {elapsed * 1000:>14.1f} {elapsed / len(rows) * 1e6:>10.2f} {size / 1024:>10.0f}")
+
+
+def pydantic_path(rows):
+    objects = [SimpleNamespace(**dict(zip(TASK_FIELDS, row))) for row in rows]
+    return json.dumps([schemas.TaskResponse.model_validate(obj).model_dump(mode="json") for obj in objects],
+                      ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def jsonable_path(rows):
+    return json.dumps(jsonable_encoder([dict(zip(TASK_FIELDS, row)) for row in rows]),
+                      ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def fast_path(rows):
+    return serializers.dumps(serializers.task_dicts(rows, TASK_FIELDS))
+
+
+def task_response_path(rows):
+    return serializers.dumps([serializers.task_response(row, TASK_FIELDS) for row in rows])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="стоимость сериализации списка задач")
+    parser.add_argument("--tasks", type=int, default=10000, help="задач в ответе")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(1)
+    # дедлайны в будущем: TaskResponse проверяет это при валидации
+    rows = make_rows(args.tasks)
+    print(f"{args.tasks} задач, поля: {', '.join(TASK_FIELDS)}")
+    print(f"{'mode':<14} {'ms per list':>14} {'us/task':>10} {'KiB':>10}")
+    run("pydantic", rows, args.rounds, pydantic_path)
+    run("jsonable", rows, args.rounds, jsonable_path)
+    orjson = serializers.orjson
+    serializers.orjson = None
+    run("fast-json", rows, args.rounds, fast_path)
+    serializers.orjson = orjson
+    if orjson is not None:
+        run("fast-orjson", rows, args.rounds, fast_path)
+        run("task_response", rows, args.rounds, task_response_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Пропускная способность записи в SQLite: настройки по умолчанию против профиля production.
+# default: каждая запись в своей сессии из общего пула и свой commit (как раньше в create_task).
+# production: WAL + PRAGMA и очередь-писатель, которая объединяет одновременные записи в один commit.
+#
+# Запуск: python -m benchmarks.bench_sqlite_writes --writers 50 --writes 40
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app import models
+from app.database import Base, to_async_url, apply_sqlite_profile, create_write_queue
+
+
+def prepare(url: str):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"email": "bench@example.com", "hashed_password": "x", "is_active": True}])
+    engine.dispose()
+
+
+def make_write(i: int):
+    async def write(db):
+        db.add(models.Task(title=f"task {i}", owner_id=1, priority="medium", status="new"))
+        await db.flush()
+    return write
+
+
+async def run_default(url: str, writers: int, writes: int) -> int:
+    engine = create_async_engine(to_async_url(url), connect_args={"timeout": 30}, pool_size=writers, max_overflow=0)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    errors = 0
+
+    async def writer(n):
+        nonlocal errors
+        for i in range(writes):
+            try:
+                async with session_factory() as db:
+                    await make_write(n * writes + i)(db)
+                    await db.commit()
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*(writer(n) for n in range(writers)))
+    await engine.dispose()
+    return errors
+
+
+async def run_production(url: str, writers: int, writes: int) -> int:
+    queue = create_write_queue(url, "production")
+    errors = 0
+
+    async def writer(n):
+        nonlocal errors
+        for i in range(writes):
+            try:
+                await queue.submit(make_write(n * writes + i))
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*(writer(n) for n in range(writers)))
+    await queue.close()
+    print(f"  production: {queue.jobs} записей в {queue.commits} транзакциях")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="пропускная способность записи в SQLite")
+    parser.add_argument("--writers", type=int, default=50, help="одновременных писателей")
+    parser.add_argument("--writes", type=int, default=40, help="записей на писателя")
+    args = parser.parse_args()
+    total = args.writers * args.writes
+
+    print(f"{'profile':<11} {'writes':>7} {'seconds':>8} {'writes/s':>9} {'errors':>7}")
+    for profile, run in (("default", run_default), ("production", run_production)):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = f"sqlite:///{Path(tmp) / 'bench.db'}"
+            prepare(url)
+            if profile == "production":
+                # WAL включается на файле один раз и сохраняется
+                tuned = create_engine(url)
+                apply_sqlite_profile(tuned, "production")
+                tuned.connect().close()
+                tuned.dispose()
+            start = time.perf_counter()
+            errors = asyncio.run(run(url, args.writers, args.writes))
+            elapsed = time.perf_counter() - start
+            print(f"{profile:<11} {total:>7} {elapsed:>8.2f} {(total - errors) / elapsed:>9.1f} {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
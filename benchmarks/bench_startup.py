@@ -0,0 +1,142 @@
+# Время запуска API: от запуска процесса до первого обслуженного запроса.
+#
+# Варианты:
+#   app.server    - python -m app.server: приложение импортируется один раз, процессы API создаются fork
+#   uvicorn       - python -m uvicorn app.main:app --workers N: каждый процесс запускается заново
+#                   (spawn) и сам импортирует приложение
+# Для каждого варианта (медиана по --repeat запускам):
+#   first request - от запуска команды до первого ответа 200 на GET /metrics
+#   all workers   - пока все N процессов не закончат запуск lifespan (строки "Application startup complete")
+#   respawn       - от SIGKILL одному процессу API до готовности процесса, который его заменил
+#   shutdown      - от SIGTERM главному процессу до его завершения (без запросов в работе)
+#
+# Запуск: python -m benchmarks.bench_startup --workers 4 --repeat 5
+
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy import create_engine
+
+from app.server import MIN_UPTIME_SECONDS
+
+READY_LINE = "Application startup complete"
+TIMEOUT = 60
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def commands(workers: int, port: int) -> dict:
+    return {
+        "app.server": [sys.executable, "-m", "app.server", "--workers", str(workers), "--host", "127.0.0.1",
+                       "--port", str(port)],
+        "uvicorn": [sys.executable, "-m", "uvicorn", "app.main:app", "--workers", str(workers), "--host", "127.0.0.1",
+                    "--port", str(port)],
+    }
+
+
+class Run:
+    def __init__(self, command: list[str], env: dict):
+        self.started_at = time.perf_counter()
+        self.process = subprocess.Popen(command, env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+        # время каждой строки о готовности процесса API
+        self.ready_at = []
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        for line in self.process.stderr:
+            if READY_LINE in line:
+                self.ready_at.append(time.perf_counter())
+
+    def wait_ready(self, count: int) -> float:
+        deadline = time.perf_counter() + TIMEOUT
+        while len(self.ready_at) < count:
+            if time.perf_counter() > deadline or self.process.poll() is not None:
+                raise RuntimeError("процессы API не запустились")
+            time.sleep(0.001)
+        return self.ready_at[count - 1]
+
+    def worker_pids(self) -> list[int]:
+        output = subprocess.run(["ps", "--ppid", str(self.process.pid), "-o", "pid=,args="],
+                                capture_output=True, text=True).stdout
+        # у uvicorn есть еще служебный процесс multiprocessing (resource_tracker)
+        return [int(line.split()[0]) for line in output.splitlines() if "resource_tracker" not in line]
+
+
+def measure(command: list[str], env: dict, port: int, workers: int) -> dict:
+    run = Run(command, env)
+    try:
+        while True:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/metrics").status_code == 200:
+                    break
+            except httpx.TransportError:
+                time.sleep(0.001)
+            if time.perf_counter() - run.started_at > TIMEOUT:
+                raise RuntimeError("сервер не ответил")
+        result = {"first request": time.perf_counter() - run.started_at,
+                  "all workers": run.wait_ready(workers) - run.started_at}
+
+        # app.server перезапускает процесс, проживший меньше MIN_UPTIME_SECONDS, с паузой
+        time.sleep(MIN_UPTIME_SECONDS)
+        killed_at = time.perf_counter()
+        os.kill(run.worker_pids()[0], signal.SIGKILL)
+        result["respawn"] = run.wait_ready(workers + 1) - killed_at
+
+        stop_at = time.perf_counter()
+        run.process.send_signal(signal.SIGTERM)
+        run.process.wait(timeout=TIMEOUT)
+        result["shutdown"] = time.perf_counter() - stop_at
+        return result
+    finally:
+        if run.process.poll() is None:
+            run.process.kill()
+            run.process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="время запуска API в нескольких процессах")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        from app.database import Base
+        from app import models  # noqa: F401 (таблицы регистрируются в Base при импорте)
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        engine.dispose()
+        env = {**os.environ, "DATABASE_URL": url, "LOG_LEVEL": "INFO", "LOG_MODE": "dev"}
+
+        results = {}
+        for name in commands(args.workers, 0):
+            runs = []
+            for _ in range(args.repeat):
+                port = free_port()
+                runs.append(measure(commands(args.workers, port)[name], env, port, args.workers))
+            results[name] = {key: statistics.median(run[key] for run in runs) * 1000 for key in runs[0]}
+
+    print(f"{args.workers} процессов API, медиана {args.repeat} запусков, ms")
+    print(f"{'launcher':<12} {'first request':>14} {'all workers':>12} {'respawn':>9} {'shutdown':>9}")
+    for name, result in results.items():
+        print(f"{name:<12} {result['first request']:>14.0f} {result['all workers']:>12.0f} "
+              f"{result['respawn']:>9.0f} {result['shutdown']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Задержка изменения одной задачи, когда у пользователя много задач.
+# id: PATCH/DELETE /tasks/id/{task_id}, поиск по первичному ключу.
+# title: PATCH/DELETE /tasks/{title}, маршруты-псевдонимы через уникальный индекс (owner_id, title).
+# Запросы идут в приложение напрямую через ASGI, без сети.
+#
+# Запуск: python -m benchmarks.bench_task_mutations --tasks 100000 --requests 2000
+
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app import models
+from app.database import Base, to_async_url
+
+SEED_CHUNK = 50000
+
+
+def seed(url: str, tasks: int):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"email": "bench@example.com", "hashed_password": "x", "is_active": True}])
+        for start in range(0, tasks, SEED_CHUNK):
+            conn.execute(insert(models.Task), [{"title": f"task {i}", "owner_id": 1, "priority": "medium", "status": "new"}
+                                               for i in range(start, min(start + SEED_CHUNK, tasks))])
+    engine.dispose()
+
+
+def summary(latencies: list[float]) -> str:
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    return f"{p50:>9.2f} {p95:>9.2f}"
+
+
+async def measure(url: str, tasks: int, requests: int):
+    from app.main import app
+    from app.database import get_db
+    from app.auth import create_access_token
+
+    session_factory = async_sessionmaker(create_async_engine(to_async_url(url)), expire_on_commit=False)
+
+    async def override_get_db():
+        async with session_factory() as db:
+            yield db
+    app.dependency_overrides[get_db] = override_get_db
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'bench@example.com'})}"}
+    # задачи для удаления не пересекаются, чтобы каждый DELETE находил свою задачу
+    ids = random.sample(range(tasks), requests * 2)
+    routes = {
+        "id": lambda i: f"/tasks/id/{i + 1}",
+        "title": lambda i: f"/tasks/task {i}",
+    }
+    print(f"{'route':<6} {'method':<7} {'p50 ms':>9} {'p95 ms':>9}")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for offset, (name, path) in enumerate(routes.items()):
+            latencies = []
+            for i in ids[:requests]:
+                start = time.perf_counter()
+                response = await client.patch(path(i), json={"status": random.choice(["new", "completed"])}, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+            print(f"{name:<6} {'PATCH':<7} {summary(latencies)}")
+            latencies = []
+            for i in ids[requests + offset::2][:requests // 2]:
+                start = time.perf_counter()
+                response = await client.delete(path(i), headers=headers)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+            print(f"{name:<6} {'DELETE':<7} {summary(latencies)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="задержка изменения задачи по id и по названию")
+    parser.add_argument("--tasks", type=int, default=100000, help="задач у пользователя")
+    parser.add_argument("--requests", type=int, default=2000, help="запросов PATCH на каждый маршрут")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        seed(url, args.tasks)
+        print(f"{args.tasks} задач у пользователя")
+        asyncio.run(measure(url, args.tasks, args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# Скорость проверки токенов в get_current_user.
+# jose: прежний путь, jwt.decode с проверкой подписи на каждый запрос.
+# verifier-miss: TokenVerifier для токена, которого еще нет в кэше (выбор ключа по kid + jwt.decode).
+# verifier-hit: TokenVerifier для уже проверенного токена (claims из кэша до exp).
+#
+# Запуск: python -m benchmarks.bench_token_decode --tokens 1000 --rounds 20
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from jose import jwt
+
+from app.auth import TokenVerifier, SECRET_KEY, ALGORITHM, DEFAULT_KID
+
+
+def make_tokens(count: int) -> list[str]:
+    verifier = TokenVerifier({DEFAULT_KID: SECRET_KEY}, DEFAULT_KID)
+    expire = datetime.utcnow() + timedelta(minutes=30)
+    return [verifier.encode({"sub": f"user{i}@example.com", "uid": i, "exp": expire}) for i in range(count)]
+
+
+def run(name: str, tokens: list[str], rounds: int, decode, before_round=None) -> None:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if before_round is not None:
+            before_round()
+        for token in tokens:
+            decode(token)
+    elapsed = time.perf_counter() - start
+    total = len(tokens) * rounds
+    print(f"{name:<15} {total / elapsed:>12.0f} {elapsed / total * 1e6:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="скорость проверки JWT")
+    parser.add_argument("--tokens", type=int, default=1000, help="разных токенов (пользователей)")
+    parser.add_argument("--rounds", type=int, default=20, help="сколько раз проверяется каждый токен")
+    args = parser.parse_args()
+
+    tokens = make_tokens(args.tokens)
+    verifier = TokenVerifier({DEFAULT_KID: SECRET_KEY}, DEFAULT_KID, cache_size=args.tokens)
+    print(f"{'mode':<15} {'decodes/s':>12} {'us/decode':>10}")
+    run("jose", tokens, args.rounds, lambda token: jwt.decode(token, SECRET_KEY, algorithms=ALGORITHM))
+    run("verifier-miss", tokens, args.rounds, verifier.decode, before_round=verifier.cache.clear)
+    verifier.cache.clear()
+    for token in tokens:
+        verifier.decode(token)
+    run("verifier-hit", tokens, args.rounds, verifier.decode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Тесты настроек SQLite и очереди-писателя из app/database.py
+import asyncio
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event, select, func, insert
+
+from app import models
+from app.database import apply_sqlite_profile, create_write_queue, engine_options, pool_stats
+
+
+def test_production_profile_pragmas(sqlite_only, engine, database_url):
+    tuned = create_engine(database_url)
+    apply_sqlite_profile(tuned, "production")
+    with tuned.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        # 1 это NORMAL
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 30000
+    tuned.dispose()
+
+
+def test_default_profile_keeps_driver_settings(sqlite_only, engine, database_url):
+    plain = create_engine(database_url)
+    apply_sqlite_profile(plain, "default")
+    with plain.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "delete"
+    plain.dispose()
+    assert create_write_queue(database_url, "default") is None
+
+
+def test_write_queue_group_commit(sqlite_only, session, database_url):
+    session.add(models.User(email="writer@example.com", hashed_password="x"))
+    session.commit()
+    queue = create_write_queue(database_url, "production")
+    commits = []
+    event.listen(queue.session_factory.kw["bind"].sync_engine, "commit", lambda conn: commits.append(1))
+
+    def insert_task(title):
+        async def write(db):
+            if title == "bad":
+                raise HTTPException(status_code=400)
+            return (await db.execute(insert(models.Task).values(title=title, owner_id=1).returning(models.Task.id))).scalar()
+        return write
+
+    async def run():
+        titles = [f"t{i}" for i in range(20)] + ["bad"]
+        results = await asyncio.gather(*(queue.submit(insert_task(title)) for title in titles), return_exceptions=True)
+        await queue.close()
+        return results
+
+    results = asyncio.run(run())
+    # ошибка одного задания откатила только его SAVEPOINT
+    assert isinstance(results[-1], HTTPException)
+    assert all(isinstance(result, int) for result in results[:-1])
+    assert session.scalar(select(func.count(models.Task.id))) == 20
+    # 20 одновременных записей зафиксированы меньшим числом транзакций
+    assert queue.jobs == 21
+    assert len(commits) == queue.commits < 20
+
+
+def test_pool_checkout_wait_is_recorded(database_url, engine):
+    checkouts = pool_stats.checkouts
+    pooled = create_engine(database_url, **engine_options(database_url))
+    for _ in range(3):
+        with pooled.connect() as conn:
+            conn.exec_driver_sql("SELECT 1")
+    pooled.dispose()
+    assert pool_stats.checkouts == checkouts + 3
+    assert pool_stats.stats()["wait_seconds_max"] >= 0
@@ -1,33 +1,104 @@
-from app import models
+from app import models, schemas, serializers
+from app.cache import principal_cache, task_list_cache, RedisBackend, MemoryBackend
+from app import main
+from app import auth
 from unittest.mock import patch
+from jose import JWTError, jwt
+import asyncio
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.requests import Request
+from app.scheduler import DeadlineScheduler, utcnow
+from app.notifications import NotificationWorker, ConsoleSender, enqueue_high_priority
 #from app.auth import create_access_token, verify_password
-from app.main import send_high_priority_email
 #get_current_user, delete_task
 
 
-# TЕСТЫ ФУНКЦИИ ПО ОТПРАВКЕ ОПОВЕЩЕНИЯ
-def test_send_high_priority_email_output(capsys):
-    # Тестируем вывод текста в консоль и проверяем, что имитация отправки работает.
+# TЕСТЫ ОЧЕРЕДИ ОПОВЕЩЕНИЙ
+class RecordingSender:
+    # Заменяет почтовый сервис: запоминает письма, может падать заданное число раз
+    def __init__(self, fail_times=0):
+        self.fail_times = fail_times
+        self.sent = []
+
+    async def send(self, email, titles):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise ConnectionError("smtp недоступен")
+        self.sent.append((email, titles))
+
+
+@pytest.fixture
+def make_worker(async_session_factory):
+    # воркер открывает свои сессии, но к той же тестовой базе
+    def make(sender, **kwargs):
+        return NotificationWorker(session_factory=async_session_factory, sender=sender, **kwargs)
+    return make
+
+
+def test_console_sender_output(capsys):
     # capsys это встроенная фикстура pytest для перехвата print().
-    test_email = "test@example.com"
-    test_title = "Fix"
-    # Используем patch, чтобы убрать действие time.sleep, чтобы тест выполниться мгновенно вместо 3 секунд
-    with patch("time.sleep", return_value=None):
-        send_high_priority_email(test_email, test_title)
-    # Захватываем всё, что функция напечатала в консоль
+    asyncio.run(ConsoleSender().send("test@example.com", ["Fix"]))
     captured = capsys.readouterr()
-    # Проверяем, содержатся ли нужные строки в выводе
-    assert f"--- EMAIL SENT to {test_email} ---" in captured.out
-    assert f"Notification: New critical task created: '{test_title}'" in captured.out
+    assert "--- EMAIL SENT to test@example.com ---" in captured.out
+    assert "Notification: New critical task created: 'Fix'" in captured.out
     assert "---------------------------------" in captured.out
 
 
-@patch("time.sleep")
-def test_send_high_priority_email_sleep_called(mock_sleep):
-    # Проверяем, что функция пыталась подождать 3 секунды.
-    send_high_priority_email("user@test.com", "Title")
-    # Проверяем, что sleep был вызван ровно один раз с аргументом 3
-    mock_sleep.assert_called_once_with(3)
+def test_worker_coalesces_notifications_per_recipient(session, make_worker):
+    enqueue_high_priority(session, "a@example.com", ["first"])
+    enqueue_high_priority(session, "a@example.com", ["second"])
+    enqueue_high_priority(session, "b@example.com", ["third"])
+    session.commit()
+    sender = RecordingSender()
+    worker = make_worker(sender)
+    assert asyncio.run(worker.run_once()) == 3
+    # два оповещения одному адресату ушли одним письмом
+    assert sorted(sender.sent) == [("a@example.com", ["first", "second"]), ("b@example.com", ["third"])]
+    session.expire_all()
+    assert session.query(models.Notification).filter(models.Notification.status == "sent").count() == 3
+    assert worker.stats()["messages"] == 2
+    # повторный проход ничего не отправляет
+    assert asyncio.run(worker.run_once()) == 0
+
+
+def test_worker_retries_with_backoff(session, make_worker):
+    enqueue_high_priority(session, "a@example.com", ["first"])
+    session.commit()
+    worker = make_worker(RecordingSender(fail_times=1), max_attempts=2, backoff_seconds=60)
+    assert asyncio.run(worker.run_once()) == 0
+    session.expire_all()
+    notification = session.query(models.Notification).one()
+    assert notification.status == "pending"
+    assert notification.attempts == 1
+    # следующая попытка отложена, поэтому сразу воркер ее не берет
+    assert notification.next_attempt_at > datetime.utcnow() + timedelta(seconds=50)
+    assert asyncio.run(worker.run_once()) == 0
+    notification.next_attempt_at = datetime.utcnow()
+    session.commit()
+    assert asyncio.run(worker.run_once()) == 1
+    assert worker.stats()["retries"] == 1
+
+
+def test_concurrent_workers_do_not_send_twice(session, make_worker):
+    for number in range(20):
+        enqueue_high_priority(session, f"user{number}@example.com", [f"task {number}"])
+    session.commit()
+    sender = RecordingSender()
+    # два процесса API с воркерами: каждый пытается взять всю очередь одновременно с другим
+    workers = [make_worker(sender, batch_size=20) for _ in range(2)]
+
+    async def run_both():
+        return await asyncio.gather(*(worker.run_once() for worker in workers))
+    assert sum(asyncio.run(run_both())) == 20
+    assert sorted(email for email, _ in sender.sent) == sorted(f"user{number}@example.com" for number in range(20))
 
 
 # ТЕСТЫ ЭНДПОИНТА register
@@ -53,6 +124,28 @@ def test_register(client, session):
     assert response.json()["detail"] == "Такой email уже занят"
 
 
+def test_register_race_on_email(client, session):
+    user_data = {"email": "newuser@example.com", "password": "123"}
+    real_hash = auth.hasher.hash
+
+    # пока хешируется пароль, тот же email регистрирует другой запрос
+    async def hash_while_other_registers(password):
+        session.add(models.User(email=user_data["email"], hashed_password="x"))
+        session.commit()
+        return await real_hash(password)
+    with patch.object(auth.hasher, "hash", hash_while_other_registers):
+        response = client.post("/users/", json=user_data)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Такой email уже занят"
+
+
+def test_other_integrity_errors_are_server_errors():
+    exc = IntegrityError("INSERT INTO tasks ...", {}, Exception("NOT NULL constraint failed: tasks.title"))
+    request = Request({"type": "http", "method": "POST", "path": "/tasks/", "headers": [], "query_string": b""})
+    response = main.integrity_error_handler(request, exc)
+    assert response.status_code == 500
+
+
 # ТЕСТЫ ЭНДПОИНТА login
 def test_login(client):
     user_data = {"email": "newuser@example.com", "password": "123"}
@@ -64,6 +157,37 @@ def test_login(client):
     assert data["token_type"] == "bearer"
 
 
+def test_login_rehashes_password_with_new_cost(client, session):
+    user_data = {"email": "newuser@example.com", "password": "123"}
+    client.post("/users/", json=user_data)
+    # имитируем пароль, сохраненный со старой стоимостью bcrypt
+    user = session.query(models.User).filter(models.User.email == user_data["email"]).first()
+    user.hashed_password = auth.get_password_hash(user_data["password"], rounds=5)
+    session.commit()
+    assert auth.needs_rehash(user.hashed_password)
+    principal_cache.set(user.email, schemas.CurrentUser.model_validate(user))
+    response = client.post("/users/token/", data={"username": user_data["email"], "password": user_data["password"]})
+    assert response.status_code == 200
+    # хеш обновлен через Core UPDATE, события ORM не сработали, кэш сброшен явно
+    assert principal_cache.get(user.email) is None
+    session.expire_all()
+    assert not auth.needs_rehash(user.hashed_password)
+    assert auth.verify_password(user_data["password"], user.hashed_password)
+
+
+def test_login_rejected_when_hasher_is_busy(client):
+    user_data = {"email": "newuser@example.com", "password": "123"}
+    client.post("/users/", json=user_data)
+    busy_hasher = auth.PasswordHasher(workers=1, queue_size=0)
+    # занимаем единственное место в очереди
+    busy_hasher._slots.acquire()
+    with patch("app.auth.hasher", busy_hasher):
+        response = client.post("/users/token/", data={"username": user_data["email"], "password": user_data["password"]})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert busy_hasher.rejected == 1
+
+
 def test_error_login(client): 
     user_data = {"email": "newuser@example.com", "password": "123"}
     client.post("/users/", json=user_data)    
@@ -72,6 +196,47 @@ def test_error_login(client):
     assert response.json()["detail"] == "Неверный логин или пароль"
 
 
+
+# ТЕСТЫ ЭНДПОИНТА users/me
+def test_current_user_tasks_only_on_request(client, session, user_token_headers, created_task):
+    response = client.get("/users/me", headers=user_token_headers)
+    assert response.status_code == 200
+    assert response.json() == {"email": "newuser@example.com", "id": 1, "is_active": True}
+    # просроченная задача тоже попадает в ответ, хотя создать такую через API нельзя
+    session.add(models.Task(title="old", owner_id=1, priority="low", status="completed", deadline=datetime(2000, 1, 1)))
+    session.add(models.Task(title="third", owner_id=1))
+    session.commit()
+    response = client.get("/users/me", params={"include_tasks": True, "task_limit": 2}, headers=user_token_headers)
+    assert response.status_code == 200
+    tasks = response.json()["tasks"]
+    assert [task["title"] for task in tasks] == ["kl", "old"]
+    assert tasks[1]["status"] == "completed"
+
+
+def test_users_response_loads_tasks_in_one_query(session, async_session_factory, sql_statements):
+    session.execute(models.User.__table__.insert(), [{"email": f"user{i}@example.com", "hashed_password": "x",
+                                                      "is_active": True} for i in range(1000)])
+    session.execute(models.Task.__table__.insert(), [{"title": f"task {i}", "owner_id": user_id, "priority": "medium",
+                                                      "status": "new"} for user_id in range(1, 1001) for i in range(3)])
+    session.commit()
+
+    async def serialize(include_tasks):
+        async with async_session_factory() as db:
+            users = (await db.scalars(select(models.User).order_by(models.User.id))).all()
+            sql_statements.clear()
+            result = await main.users_response(db, users, include_tasks, task_limit=2)
+            return [user.model_dump(mode="json", exclude_unset=True) for user in result]
+    users = asyncio.run(serialize(include_tasks=False))
+    # без include_tasks к задачам не обращаемся вовсе
+    assert sql_statements == []
+    assert len(users) == 1000 and "tasks" not in users[0]
+    users = asyncio.run(serialize(include_tasks=True))
+    # задачи 1000 пользователей одним запросом, а не запросом на каждого
+    assert len(sql_statements) == 1
+    assert all(len(user["tasks"]) == 2 for user in users)
+    assert users[999]["tasks"][0]["owner_id"] == 1000
+
+
 # ТЕСТ ЭНДПОИНТА create_task
 def test_create_task_db_check(session, created_task):
     session.expire_all()
@@ -80,12 +245,16 @@ def test_create_task_db_check(session, created_task):
     assert task_in_db.title == created_task["title"]
 
 
-@patch("app.main.send_high_priority_email")
-def test_create_task_high_priority(mocker, client, user_token_headers):
+def test_create_task_high_priority(client, session, user_token_headers):
     task_data = {"title": "kl", "description": "nl", "priority": "high"}
     response = client.post("/tasks", json=task_data, headers=user_token_headers)
     assert response.status_code == 200
-    mocker.assert_called_once()
+    # оповещение сохранено в outbox вместе с задачей
+    notification = session.query(models.Notification).one()
+    assert notification.recipient == "newuser@example.com"
+    assert notification.status == "pending"
+    client.post("/tasks", json={"title": "low", "priority": "low"}, headers=user_token_headers)
+    assert session.query(models.Notification).count() == 1
 
 
 # ТЕСТ ЭНДПОИНТА delete_task
@@ -107,6 +276,61 @@ def test_update_task(client, session, user_token_headers, created_task):
     assert task_in_db.title == update_data["title"]
 
 
+# ТЕСТЫ МАРШРУТОВ ПО id И УНИКАЛЬНОСТИ НАЗВАНИЯ
+def test_update_and_delete_task_by_id(client, session, user_token_headers, created_task):
+    task_id = created_task["id"]
+    response = client.patch(f"/tasks/id/{task_id}", json={"title": "renamed"}, headers=user_token_headers)
+    assert response.status_code == 200
+    assert response.json()["task"]["title"] == "renamed"
+    response = client.delete(f"/tasks/id/{task_id}", headers=user_token_headers)
+    assert response.status_code == 200
+    assert response.json()["message"] == "Задача 'renamed' удалена"
+    assert session.get(models.Task, task_id) is None
+    assert client.delete(f"/tasks/id/{task_id}", headers=user_token_headers).status_code == 404
+
+
+def test_task_by_id_of_another_user_not_found(client, user_token_headers, created_task):
+    client.post("/users/", json={"email": "other@example.com", "password": "123"})
+    token = client.post("/users/token/", data={"username": "other@example.com", "password": "123"}).json()["access_token"]
+    other_headers = {"Authorization": f"Bearer {token}"}
+    response = client.patch(f"/tasks/id/{created_task['id']}", json={"status": "completed"}, headers=other_headers)
+    assert response.status_code == 404
+    assert client.delete(f"/tasks/id/{created_task['id']}", headers=other_headers).status_code == 404
+    # у другого пользователя может быть задача с тем же названием
+    assert client.post("/tasks", json={"title": created_task["title"]}, headers=other_headers).status_code == 200
+
+
+def test_duplicate_task_title_conflict(client, session, user_token_headers, created_task):
+    response = client.post("/tasks", json={"title": created_task["title"]}, headers=user_token_headers)
+    assert response.status_code == 409
+    client.post("/tasks", json={"title": "second"}, headers=user_token_headers)
+    response = client.patch("/tasks/second", json={"title": created_task["title"]}, headers=user_token_headers)
+    assert response.status_code == 409
+    assert sorted(task.title for task in session.query(models.Task)) == [created_task["title"], "second"]
+
+
+def test_task_mutations_use_single_statement(client, user_token_headers, created_task, sql_statements):
+    # раньше обновление делало SELECT, UPDATE и SELECT для refresh, удаление SELECT и DELETE
+    sql_statements.clear()
+    response = client.patch(f"/tasks/{created_task['title']}", json={"status": "completed"}, headers=user_token_headers)
+    assert response.json()["task"]["status"] == "completed"
+    statements = [statement for statement, _ in sql_statements if "tasks" in statement]
+    assert len(statements) == 1
+    assert statements[0].startswith("UPDATE tasks") and "RETURNING" in statements[0]
+    sql_statements.clear()
+    response = client.delete(f"/tasks/id/{created_task['id']}", headers=user_token_headers)
+    assert response.json()["message"] == f"Задача '{created_task['title']}' удалена"
+    statements = [statement for statement, _ in sql_statements if "tasks" in statement]
+    assert len(statements) == 1
+    assert statements[0].startswith("DELETE FROM tasks") and "RETURNING" in statements[0]
+
+
+def test_update_task_not_found_before_empty_changes(client, user_token_headers, created_task):
+    assert client.patch("/tasks/missing", json={"status": "completed"}, headers=user_token_headers).status_code == 404
+    assert client.patch("/tasks/missing", json={}, headers=user_token_headers).status_code == 404
+    assert client.patch(f"/tasks/{created_task['title']}", json={}, headers=user_token_headers).status_code == 400
+
+
 # ТЕСТ ЭНДПОИНТА get_task
 def test_get_task(client, user_token_headers, created_task):
     response = client.get(f"/tasks/{created_task["title"]}", headers=user_token_headers, params={"priorety":"high", "description": "nl"})
@@ -115,9 +339,370 @@ def test_get_task(client, user_token_headers, created_task):
     assert created_task in data
 
 
+def test_get_task_keyset_pagination(client, user_token_headers):
+    for i in range(5):
+        client.post("/tasks", json={"title": f"t{i}"}, headers=user_token_headers)
+    titles = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/tasks/1", params=params, headers=user_token_headers)
+        assert response.status_code == 200
+        titles += [task["title"] for task in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    # все задачи пришли по одному разу и в порядке создания
+    assert titles == [f"t{i}" for i in range(5)]
+
+
+def test_get_task_fields_projection(client, user_token_headers, created_task):
+    response = client.get("/tasks/1", params={"fields": "title,status"}, headers=user_token_headers)
+    assert response.status_code == 200
+    assert response.json() == [{"title": created_task["title"], "status": created_task["status"]}]
+    response = client.get("/tasks/1", params={"fields": "title,password"}, headers=user_token_headers)
+    assert response.status_code == 400
+
+
+
+def test_task_serialization_keeps_formats(client, user_token_headers, monkeypatch):
+    deadline = datetime(2030, 5, 6, 7, 8)
+    created = client.post("/tasks", json={"title": "дедлайн", "deadline": deadline.isoformat()}, headers=user_token_headers).json()
+    # создание отвечает в формате TaskResponse, список отдает deadline в ISO 8601, как и раньше
+    assert created == schemas.TaskResponse(**created | {"deadline": deadline}).model_dump(mode="json")
+    assert created["deadline"] == "07:08:06:05:2030"
+    response = client.get("/tasks/1", headers=user_token_headers)
+    assert response.json() == [created | {"deadline": "2030-05-06T07:08:00"}]
+    # без orjson тело ответа то же самое
+    body = response.content
+    monkeypatch.setattr(serializers, "orjson", None)
+    task_list_cache.clear()
+    assert client.get("/tasks/1", headers=user_token_headers).content == body
+
+
+def test_due_and_overdue_tasks(client, session, user_token_headers):
+    now = utcnow()
+    for title, deadline, status in [("later", now + timedelta(days=2), "new"), ("soon", now + timedelta(minutes=30), "new"),
+                                    ("sooner", now + timedelta(minutes=10), "in progress"), ("late", now - timedelta(hours=1), "new"),
+                                    ("done", now - timedelta(hours=2), "completed"), ("none", None, "new")]:
+        session.add(models.Task(title=title, owner_id=1, deadline=deadline, status=status))
+    session.commit()
+    response = client.get("/tasks/due", headers=user_token_headers)
+    assert response.status_code == 200
+    assert [task["title"] for task in response.json()] == ["sooner", "soon"]
+    response = client.get("/tasks/due", params={"within": 3 * 24 * 3600, "limit": 2}, headers=user_token_headers)
+    assert [task["title"] for task in response.json()] == ["sooner", "soon"]
+    response = client.get("/tasks/overdue", headers=user_token_headers)
+    assert [task["title"] for task in response.json()] == ["late"]
+
+
+def test_deadline_with_offset_stored_as_utc(client, session, user_token_headers, async_session_factory):
+    deadline = utcnow() + timedelta(minutes=30)
+    offset = timezone(timedelta(hours=5))
+    local = deadline.replace(tzinfo=timezone.utc).astimezone(offset).isoformat()
+    assert client.post("/tasks", json={"title": "utc", "deadline": local}, headers=user_token_headers).status_code == 200
+    stored = session.query(models.Task).one().deadline
+    assert abs(stored - deadline) < timedelta(seconds=1)
+    response = client.get("/tasks/due", headers=user_token_headers)
+    assert [task["title"] for task in response.json()] == ["utc"]
+    # планировщик видит тот же дедлайн: due_soon сразу, overdue через 30 минут, а не через 5 часов
+    events = []
 
+    async def sink(batch):
+        events.extend((event["event"], event["deadline"]) for event in batch)
+    scheduler = DeadlineScheduler(async_session_factory, sink=sink, due_soon_seconds=3600)
+    assert asyncio.run(scheduler.run_once()) == stored
+    assert events == [("due_soon", stored)]
 
-    
-    
 
+# ТЕСТЫ КЭША get_current_user
+def test_current_user_is_cached(client, user_token_headers, created_task):
+    # created_task уже положил пользователя в кэш, повторные запросы не должны идти в таблицу users
+    misses = principal_cache.misses
+    for _ in range(3):
+        response = client.get("/tasks/1", headers=user_token_headers)
+        assert response.status_code == 200
+    assert principal_cache.misses == misses
+    assert principal_cache.hits >= 3
 
+
+def test_deleted_user_is_dropped_from_cache(client, session, user_token_headers, created_task):
+    user = session.query(models.User).filter(models.User.email == "newuser@example.com").first()
+    assert principal_cache.get(user.email) is not None
+    session.delete(user)
+    session.commit()
+    assert principal_cache.get(user.email) is None
+    response = client.get("/tasks/1", headers=user_token_headers)
+    assert response.status_code == 404
+
+
+def test_deactivated_user_is_rejected(client, session, user_token_headers, created_task):
+    user = session.query(models.User).filter(models.User.email == "newuser@example.com").first()
+    assert principal_cache.get(user.email) is not None
+    user.is_active = False
+    session.commit()
+    assert principal_cache.get(user.email) is None
+    response = client.get("/tasks/1", headers=user_token_headers)
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Пользователь деактивирован"
+    response = client.post("/users/token/", data={"username": user.email, "password": "123"})
+    assert response.status_code == 403
+
+
+
+def test_cached_user_expires_after_ttl(client, session, user_token_headers, created_task, monkeypatch):
+    monkeypatch.setattr(main, "PRINCIPAL_CACHE_TTL", 0.2)
+    principal_cache.clear()
+    assert client.get("/tasks/1", headers=user_token_headers).status_code == 200
+    # деактивация через Core: события ORM не срабатывают, кэш об этом не знает
+    session.execute(update(models.User).values(is_active=False))
+    session.commit()
+    assert client.get("/tasks/1", headers=user_token_headers).status_code == 200
+    time.sleep(0.3)
+    assert client.get("/tasks/1", headers=user_token_headers).status_code == 403
+
+
+# ТЕСТЫ ПРОВЕРКИ ТОКЕНОВ
+def token_claims(minutes=30):
+    return {"sub": "user@example.com", "uid": 1, "exp": datetime.utcnow() + timedelta(minutes=minutes)}
+
+
+def test_token_signature_checked_once(client, user_token_headers, created_task):
+    auth.token_verifier.cache.clear()
+    with patch("app.auth.jwt.decode", wraps=jwt.decode) as decode:
+        for _ in range(3):
+            assert client.get("/tasks/1", headers=user_token_headers).status_code == 200
+    assert decode.call_count == 1
+
+
+def test_token_key_rotation():
+    verifier = auth.TokenVerifier({"old": "old-secret"}, "old")
+    old_token = verifier.encode(token_claims())
+    # новый ключ становится активным, старый остается для уже выданных токенов
+    verifier.set_keys({"old": "old-secret", "new": "new-secret"}, "new")
+    new_token = verifier.encode(token_claims())
+    assert jwt.get_unverified_header(new_token)["kid"] == "new"
+    assert verifier.decode(old_token)["sub"] == "user@example.com"
+    assert verifier.decode(new_token)["sub"] == "user@example.com"
+    # после удаления старого ключа его токены не принимаются, в том числе из кэша
+    verifier.set_keys({"new": "new-secret"}, "new")
+    with pytest.raises(JWTError):
+        verifier.decode(old_token)
+    assert verifier.decode(new_token)["uid"] == 1
+
+
+def test_token_keys_reloaded_from_file(tmp_path):
+    keys_file = tmp_path / "keys.json"
+    keys_file.write_text(json.dumps({"active": "k1", "keys": {"k1": "secret-1"}}))
+    verifier = auth.TokenVerifier({auth.DEFAULT_KID: auth.SECRET_KEY}, auth.DEFAULT_KID,
+                                  keys_file=str(keys_file), reload_seconds=0)
+    token = verifier.encode(token_claims())
+    assert jwt.get_unverified_header(token)["kid"] == "k1"
+    keys_file.write_text(json.dumps({"active": "k2", "keys": {"k2": "secret-2"}}))
+    os.utime(keys_file, (0, 0))
+    with pytest.raises(JWTError):
+        verifier.decode(token)
+    assert jwt.get_unverified_header(verifier.encode(token_claims()))["kid"] == "k2"
+
+
+def test_token_without_kid_and_expired_token():
+    verifier = auth.TokenVerifier(*auth.load_signing_keys(""))
+    # токены, выданные до появления kid, подписаны SECRET_KEY
+    legacy = jwt.encode(token_claims(), auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    assert verifier.decode(legacy)["sub"] == "user@example.com"
+    with pytest.raises(JWTError):
+        verifier.decode(verifier.encode(token_claims(minutes=-1)))
+
+
+def test_trusted_token_claims_skip_user_lookup(client, user_token_headers, sql_statements, monkeypatch):
+    monkeypatch.setattr(main, "TRUST_TOKEN_CLAIMS", True)
+    principal_cache.clear()
+    sql_statements.clear()
+    response = client.get("/tasks/1", headers=user_token_headers)
+    assert response.status_code == 200
+    assert not [statement for statement, _ in sql_statements if "FROM users" in statement]
+    assert principal_cache.get("newuser@example.com").id == 1
+
+
+# ТЕСТЫ КЭША ОТВЕТОВ get_task
+def task_queries(sql_statements):
+    return [statement for statement, _ in sql_statements if "FROM tasks" in statement]
+
+
+def test_task_list_is_cached_until_tasks_change(client, user_token_headers, created_task, sql_statements):
+    first = client.get("/tasks/1", headers=user_token_headers)
+    sql_statements.clear()
+    second = client.get("/tasks/1", headers=user_token_headers)
+    assert second.json() == first.json()
+    assert task_queries(sql_statements) == []
+    # новая задача меняет версию данных пользователя, и следующий запрос снова идет в базу
+    client.post("/tasks", json={"title": "new"}, headers=user_token_headers)
+    third = client.get("/tasks/1", headers=user_token_headers)
+    assert [task["title"] for task in third.json()] == [created_task["title"], "new"]
+    client.request("DELETE", "/tasks/bulk", json=["new"], headers=user_token_headers)
+    assert client.get("/tasks/1", headers=user_token_headers).json() == first.json()
+
+
+def test_task_list_etag_not_modified(client, user_token_headers, created_task, sql_statements):
+    response = client.get("/tasks/1", headers=user_token_headers)
+    etag = response.headers["ETag"]
+    sql_statements.clear()
+    response = client.get("/tasks/1", headers={**user_token_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert sql_statements == []
+    # после изменения задачи старый ETag больше не подходит
+    client.patch(f"/tasks/{created_task['title']}", json={"status": "completed"}, headers=user_token_headers)
+    response = client.get("/tasks/1", headers={**user_token_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()[0]["status"] == "completed"
+
+
+def test_task_list_etag_changes_after_restart(client, user_token_headers, created_task, monkeypatch):
+    response = client.get("/tasks/1", headers=user_token_headers)
+    etag = response.headers["ETag"]
+    version = asyncio.run(main.task_list_cache.version(1))
+    # перезапуск: версии в памяти начинаются заново и после стольких же изменений совпадают с прежними
+    restarted = MemoryBackend()
+    for _ in range(version):
+        asyncio.run(restarted.bump(1))
+    monkeypatch.setattr(main, "task_list_cache", restarted)
+    response = client.get("/tasks/1", headers={**user_token_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+# Локальная замена Redis: хранит строки с временем жизни, как настоящий сервер
+class LocalRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= datetime.now().timestamp():
+            return None
+        return value
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = (value, datetime.now().timestamp() + ex if ex else None)
+
+    async def incr(self, key):
+        value = int((await self.get(key)) or 0) + 1
+        self.data[key] = (str(value), None)
+        return value
+
+
+def test_task_list_cache_with_shared_backend(client, user_token_headers, created_task, sql_statements, monkeypatch):
+    backend = RedisBackend(LocalRedis())
+    monkeypatch.setattr(main, "task_list_cache", backend)
+    first = client.get("/tasks/1", headers=user_token_headers)
+    sql_statements.clear()
+    assert client.get("/tasks/1", headers=user_token_headers).json() == first.json()
+    assert task_queries(sql_statements) == []
+    assert backend.hits == 1
+    client.post("/tasks", json={"title": "new"}, headers=user_token_headers)
+    assert len(client.get("/tasks/1", headers=user_token_headers).json()) == 2
+
+
+# ТЕСТЫ ЭНДПОИНТА export_tasks
+def test_export_tasks_ndjson(client, user_token_headers, created_task):
+    client.post("/tasks", json={"title": "second", "priority": "low"}, headers=user_token_headers)
+    response = client.get("/tasks/export", headers=user_token_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["title"] for row in rows] == ["kl", "second"]
+    assert rows[0] == created_task
+    # фильтры те же, что у get_task
+    response = client.get("/tasks/export", params={"priority": "low"}, headers=user_token_headers)
+    assert [json.loads(line)["title"] for line in response.text.splitlines()] == ["second"]
+
+
+def test_export_tasks_csv(client, user_token_headers, created_task):
+    response = client.get("/tasks/export", params={"format": "csv"}, headers=user_token_headers)
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 1
+    assert rows[0]["title"] == created_task["title"]
+    assert rows[0]["priority"] == "high"
+
+
+# ТЕСТЫ ПАКЕТНЫХ ЭНДПОИНТОВ
+def test_create_tasks_bulk(client, session, user_token_headers):
+    items = [{"title": "a", "priority": "high"}, {"priority": "low"}, {"title": "b", "priority": "high"}, {"title": "c"}]
+    response = client.post("/tasks/bulk", json=items, headers=user_token_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["created"] == 3
+    # у второго элемента нет title: ошибка только для него
+    assert [error["index"] for error in data["errors"]] == [1]
+    titles = [task.title for task in session.query(models.Task).order_by(models.Task.id)]
+    assert titles == ["a", "b", "c"]
+    assert data["ids"] == [task.id for task in session.query(models.Task).order_by(models.Task.id)]
+    # одно оповещение на весь пакет
+    notification = session.query(models.Notification).one()
+    assert json.loads(notification.payload)["titles"] == ["a", "b"]
+
+
+def test_create_tasks_bulk_skips_duplicate_titles(client, session, user_token_headers, created_task):
+    items = [{"title": "a"}, {"title": created_task["title"]}, {"title": "a"}, {"title": "b"}]
+    response = client.post("/tasks/bulk", json=items, headers=user_token_headers)
+    data = response.json()
+    assert data["created"] == 2
+    assert [error["index"] for error in data["errors"]] == [1, 2]
+    assert sorted(task.title for task in session.query(models.Task)) == ["a", "b", created_task["title"]]
+
+
+def test_update_tasks_bulk(client, session, user_token_headers):
+    client.post("/tasks/bulk", json=[{"title": "a"}, {"title": "b"}], headers=user_token_headers)
+    items = [{"title": "a", "changes": {"status": "completed"}},
+             {"title": "b", "changes": {"priority": "low", "description": "d"}},
+             {"title": "missing", "changes": {"status": "completed"}},
+             {"title": "a", "changes": {}}]
+    response = client.patch("/tasks/bulk", json=items, headers=user_token_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["updated"] == 2
+    assert [error["index"] for error in data["errors"]] == [2, 3]
+    tasks = {task.title: task for task in session.query(models.Task)}
+    assert tasks["a"].status == "completed"
+    assert (tasks["b"].priority, tasks["b"].description) == ("low", "d")
+
+
+def test_update_tasks_bulk_reports_title_conflicts(client, session, user_token_headers):
+    client.post("/tasks/bulk", json=[{"title": "a"}, {"title": "b"}, {"title": "c"}, {"title": "d"}],
+                headers=user_token_headers)
+    items = [{"title": "a", "changes": {"title": "b"}},
+             {"title": "c", "changes": {"title": "x", "status": "completed"}},
+             {"title": "d", "changes": {"title": "x"}},
+             {"title": "b", "changes": {"status": "completed"}}]
+    response = client.patch("/tasks/bulk", json=items, headers=user_token_headers)
+    assert response.status_code == 200
+    data = response.json()
+    # "b" уже есть, "x" занимает предыдущий элемент пакета; остальные элементы применяются
+    assert data["updated"] == 2
+    assert data["errors"] == [{"index": 0, "detail": "Задача с названием 'b' уже существует"},
+                              {"index": 2, "detail": "Задача с названием 'x' уже существует"}]
+    tasks = {task.title: task.status for task in session.query(models.Task)}
+    assert tasks == {"a": "new", "b": "completed", "x": "completed", "d": "new"}
+
+
+def test_delete_tasks_bulk(client, session, user_token_headers):
+    client.post("/tasks/bulk", json=[{"title": "a"}, {"title": "b"}, {"title": "c"}], headers=user_token_headers)
+    response = client.request("DELETE", "/tasks/bulk", json=["a", "c", "missing"], headers=user_token_headers)
+    assert response.status_code == 200
+    assert response.json() == {"deleted": 2, "errors": [{"index": 2, "detail": "Задача с названием 'missing' не найдена"}]}
+    assert [task.title for task in session.query(models.Task)] == ["b"]
+
+
+def test_task_titled_bulk_by_title(client, session, user_token_headers):
+    client.post("/tasks", json={"title": "bulk"}, headers=user_token_headers)
+    # объект вместо списка: обновление задачи "bulk", а не пакет
+    response = client.patch("/tasks/bulk", json={"status": "completed"}, headers=user_token_headers)
+    assert response.status_code == 200
+    assert response.json()["task"]["status"] == "completed"
+    assert client.patch("/tasks/bulk", json={"status": "unknown"}, headers=user_token_headers).status_code == 422
+    # без тела: удаление задачи "bulk"
+    response = client.delete("/tasks/bulk", headers=user_token_headers)
+    assert response.json() == {"message": "Задача 'bulk' удалена"}
+    assert session.query(models.Task).count() == 0
@@ -0,0 +1,45 @@
+import json
+import logging
+import queue
+from app.logger_config import JsonFormatter, WarningSampler, DroppingQueueHandler
+
+
+def make_record(message, level=logging.WARNING, lineno=10):
+    return logging.LogRecord("app.main", level, "/app/main.py", lineno, message, None, None)
+
+
+def test_json_formatter():
+    line = JsonFormatter().format(make_record("Пользователь %s", level=logging.INFO))
+    data = json.loads(line)
+    assert data["level"] == "INFO"
+    assert data["logger"] == "app.main"
+    assert "\x1b" not in line
+
+
+def test_repeated_warnings_are_sampled():
+    sampler = WarningSampler(burst=3, window=60)
+    passed = [sampler.filter(make_record(f"вход {i}")) for i in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    assert sampler.sampled == 7
+    # другая строка кода и другие уровни считаются отдельно
+    assert sampler.filter(make_record("другое", lineno=20))
+    assert sampler.filter(make_record("ошибка", level=logging.ERROR))
+
+
+def test_sampled_count_reported_in_next_window():
+    sampler = WarningSampler(burst=1, window=60)
+    for i in range(4):
+        sampler.filter(make_record(f"вход {i}"))
+    # окно закончилось: первая запись нового окна проходит и сообщает о пропущенных
+    sampler.window = 0
+    record = make_record("вход 4")
+    assert sampler.filter(record)
+    assert record.suppressed == 3
+
+
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+    for i in range(5):
+        handler.handle(make_record(f"запись {i}", level=logging.INFO))
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
@@ -0,0 +1,46 @@
+import logging
+from app import metrics as metrics_module
+from app.metrics import metrics
+
+
+def test_metrics_endpoint(client, user_token_headers, created_task):
+    client.get("/tasks/1", headers=user_token_headers)
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    # метка это шаблон маршрута, а не конкретный путь
+    assert 'http_requests_total{method="GET",route="/tasks/{owner_id}",status="200"}' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/tasks/{owner_id}",le="+Inf"}' in body
+    # сам запрос к /metrics еще обрабатывается
+    assert "http_requests_in_flight 1" in body
+    assert "app_principal_cache_hits" in body
+    assert "app_notifications_queue_depth" in body
+
+
+def test_sql_statements_counted_per_request(client, user_token_headers, created_task):
+    histogram = metrics.statements[("PATCH", "/tasks/{title}")]
+    count, total = histogram.count, histogram.sum
+    client.patch(f"/tasks/{created_task['title']}", json={"status": "completed"}, headers=user_token_headers)
+    # пользователь уже в кэше, поэтому единственный запрос это UPDATE ... RETURNING
+    assert histogram.count == count + 1
+    assert histogram.sum == total + 1
+
+
+def test_hasher_wait_recorded(client):
+    # регистрация хеширует пароль в пуле bcrypt
+    count = metrics.hasher_wait.count
+    client.post("/users/", json={"email": "newuser@example.com", "password": "123"})
+    assert metrics.hasher_wait.count == count + 1
+    assert "hasher_wait_seconds_count" in client.get("/metrics").text
+
+
+def test_slow_request_logged_with_statements(client, user_token_headers, created_task, caplog, monkeypatch):
+    monkeypatch.setattr(metrics_module, "SLOW_REQUEST_SECONDS", 0)
+    slow = metrics.slow_requests
+    with caplog.at_level(logging.WARNING, logger="app.metrics"):
+        client.get("/tasks/1", headers=user_token_headers)
+    assert metrics.slow_requests == slow + 1
+    record = next(record for record in caplog.records if record.name == "app.metrics")
+    assert "GET /tasks/1 -> 200" in record.getMessage()
+    assert "FROM tasks" in record.getMessage()
@@ -0,0 +1,116 @@
+# Проверяем, что запросы эндпоинтов к таблице tasks (SELECT, а также UPDATE и DELETE с WHERE)
+# используют составные индексы, а не читают всю таблицу. План берем у того же SQL, который приложение отправило в базу.
+# Тесты работают и на SQLite (EXPLAIN QUERY PLAN), и на Postgres (EXPLAIN (FORMAT JSON), см. TEST_DATABASE_URL в conftest).
+import pytest
+
+
+def sqlite_plan(connection, statement, parameters):
+    rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, tuple(parameters)).all()
+    # последняя колонка это описание шага плана, например "SEARCH tasks USING INDEX ..."
+    return " | ".join(row[-1] for row in rows)
+
+
+def postgres_plan(connection, statement, parameters):
+    # на пустой тестовой таблице планировщик Postgres выбирает Seq Scan по стоимости,
+    # поэтому запрещаем его: если подходящего индекса нет, в плане все равно останется Seq Scan
+    connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    # приложение работает через asyncpg и отправляет SQL с параметрами $1, $2, ...:
+    # такой текст можно подготовить как есть, а значения передать в EXECUTE
+    connection.exec_driver_sql("PREPARE task_plan AS " + statement)
+    try:
+        execute = "EXECUTE task_plan" + (f"({', '.join(['%s'] * len(parameters))})" if parameters else "")
+        plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + execute, tuple(parameters)).scalar_one()
+    finally:
+        connection.exec_driver_sql("DEALLOCATE task_plan")
+    # дерево плана разворачиваем в строку, похожую на текстовый EXPLAIN: "Index Scan using ix_... on tasks"
+    steps, nodes = [], [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop(0)
+        step = node["Node Type"]
+        if "Index Name" in node:
+            step += f" using {node['Index Name']}"
+        if "Relation Name" in node:
+            step += f" on {node['Relation Name']}"
+        steps.append(step)
+        nodes.extend(node.get("Plans", []))
+    return " | ".join(steps)
+
+
+def task_query_plans(session, sql_statements):
+    connection = session.connection()
+    explain = postgres_plan if connection.dialect.name == "postgresql" else sqlite_plan
+    plans = []
+    for statement, parameters in sql_statements:
+        if (statement.lstrip().upper().startswith(("SELECT", "DELETE")) and "FROM tasks" in statement
+                or statement.lstrip().startswith("UPDATE tasks")):
+            plans.append(explain(connection, statement, parameters))
+    assert plans, "эндпоинт не выполнил ни одного запроса к tasks"
+    return plans
+
+
+def uses_index(plan, index):
+    # SQLite: "SEARCH tasks USING INDEX ix_...", Postgres: "Index Scan using ix_... on tasks"
+    return f"USING INDEX {index}" in plan or f"using {index}" in plan
+
+
+def sorts(plan):
+    # сортировка всех найденных строк: "USE TEMP B-TREE FOR ORDER BY" в SQLite, узел Sort в Postgres
+    return "TEMP B-TREE" in plan or "Sort" in plan
+
+
+def test_update_task_uses_owner_title_index(client, session, user_token_headers, created_task, sql_statements):
+    sql_statements.clear()
+    response = client.patch(f"/tasks/{created_task['title']}", json={"status": "completed"}, headers=user_token_headers)
+    assert response.status_code == 200
+    plans = task_query_plans(session, sql_statements)
+    assert len(plans) == 1
+    assert uses_index(plans[0], "ix_tasks_owner_id_title"), plans
+
+
+def test_delete_task_uses_owner_title_index(client, session, user_token_headers, created_task, sql_statements):
+    sql_statements.clear()
+    response = client.delete(f"/tasks/{created_task['title']}", headers=user_token_headers)
+    assert response.status_code == 200
+    plans = task_query_plans(session, sql_statements)
+    assert uses_index(plans[0], "ix_tasks_owner_id_title"), plans
+
+
+def test_update_task_by_id_uses_primary_key(client, session, user_token_headers, created_task, sql_statements):
+    sql_statements.clear()
+    response = client.patch(f"/tasks/id/{created_task['id']}", json={"status": "completed"}, headers=user_token_headers)
+    assert response.status_code == 200
+    for plan in task_query_plans(session, sql_statements):
+        # Postgres может взять и (owner_id, id): это тоже поиск одной строки по id
+        assert ("INTEGER PRIMARY KEY" in plan or uses_index(plan, "tasks_pkey")
+                or uses_index(plan, "ix_tasks_owner_id_id")), plan
+
+
+@pytest.mark.parametrize("params, index", [
+    ({"title": "kl"}, "ix_tasks_owner_id_title"),
+    ({"status": "new", "priority": "high"}, "ix_tasks_owner_id_status_priority"),
+    # без полного совпадения с составным индексом планировщик идет по (owner_id, id):
+    # так страница читается в порядке курсора без сортировки всех задач пользователя
+    ({"status": "new"}, "ix_tasks_owner_id_id"),
+    ({}, "ix_tasks_owner_id_id"),
+    ({"cursor": "MA=="}, "ix_tasks_owner_id_id"),
+])
+def test_get_task_uses_composite_index(client, session, user_token_headers, created_task, sql_statements, params, index):
+    sql_statements.clear()
+    response = client.get("/tasks/1", params=params, headers=user_token_headers)
+    assert response.status_code == 200
+    for plan in task_query_plans(session, sql_statements):
+        assert uses_index(plan, index), plan
+        # в SQLite строки с одинаковым ключом индекса лежат в порядке rowid, поэтому сортировки нет ни в одном случае;
+        # в B-tree Postgres такие строки упорядочены по физическому адресу, и найденные по равенству задачи он сортирует по id
+        if index == "ix_tasks_owner_id_id" or session.get_bind().dialect.name == "sqlite":
+            assert not sorts(plan), plan
+
+
+@pytest.mark.parametrize("path", ["/tasks/due", "/tasks/overdue", "/tasks/stats"])
+def test_deadline_listings_use_deadline_index(client, session, user_token_headers, created_task, sql_statements, path):
+    sql_statements.clear()
+    response = client.get(path, headers=user_token_headers)
+    assert response.status_code == 200
+    for plan in task_query_plans(session, sql_statements):
+        assert uses_index(plan, "ix_tasks_owner_id_deadline"), plan
+        assert not sorts(plan), plan
@@ -0,0 +1,142 @@
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+from unittest.mock import patch
+from app import auth, ratelimit
+from app.ratelimit import rate_limiter, gcra, RedisStore, RateLimiter, RateLimit
+
+
+def login(client, password="123", email="newuser@example.com"):
+    return client.post("/users/token/", data={"username": email, "password": password})
+
+
+def test_gcra_allows_burst_then_refills():
+    now = 1000.0
+    tat = None
+    for _ in range(3):
+        tat, retry_after = gcra(tat, now, interval=10, burst=3)
+        assert retry_after == 0
+    rejected, retry_after = gcra(tat, now, interval=10, burst=3)
+    assert rejected is None and retry_after == 10
+    # через один интервал освобождается один жетон
+    tat, retry_after = gcra(tat, now + 10, interval=10, burst=3)
+    assert retry_after == 0
+
+
+def test_login_limited_per_username_before_db(client, user_token_headers, sql_statements, monkeypatch):
+    monkeypatch.setattr(ratelimit.LOGIN_USER_LIMIT, "burst", 2)
+    rate_limiter.store.clear()
+    assert login(client).status_code == 200
+    assert login(client).status_code == 200
+    sql_statements.clear()
+    with patch.object(auth.hasher, "verify", wraps=auth.hasher.verify) as verify:
+        response = login(client)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    # отказ без запросов к базе и без bcrypt
+    assert sql_statements == []
+    verify.assert_not_called()
+    # лимит считается по логину, другой пользователь входит
+    client.post("/users/", json={"email": "other@example.com", "password": "123"})
+    assert login(client, email="other@example.com").status_code == 200
+
+
+def test_login_limited_per_ip(client, user_token_headers, monkeypatch):
+    monkeypatch.setattr(ratelimit.LOGIN_IP_LIMIT, "burst", 3)
+    rate_limiter.store.clear()
+    statuses = [login(client, email=f"user{i}@example.com").status_code for i in range(4)]
+    assert statuses == [401, 401, 401, 429]
+
+
+def test_lockout_after_failed_logins(client, user_token_headers, monkeypatch):
+    monkeypatch.setattr(ratelimit, "LOCKOUT_THRESHOLD", 3)
+    monkeypatch.setattr(ratelimit.LOGIN_USER_LIMIT, "burst", 100)
+    rate_limiter.store.clear()
+    for _ in range(3):
+        assert login(client, password="wrong").status_code == 401
+    # даже верный пароль не проверяется, пока действует блокировка
+    response = login(client)
+    assert response.status_code == 429
+    assert 25 <= int(response.headers["Retry-After"]) <= 30
+
+
+def test_lockout_backoff_doubles_and_success_resets(monkeypatch):
+    monkeypatch.setattr(ratelimit, "LOCKOUT_THRESHOLD", 2)
+    limiter = RateLimiter(ratelimit.MemoryStore())
+
+    async def scenario():
+        durations = []
+        for _ in range(4):
+            await limiter.login_failed("user")
+            locked_until = await limiter.store.get("lock:user")
+            durations.append(round(locked_until - time.time()) if locked_until else 0)
+        await limiter.login_succeeded("user")
+        failures = await limiter.store.get("failures:user")
+        return durations, failures
+    durations, failures = asyncio.run(scenario())
+    assert durations == [0, 30, 60, 120]
+    assert failures is None
+
+
+def test_register_limited_by_dependency(client, monkeypatch):
+    monkeypatch.setattr(ratelimit.REGISTER_IP_LIMIT, "burst", 2)
+    rate_limiter.store.clear()
+    statuses = [client.post("/users/", json={"email": f"u{i}@example.com", "password": "1"}).status_code for i in range(3)]
+    assert statuses == [200, 200, 429]
+
+
+# Локальная замена Redis для RedisStore. eval выполняет тот же алгоритм, что и GCRA_SCRIPT,
+# через его копию на Python (ratelimit.gcra)
+class LocalRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return value
+
+    async def set(self, key, value, px=None):
+        self.data[key] = (str(value).encode(), time.time() + px / 1000 if px else None)
+
+    async def incr(self, key):
+        value = int(await self.get(key) or 0) + 1
+        expires_at = self.data.get(key, (None, None))[1]
+        self.data[key] = (str(value).encode(), expires_at)
+        return value
+
+    async def expire(self, key, seconds):
+        self.data[key] = (self.data[key][0], time.time() + seconds)
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def eval(self, script, numkeys, key, now, interval, burst):
+        assert script == ratelimit.GCRA_SCRIPT
+        tat = await self.get(key)
+        new_tat, retry_after = gcra(float(tat) if tat else None, now, interval, burst)
+        if new_tat is not None:
+            await self.set(key, new_tat, px=(new_tat - now) * 1000)
+        return str(retry_after).encode()
+
+
+def test_rate_limiter_with_shared_store(monkeypatch):
+    monkeypatch.setattr(ratelimit, "LOCKOUT_THRESHOLD", 1)
+    limiter = RateLimiter(RedisStore(LocalRedis()))
+    limit = RateLimit("test", per_minute=60, burst=2)
+
+    async def scenario():
+        await limiter.check(limit, "1.2.3.4")
+        await limiter.check(limit, "1.2.3.4")
+        with pytest.raises(HTTPException) as rejected:
+            await limiter.check(limit, "1.2.3.4")
+        assert rejected.value.status_code == 429
+        assert rejected.value.headers["Retry-After"] == "1"
+        await limiter.login_failed("user")
+        with pytest.raises(HTTPException) as locked:
+            await limiter.check_login("5.6.7.8", "user")
+        assert locked.value.status_code == 429
+    asyncio.run(scenario())
+    assert limiter.stats() == {"rejected": 2, "lockouts": 1}
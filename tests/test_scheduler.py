@@ -0,0 +1,143 @@
+import asyncio
+from datetime import datetime, timedelta
+from app import models
+from app.scheduler import DeadlineScheduler, utcnow
+
+NOW = datetime(2030, 1, 1, 12, 0)
+
+
+def add_tasks(session, *tasks):
+    session.add(models.User(email="owner@example.com", hashed_password="x"))
+    for title, deadline, status in tasks:
+        session.add(models.Task(title=title, owner_id=1, deadline=deadline, status=status))
+    session.commit()
+
+
+def make_scheduler(async_session_factory, **kwargs):
+    batches = []
+
+    async def sink(events):
+        batches.append([(event["event"], event["title"]) for event in events])
+    options = {"due_soon_seconds": 600, "horizon_seconds": 3600} | kwargs
+    return DeadlineScheduler(async_session_factory, sink=sink, **options), batches
+
+
+def test_events_fire_once_in_deadline_order(session, async_session_factory):
+    add_tasks(session,
+              ("soon", NOW + timedelta(minutes=5), "new"),
+              ("later", NOW + timedelta(minutes=30), "new"),
+              ("done", NOW + timedelta(minutes=5), "completed"),
+              ("next window", NOW + timedelta(hours=3), "new"),
+              ("no deadline", None, "new"))
+    scheduler, batches = make_scheduler(async_session_factory)
+
+    async def scenario():
+        # "soon" уже ближе DUE_SOON_SECONDS: due_soon сразу, следующее событие это ее дедлайн
+        wake_at = await scheduler.run_once(NOW)
+        assert wake_at == NOW + timedelta(minutes=5)
+        assert await scheduler.run_once(NOW + timedelta(minutes=1)) == wake_at
+        # "later" станет истекающей через 20 минут
+        assert await scheduler.run_once(wake_at) == NOW + timedelta(minutes=20)
+        await scheduler.run_once(NOW + timedelta(minutes=31))
+    asyncio.run(scenario())
+    assert batches == [
+        [("due_soon", "soon")],
+        [("overdue", "soon")],
+        [("due_soon", "later"), ("overdue", "later")],
+    ]
+    assert scheduler.stats()["scheduled_tasks"] == 0
+    # выполненная задача и задачи за пределами окна в память не загружались
+    assert scheduler.window_loads == 1
+
+
+def test_owner_reload_picks_up_changes(session, async_session_factory):
+    add_tasks(session, ("moved", NOW + timedelta(minutes=30), "new"), ("deleted", NOW + timedelta(minutes=30), "new"))
+    scheduler, batches = make_scheduler(async_session_factory)
+
+    async def scenario():
+        await scheduler.run_once(NOW)
+        session.query(models.Task).filter_by(title="moved").update({"deadline": NOW + timedelta(minutes=50)})
+        session.query(models.Task).filter_by(title="deleted").delete()
+        session.add(models.Task(title="new", owner_id=1, deadline=NOW + timedelta(minutes=2)))
+        session.commit()
+        await scheduler.reload_owners({1})
+        await scheduler.run_once(NOW + timedelta(minutes=45))
+    asyncio.run(scenario())
+    # старые записи кучи для "moved" и "deleted" пропущены
+    assert batches == [[("due_soon", "new"), ("overdue", "new"), ("due_soon", "moved")]]
+
+
+def test_startup_catches_up_missed_deadlines(session, async_session_factory):
+    # пока процесс не работал, дедлайны прошли
+    add_tasks(session,
+              ("missed", NOW - timedelta(hours=2), "new"),
+              ("became soon", NOW + timedelta(minutes=5), "new"),
+              ("done", NOW - timedelta(hours=1), "completed"),
+              ("long ago", NOW - timedelta(days=3), "new"))
+    scheduler, batches = make_scheduler(async_session_factory, catchup_seconds=24 * 3600)
+    asyncio.run(scheduler.run_once(NOW))
+    # задача старше интервала догона и выполненная задача не оповещаются
+    assert batches == [[("due_soon", "missed"), ("overdue", "missed"), ("due_soon", "became soon")]]
+
+
+def test_events_delivered_in_batches(session, async_session_factory):
+    add_tasks(session, *[(f"t{i}", NOW + timedelta(minutes=1), "new") for i in range(5)])
+    scheduler, batches = make_scheduler(async_session_factory, batch_size=2)
+    asyncio.run(scheduler.run_once(NOW))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_events_kept_when_sink_fails(session, async_session_factory):
+    add_tasks(session, *[(f"t{i}", NOW + timedelta(minutes=1), "new") for i in range(5)])
+    delivered, calls = [], []
+
+    # вторая пачка не доставлена с первого раза
+    async def sink(events):
+        calls.append(events)
+        if len(calls) == 2:
+            raise ConnectionError("недоступен")
+        delivered.extend(event["title"] for event in events)
+    scheduler = DeadlineScheduler(async_session_factory, sink=sink, due_soon_seconds=600, horizon_seconds=3600,
+                                  batch_size=2)
+
+    async def scenario():
+        try:
+            await scheduler.run_once(NOW)
+            raise AssertionError("ошибка sink не передана")
+        except ConnectionError:
+            pass
+        assert delivered == ["t0", "t1"]
+        await scheduler.run_once(NOW + timedelta(seconds=5))
+    asyncio.run(scenario())
+    # t0 и t1 не повторяются, остальные доставлены при следующем проходе
+    assert delivered == ["t0", "t1", "t2", "t3", "t4"]
+    assert scheduler.stats()["due_soon_events"] == 5
+
+
+def test_run_wakes_on_deadline_and_on_changes(session, async_session_factory):
+    add_tasks(session, ("first", utcnow() + timedelta(seconds=0.3), "new"))
+    scheduler, batches = make_scheduler(async_session_factory, due_soon_seconds=0)
+
+    async def scenario():
+        stop = asyncio.Event()
+        runner = asyncio.create_task(scheduler.run(stop))
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if batches:
+                break
+        # новая задача будит планировщик раньше, чем наступит конец окна
+        session.add(models.Task(title="second", owner_id=1, deadline=utcnow() + timedelta(seconds=0.2)))
+        session.commit()
+        scheduler.owner_changed(1)
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if len(batches) > 1:
+                break
+        stop.set()
+        await runner
+    asyncio.run(scenario())
+    events = [event for batch in batches for event in batch]
+    assert ("overdue", "first") in events and ("overdue", "second") in events
+    # без опроса базы: окно загружено один раз, задачи пользователя перечитаны один раз
+    assert scheduler.window_loads == 1
+    assert scheduler.owner_reloads == 1
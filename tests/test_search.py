@@ -0,0 +1,76 @@
+from sqlalchemy import insert, update, delete
+from app import models
+
+
+def search(client, headers, q, **params):
+    return client.get("/tasks/search", params={"q": q, **params}, headers=headers)
+
+
+def add_tasks(client, headers, *tasks):
+    for title, description in tasks:
+        assert client.post("/tasks", json={"title": title, "description": description}, headers=headers).status_code == 200
+
+
+def titles(response):
+    assert response.status_code == 200, response.text
+    return [task["title"] for task in response.json()]
+
+
+def test_search_ranks_title_matches_first(client, user_token_headers):
+    add_tasks(client, user_token_headers,
+              ("Купить молоко", None),
+              ("Магазин", "купить хлеб и молоко"),
+              ("Отчет", "квартальный отчет для бухгалтерии"))
+    assert titles(search(client, user_token_headers, "молоко")) == ["Купить молоко", "Магазин"]
+    # все слова запроса должны найтись, регистр не важен
+    assert titles(search(client, user_token_headers, "КУПИТЬ хлеб")) == ["Магазин"]
+    # операторы FTS в запросе это обычные слова
+    assert titles(search(client, user_token_headers, "отчет OR молоко")) == []
+
+
+def test_search_prefix(client, user_token_headers):
+    add_tasks(client, user_token_headers, ("Квартальный отчет", None), ("Квартира", None), ("Отпуск", None))
+    assert sorted(titles(search(client, user_token_headers, "кварт*"))) == ["Квартальный отчет", "Квартира"]
+    assert titles(search(client, user_token_headers, "кварт")) == []
+
+
+def test_search_only_own_tasks(client, user_token_headers, created_task):
+    client.post("/users/", json={"email": "other@example.com", "password": "123"})
+    token = client.post("/users/token/", data={"username": "other@example.com", "password": "123"}).json()["access_token"]
+    other_headers = {"Authorization": f"Bearer {token}"}
+    add_tasks(client, other_headers, (created_task["title"], created_task["description"]))
+    response = search(client, user_token_headers, created_task["title"])
+    assert [task["id"] for task in response.json()] == [created_task["id"]]
+
+
+def test_search_index_follows_writes(client, session, user_token_headers, created_task):
+    client.patch(f"/tasks/{created_task['title']}", json={"description": "новое описание"}, headers=user_token_headers)
+    assert titles(search(client, user_token_headers, "новое")) == [created_task["title"]]
+    assert titles(search(client, user_token_headers, created_task["description"])) == []
+    # пакетные запросы Core тоже попадают в индекс: его обновляют триггеры базы
+    session.execute(insert(models.Task), [{"title": f"пакет {i}", "owner_id": 1} for i in range(3)])
+    session.execute(update(models.Task).where(models.Task.title == "пакет 0").values(title="переименована"))
+    session.execute(delete(models.Task).where(models.Task.title == "пакет 1"))
+    session.commit()
+    assert titles(search(client, user_token_headers, "пакет")) == ["пакет 2"]
+    assert titles(search(client, user_token_headers, "переименована")) == ["переименована"]
+    client.delete(f"/tasks/{created_task['title']}", headers=user_token_headers)
+    assert titles(search(client, user_token_headers, "новое")) == []
+
+
+def test_search_pagination(client, user_token_headers):
+    add_tasks(client, user_token_headers, *[(f"задача {i}", "общее слово" if i % 2 else None) for i in range(7)])
+    found, params = [], {"limit": 3}
+    while True:
+        response = search(client, user_token_headers, "задача", **params)
+        found += titles(response)
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert sorted(found) == [f"задача {i}" for i in range(7)]
+    assert len(found) == 7
+
+
+def test_search_bad_requests(client, user_token_headers):
+    assert search(client, user_token_headers, "!!! ???").status_code == 400
+    assert search(client, user_token_headers, "задача", cursor="не курсор").status_code == 400
@@ -0,0 +1,130 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import timedelta
+import httpx
+import pytest
+from app import models, schemas
+from app.cache import MemoryBackend, PrincipalCache
+from app.scheduler import DeadlineScheduler, OwnerChangePipe, utcnow
+
+fork = multiprocessing.get_context("fork")
+# к этим тестам в процессе pytest уже есть потоки (пулы предыдущих тестов), а дочерние
+# процессы здесь только пишут в общую память и pipe, поэтому предупреждение о fork не важно
+pytestmark = pytest.mark.filterwarnings("ignore:This process .* is multi-threaded:DeprecationWarning")
+
+
+def in_child_process(fn):
+    process = fork.Process(target=fn)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+
+def test_cache_versions_shared_between_processes():
+    backend = MemoryBackend()
+    backend.share_versions(slots=16)
+    in_child_process(lambda: asyncio.run(backend.bump(5)))
+
+    async def versions():
+        return [await backend.version(owner_id) for owner_id in (5, 21, 6)]
+    # 21 попадает в ту же ячейку, что и 5: лишний промах кэша, но не устаревший ответ
+    assert asyncio.run(versions()) == [1, 1, 0]
+
+
+def test_user_invalidation_shared_between_processes():
+    cache = PrincipalCache()
+    cache.share_versions(slots=16)
+    for user_id in (5, 6):
+        cache.set(f"user{user_id}@example.com", schemas.CurrentUser(id=user_id, email=f"user{user_id}@example.com",
+                                                                       is_active=True))
+    # пользователя 5 деактивировали через другой процесс API
+    in_child_process(lambda: cache.invalidate("user5@example.com", 5))
+    assert cache.get("user5@example.com") is None
+    assert cache.get("user6@example.com").id == 6
+
+
+def test_scheduler_receives_changes_from_other_processes(session, async_session_factory):
+    session.add(models.User(email="owner@example.com", hashed_password="x"))
+    session.commit()
+    pipe = OwnerChangePipe()
+    scheduler = DeadlineScheduler(async_session_factory, sink=lambda events: asyncio.sleep(0), due_soon_seconds=0)
+    scheduler.remote = pipe
+
+    async def scenario():
+        stop = asyncio.Event()
+        runner = asyncio.create_task(scheduler.run(stop))
+        await asyncio.sleep(0.05)
+        session.add(models.Task(title="from other process", owner_id=1, deadline=utcnow() + timedelta(minutes=5)))
+        session.commit()
+        # в другом процессе планировщик не запущен, и изменение уходит в pipe
+        other = DeadlineScheduler(async_session_factory)
+        other.remote = pipe
+        in_child_process(lambda: other.owner_changed(1))
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if scheduler.stats()["scheduled_tasks"]:
+                break
+        stop.set()
+        await runner
+    asyncio.run(scenario())
+    assert scheduler.owner_reloads == 1
+    assert scheduler.stats()["scheduled_tasks"] == 1
+
+
+def test_owner_change_pipe_overflow():
+    pipe = OwnerChangePipe()
+    sent = 0
+    # pipe заполнен: send не блокирует процесс API, а отмечает переполнение
+    while pipe._overflows.value == 0:
+        pipe.send(sent)
+        sent += 1
+    owners, overflowed = pipe.receive()
+    assert overflowed and len(owners) == sent - 1
+    assert pipe.receive() == (set(), False)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_server_drains_requests_on_sigterm(engine, database_url):
+    port = free_port()
+    # bcrypt с большой стоимостью: регистрация идет дольше секунды и еще не закончена к SIGTERM
+    env = {**os.environ, "DATABASE_URL": database_url, "BCRYPT_ROUNDS": "14", "LOG_LEVEL": "WARNING"}
+    server = subprocess.Popen([sys.executable, "-m", "app.server", "--workers", "2", "--host", "127.0.0.1",
+                               "--port", str(port)], env=env)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        for _ in range(200):
+            try:
+                if httpx.get(f"{base_url}/metrics").status_code == 200:
+                    break
+            except httpx.TransportError:
+                time.sleep(0.05)
+        result = {}
+        request = threading.Thread(target=lambda: result.update(response=httpx.post(
+            f"{base_url}/users/", json={"email": "slow@example.com", "password": "123"}, timeout=30)))
+        request.start()
+        time.sleep(0.3)
+        server.send_signal(signal.SIGTERM)
+        request.join()
+        assert server.wait(timeout=30) == 0
+        assert result["response"].status_code == 200
+        # после остановки новые соединения не принимаются
+        try:
+            httpx.get(f"{base_url}/metrics")
+            raise AssertionError("сервер все еще принимает соединения")
+        except httpx.ConnectError:
+            pass
+    finally:
+        if server.poll() is None:
+            server.kill()
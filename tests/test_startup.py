@@ -0,0 +1,45 @@
+# Время импорта app.main: его платит каждый запуск процесса API, CLI и прогона тестов.
+# Числа берутся из python -X importtime в отдельном процессе, где app еще не импортирован.
+import os
+import subprocess
+import sys
+
+# собственные модули app без библиотек (FastAPI, SQLAlchemy, pydantic), мс
+APP_IMPORT_BUDGET_MS = float(os.getenv("APP_IMPORT_BUDGET_MS", "250"))
+# весь импорт app.main вместе с библиотеками, мс
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "2500"))
+# библиотеки токенов и паролей загружаются при первом использовании (app.auth), а не при импорте
+LAZY_MODULES = ["jose", "bcrypt"]
+
+
+def import_times(code: str = "import app.main", **env) -> dict[str, tuple[int, int]]:
+    command = [sys.executable, "-X", "importtime", "-c", code]
+    env = {**os.environ, **env}
+    # первый запуск записывает .pyc, его время компиляции не считаем
+    subprocess.run(command, capture_output=True, check=True, env=env)
+    stderr = subprocess.run(command, capture_output=True, text=True, check=True, env=env).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "self [us]" not in line:
+            self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+            times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def test_import_budget():
+    times = import_times()
+    app_ms = sum(self_us for name, (self_us, _) in times.items() if name == "app" or name.startswith("app.")) / 1000
+    total_ms = times["app.main"][1] / 1000
+    assert app_ms <= APP_IMPORT_BUDGET_MS, f"модули app импортируются {app_ms:.0f} ms"
+    assert total_ms <= IMPORT_BUDGET_MS, f"import app.main занимает {total_ms:.0f} ms"
+    assert [name for name in LAZY_MODULES if name in times] == []
+
+
+def test_import_has_no_side_effects():
+    # логи настраивает lifespan: при импорте нет ни обработчиков, ни потока записи логов
+    code = ("import logging, threading, app.main; "
+            "assert not logging.getLogger().handlers, logging.getLogger().handlers; "
+            "assert threading.active_count() == 1, threading.enumerate()")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            env={**os.environ, "LOG_MODE": "production"})
+    assert result.returncode == 0, result.stderr
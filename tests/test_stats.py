@@ -0,0 +1,85 @@
+from datetime import timedelta
+from sqlalchemy import insert, update, delete, text
+from app import models, stats
+from app.scheduler import utcnow
+
+
+def get_stats(client, headers):
+    response = client.get("/tasks/stats", headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_stats_follow_writes(client, session, user_token_headers, created_task):
+    client.post("/tasks", json={"title": "вторая", "priority": "low"}, headers=user_token_headers)
+    client.patch(f"/tasks/{created_task['title']}", json={"status": "completed"}, headers=user_token_headers)
+    assert get_stats(client, user_token_headers) == {
+        "total": 2,
+        "by_status": {"new": 1, "in progress": 0, "completed": 1},
+        "by_priority": {"low": 1, "medium": 0, "high": 1},
+        "overdue": 0,
+    }
+    client.delete("/tasks/вторая", headers=user_token_headers)
+    # пакетные запросы Core тоже учитываются: счетчики обновляют триггеры базы
+    session.execute(insert(models.Task), [{"title": f"пакет {i}", "owner_id": 1} for i in range(3)])
+    session.execute(update(models.Task).where(models.Task.title == "пакет 0").values(status="in progress"))
+    session.execute(delete(models.Task).where(models.Task.title == "пакет 1"))
+    session.commit()
+    result = get_stats(client, user_token_headers)
+    assert result["total"] == 3
+    assert result["by_status"] == {"new": 1, "in progress": 1, "completed": 1}
+    assert result["by_priority"] == {"low": 0, "medium": 2, "high": 1}
+
+
+def test_stats_overdue(client, session, user_token_headers):
+    now = utcnow()
+    session.execute(insert(models.Task), [
+        {"title": "просрочена", "owner_id": 1, "deadline": now - timedelta(hours=1)},
+        {"title": "выполнена", "owner_id": 1, "deadline": now - timedelta(hours=1), "status": "completed"},
+        {"title": "завтра", "owner_id": 1, "deadline": now + timedelta(days=1)},
+        {"title": "без дедлайна", "owner_id": 1},
+    ])
+    session.commit()
+    assert get_stats(client, user_token_headers)["overdue"] == 1
+
+
+def test_tasks_without_owner_are_not_counted(client, engine, session, user_token_headers):
+    # задачи без владельца (из старых версий) не ломают триггеры
+    session.execute(insert(models.Task), [{"title": "ничья"}, {"title": "тоже ничья"}])
+    session.execute(update(models.Task).where(models.Task.title == "ничья").values(owner_id=1))
+    session.execute(update(models.Task).where(models.Task.title == "тоже ничья").values(status="completed"))
+    session.commit()
+    assert get_stats(client, user_token_headers)["total"] == 1
+    with engine.connect() as conn:
+        assert stats.check(conn) == []
+    session.execute(update(models.Task).where(models.Task.title == "ничья").values(owner_id=None))
+    session.execute(delete(models.Task))
+    session.commit()
+    with engine.connect() as conn:
+        assert stats.check(conn) == []
+
+
+def test_stats_only_own_tasks(client, user_token_headers, created_task):
+    client.post("/users/", json={"email": "other@example.com", "password": "123"})
+    token = client.post("/users/token/", data={"username": "other@example.com", "password": "123"}).json()["access_token"]
+    assert get_stats(client, {"Authorization": f"Bearer {token}"})["total"] == 0
+
+
+def test_stats_check_and_rebuild(engine, session, user_token_headers, created_task, capsys):
+    assert stats.main(["check"], engine=engine) == 0
+    session.execute(text("UPDATE task_stats SET count = 5"))
+    session.execute(text("INSERT INTO task_stats (owner_id, status, priority, count) VALUES (1, 'new', 'low', 2)"))
+    session.commit()
+    with engine.connect() as conn:
+        assert sorted(stats.check(conn)) == [(1, "new", "high", 5, 1), (1, "new", "low", 2, 0)]
+    assert stats.main(["check"], engine=engine) == 1
+    assert "расхождений: 2" in capsys.readouterr().out
+    assert stats.main(["rebuild"], engine=engine) == 0
+    assert stats.main(["check"], engine=engine) == 0
+
+
+def test_stats_do_not_group_tasks(client, user_token_headers, created_task, sql_statements):
+    sql_statements.clear()
+    get_stats(client, user_token_headers)
+    assert sql_statements
+    assert not any("GROUP BY" in statement for statement, _ in sql_statements)